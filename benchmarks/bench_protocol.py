@@ -0,0 +1,286 @@
+"""
+benchmarks/bench_protocol.py - Đo chi phí mỗi frame của Protocol (encode/decode/send/recv)
+
+Chạy từ thư mục gốc:
+    python benchmarks/bench_protocol.py                     # in bảng kết quả
+    python benchmarks/bench_protocol.py --save baseline     # lưu benchmarks/baselines/baseline.json
+    python benchmarks/bench_protocol.py --compare baseline  # so với baseline đã lưu
+    python benchmarks/bench_protocol.py --wire legacy --quick
+
+Mỗi workload (text nhỏ, LIST_USERS 1k-50k user, video 20 KB, audio PCM) được đo:
+- encode: Protocol.encode_message / FrameEncoder (in-memory)
+- decode: FrameDecoder trên buffer in-memory (giống luồng nhận thật)
+- socket: send_message + recv_message qua socketpair (lock-step, 1 frame 1 lượt)
+Kết quả: frames/s, MB/s, p50/p99 latency (µs), bộ nhớ cấp phát đỉnh mỗi frame (tracemalloc).
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import queue
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+# Setup đường dẫn import để chạy từ thư mục gốc
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from common.protocol import Protocol, MessageType, FEATURES, PROTOCOL_VERSION
+from common.codecs import CODECS
+from common.connection import Connection
+from common.framing import FrameDecoder
+
+BASELINE_DIR = os.path.join(current_dir, "baselines")
+
+# Wire format được đo:
+# - legacy: client/server cũ (socket thường, JSON, media Base64)
+# - session: phiên thương lượng đầy đủ (codec tốt nhất, binary, deflate)
+WIRES = ("legacy", "session")
+
+
+# --- WORKLOADS ---
+
+def _user_list(n):
+    return {"users": [f"user_{i:05d}" for i in range(n)], "web_users": []}
+
+
+def make_workloads(quick=False):
+    """(name, msg_type, data, số frame đo) - dữ liệu giống thật, tạo sẵn trước khi đo"""
+    jpeg = os.urandom(20 * 1024)      # JPEG đã nén -> gần như ngẫu nhiên
+    pcm = os.urandom(4096)            # 1 chunk audio (CHUNK=1024, paInt16, 2 kênh)
+    scale = 0.2 if quick else 1
+    workloads = [
+        ("text_small", MessageType.TEXT,
+         {"sender": "alice", "recipient": None, "message": "Xin chào mọi người!"}, 20000),
+        ("list_users_1k", MessageType.LIST_USERS, _user_list(1000), 500),
+        ("list_users_10k", MessageType.LIST_USERS, _user_list(10000), 50),
+        ("list_users_50k", MessageType.LIST_USERS, _user_list(50000), 10),
+        ("video_20kb", MessageType.VIDEO_DATA,
+         {"sender": "alice", "recipient": "bob", "data": jpeg}, 2000),
+        ("audio_chunk", MessageType.AUDIO_DATA,
+         {"sender": "alice", "recipient": "bob", "data": pcm}, 5000),
+    ]
+    return [(name, t, d, max(5, int(n * scale))) for name, t, d, n in workloads]
+
+
+def session_for(wire):
+    if wire == "legacy":
+        return {"version": 1, "codec": "json", "features": []}
+    return {"version": PROTOCOL_VERSION, "codec": next(iter(CODECS)), "features": sorted(FEATURES)}
+
+
+def legacy_data(msg_type, data):
+    """Client cũ gửi media dạng Base64 trong JSON"""
+    if Protocol.is_binary(msg_type, data):
+        return {**data, "data": base64.b64encode(data["data"]).decode("utf-8")}
+    return data
+
+
+# --- ĐO ---
+
+def _summary(samples, nbytes, alloc):
+    total = sum(samples)
+    samples = sorted(samples)
+    return {
+        "frames": len(samples),
+        "frames_per_s": round(len(samples) / total, 1) if total else None,
+        "mb_per_s": round(nbytes * len(samples) / total / 1e6, 2) if total else None,
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 2),
+        "frame_bytes": nbytes,
+        "alloc_peak_bytes": alloc,
+    }
+
+
+def _measure(op, count):
+    """Gọi op() count lần, trả về danh sách thời gian mỗi lần (giây)"""
+    clock = time.perf_counter
+    samples = []
+    for _ in range(count):
+        t0 = clock()
+        op()
+        samples.append(clock() - t0)
+    return samples
+
+
+def _alloc_peak(op, count=20):
+    """Bộ nhớ cấp phát đỉnh trung bình cho 1 lần op() (đo riêng, tracemalloc làm chậm)"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(count):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            op()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return int(statistics.mean(peaks))
+
+
+def bench_encode(wire, msg_type, data, count):
+    if wire == "legacy":
+        payload = legacy_data(msg_type, data)
+        op = lambda: Protocol.encode_message(msg_type, payload, binary=False)
+        frame = op()
+    else:
+        # Encoder của phiên thật (kể cả deflate); MB/s tính theo frame chưa nén
+        conn = Connection(socket.socket())
+        conn.bind_session(session_for(wire))
+        conn.close()
+        op = lambda: conn.encoder.encode(msg_type, data)
+        frame = Protocol.encode_message(msg_type, data, codec=conn.codec, binary=conn.supports_binary)
+    return _summary(_measure(op, count), len(frame), _alloc_peak(op))
+
+
+def bench_decode(wire, msg_type, data, count):
+    session = session_for(wire)
+    payload = legacy_data(msg_type, data) if wire == "legacy" else data
+    conn = Connection(socket.socket())
+    conn.bind_session(session)
+    conn.close()
+    # Không nén để mỗi frame decode độc lập (deflate cần đúng thứ tự frame)
+    frame = Protocol.encode_message(msg_type, payload, codec=conn.codec, binary=conn.supports_binary)
+    decoder = FrameDecoder(codec=conn.codec)
+
+    op = lambda: decoder.feed(frame)
+    return _summary(_measure(op, count), len(frame), _alloc_peak(op))
+
+
+def bench_socket(wire, msg_type, data, count):
+    """send_message -> recv_message qua socketpair; luồng đọc riêng để frame lớn không kẹt buffer"""
+    a, b = socket.socketpair()
+    if wire == "legacy":
+        sender, receiver = a, b
+        payload = legacy_data(msg_type, data)
+    else:
+        sender, receiver = Connection(a), Connection(b)
+        for conn in (sender, receiver):
+            conn.bind_session(session_for(wire))
+        payload = data
+
+    # MB/s tính theo frame chưa nén
+    if wire == "legacy":
+        frame_bytes = len(Protocol.encode_message(msg_type, payload, binary=False))
+    else:
+        frame_bytes = len(Protocol.encode_message(msg_type, payload, codec=sender.codec, binary=sender.supports_binary))
+
+    done = queue.Queue()
+
+    def reader():
+        while True:
+            got, _ = Protocol.recv_message(receiver)
+            if got is None:
+                return
+            done.put(True)
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    def op():
+        Protocol.send_message(sender, msg_type, payload)
+        done.get()
+    try:
+        op()  # warm-up
+        samples = _measure(op, count)
+        alloc = _alloc_peak(op)
+    finally:
+        sender.close()
+        thread.join(timeout=5)
+        receiver.close()
+    return _summary(samples, frame_bytes, alloc)
+
+
+BENCHES = {"encode": bench_encode, "decode": bench_decode, "socket": bench_socket}
+
+
+def run(wires, quick=False, only=None):
+    results = {}
+    for wire in wires:
+        for name, msg_type, data, count in make_workloads(quick):
+            if only and only not in name:
+                continue
+            for bench_name, bench in BENCHES.items():
+                key = f"{wire}/{name}/{bench_name}"
+                results[key] = bench(wire, msg_type, data, count)
+                r = results[key]
+                print(f"  {key:<38} {r['frames_per_s']:>11,.0f} f/s {r['mb_per_s']:>9.2f} MB/s "
+                      f"p50 {r['p50_us']:>10.1f}µs p99 {r['p99_us']:>10.1f}µs "
+                      f"alloc {r['alloc_peak_bytes']:>10,}B")
+    return results
+
+
+# --- BASELINE ---
+
+def _baseline_path(name):
+    if name.endswith(".json") or os.sep in name:
+        return name
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = _baseline_path(name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "codecs": list(CODECS),
+            },
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+    print(f"💾 Đã lưu baseline: {path}")
+
+
+def compare(name, results):
+    """In chênh lệch frames/s, p99 và bộ nhớ so với baseline (dương = tốt hơn với f/s)"""
+    with open(_baseline_path(name), encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    def delta(new, old):
+        if not old or new is None:
+            return "      n/a"
+        return f"{(new - old) / old * 100:+8.1f}%"
+
+    print(f"\n📊 So với baseline '{name}':")
+    print(f"  {'benchmark':<38} {'frames/s':>9} {'p99':>9} {'alloc':>9}")
+    for key, r in results.items():
+        old = baseline.get(key)
+        if old is None:
+            print(f"  {key:<38} (mới)")
+            continue
+        print(f"  {key:<38} {delta(r['frames_per_s'], old['frames_per_s'])} "
+              f"{delta(r['p99_us'], old['p99_us'])} "
+              f"{delta(r['alloc_peak_bytes'], old['alloc_peak_bytes'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark cho Protocol")
+    parser.add_argument("--wire", choices=WIRES, action="append", help="Wire format cần đo (mặc định: tất cả)")
+    parser.add_argument("--only", help="Chỉ chạy workload có tên chứa chuỗi này (vd: list_users)")
+    parser.add_argument("--quick", action="store_true", help="Giảm số frame đo (chạy nhanh)")
+    parser.add_argument("--save", metavar="NAME", help="Lưu kết quả thành baseline")
+    parser.add_argument("--compare", metavar="NAME", help="So sánh với baseline đã lưu")
+    args = parser.parse_args(argv)
+
+    print(f"🏁 Protocol benchmark - Python {platform.python_version()}, codecs: {', '.join(CODECS)}")
+    results = run(args.wire or WIRES, quick=args.quick, only=args.only)
+
+    if args.compare:
+        compare(args.compare, results)
+    if args.save:
+        save_baseline(args.save, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+client/bitrate.py - Tự điều chỉnh độ phân giải / chất lượng JPEG / fps của video gọi điện
+
+Đi theo các bậc VIDEO_LADDER, dựa trên 3 tín hiệu nghẽn:
+  - hàng đợi gửi của chính mình: byte chờ gửi vượt ABR_QUEUE_HIGH, hoặc frame video chưa kịp
+    gửi đã bị frame mới thay (media_dropped tăng)
+  - RTT: client PING server mỗi ABR_PROBE_INTERVAL giây (server trả PONG cùng "ts" ->
+    Connection.rtt), nghẽn khi RTT cao hơn RTT thấp nhất đã đo quá ABR_RTT_RISE
+  - MEDIA_FEEDBACK: server báo người nhận chậm, đã bỏ frame mình gửi
+Nghẽn -> giảm 1 bậc ngay (tối đa 1 bậc / ABR_DOWN_HOLD giây);
+ổn định liên tục ABR_UP_HOLD giây -> tăng 1 bậc. Giảm nhanh tăng chậm: không dồn hàng đợi
+nhiều giây trên đường truyền chậm, cũng không nhảy lên xuống liên tục.
+"""
+
+import threading
+import time
+
+from common.config import (
+    VIDEO_LADDER, VIDEO_LADDER_START, ABR_QUEUE_HIGH, ABR_RTT_RISE,
+    ABR_PROBE_INTERVAL, ABR_DOWN_HOLD, ABR_UP_HOLD,
+)
+from common.protocol import Protocol, MessageType
+
+
+class BitrateController:
+    """
+    client: có .socket (Connection, có thể bị thay khi resume).
+    step() -> (rộng, cao, quality, fps) cho frame kế tiếp; gọi mỗi lần gửi 1 frame.
+    on_feedback(data): MEDIA_FEEDBACK từ server (gọi từ luồng nhận).
+    take_loss(): có frame video bị bỏ kể từ lần hỏi trước (TileEncoder cần gửi lại keyframe).
+    """
+
+    def __init__(self, client, ladder=VIDEO_LADDER, start=VIDEO_LADDER_START):
+        self.client = client
+        self.ladder = ladder
+        self.level = min(start, len(ladder) - 1)
+        self.min_rtt = None
+        self._peer_dropped = 0
+        self._own_dropped = None
+        self._lost = False
+        self._lock = threading.Lock()
+
+        now = time.monotonic()
+        self._stable_since = now
+        self._last_down = 0.0
+        self._last_probe = 0.0
+
+    def on_feedback(self, data):
+        with self._lock:
+            self._peer_dropped += data.get("video_dropped", 0) or 0
+
+    def step(self):
+        now = time.monotonic()
+        connection = self.client.socket
+        if connection is not None and now - self._last_probe >= ABR_PROBE_INTERVAL:
+            self._last_probe = now
+            Protocol.send_message(connection, MessageType.PING, {"ts": now})
+
+        reason = self._congestion(connection)
+        if reason is not None:
+            self._stable_since = now
+            if self.level > 0 and now - self._last_down >= ABR_DOWN_HOLD:
+                self._last_down = now
+                self._set_level(self.level - 1, reason)
+        elif now - self._stable_since >= ABR_UP_HOLD:
+            self._stable_since = now
+            if self.level < len(self.ladder) - 1:
+                self._set_level(self.level + 1, "ổn định")
+        return self.ladder[self.level]
+
+    def _congestion(self, connection):
+        """Lý do nghẽn (để log), None nếu không nghẽn"""
+        with self._lock:
+            peer_dropped, self._peer_dropped = self._peer_dropped, 0
+        if peer_dropped:
+            self._lost = True
+            return f"người nhận bỏ {peer_dropped} frame"
+        if connection is None:
+            return None
+
+        stats = connection.outbound_stats()
+        own_dropped, self._own_dropped = self._own_dropped, stats["media_dropped"]
+        if own_dropped is not None and stats["media_dropped"] > own_dropped:
+            self._lost = True
+            return "gửi không kịp"
+        if stats["bytes"] > ABR_QUEUE_HIGH:
+            return f"hàng đợi {stats['bytes'] // 1024}KB"
+
+        rtt = getattr(connection, "rtt", None)
+        if rtt is None:
+            return None
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        if rtt - self.min_rtt > ABR_RTT_RISE:
+            return f"RTT {rtt * 1000:.0f}ms"
+        return None
+
+    def take_loss(self):
+        lost, self._lost = self._lost, False
+        return lost
+
+    def _set_level(self, level, reason):
+        self.level = level
+        width, height, quality, fps = self.ladder[level]
+        print(f"🎚️ Video {width}x{height} q{quality} {fps}fps ({reason})")
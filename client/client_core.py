@@ -8,12 +8,14 @@ import os
 from tkinter import Tk
 
 from common.protocol import Protocol, MessageType
+from common.connection import Connection
 from common.config import CLIENT_DOWNLOAD_DIR, SOCKET_TIMEOUT, Colors
 from client.ui.login_ui import LoginUI
 from client.ui.chat_ui import ChatUI
 from client.handlers.message_handler import MessageHandler
 from client.handlers.file_handler import FileHandler
 from client.handlers.call_handler import CallHandler
+from client.handlers.session_handler import SessionHandler
 
 class ChatClient:
     def __init__(self):
@@ -25,8 +27,10 @@ class ChatClient:
         
         # Socket và connection
         self.socket = None
+        self.server_address = None
         self.username = None
         self.connected = False
+        self.is_running = True
         self.receive_thread = None
         
         # Event và flags cho file upload/download
@@ -36,6 +40,8 @@ class ChatClient:
         
         # Data - LƯU TẤT CẢ MESSAGES
         self.users = []
+        self.presence_version = None  # version của danh sách users (delta presence)
+        self.reconnect_after = 0  # Giây chờ trước khi kết nối lại (SERVER_DRAIN)
         self.messages = []  # Lưu tất cả messages (group + private)
         
         # Current call
@@ -56,6 +62,7 @@ class ChatClient:
         self.message_handler = MessageHandler(self)
         self.file_handler = FileHandler(self)
         self.call_handler = CallHandler(self)
+        self.session_handler = SessionHandler(self)
         
         # Setup initial UI
         self.setup_login_ui()
@@ -91,16 +98,17 @@ class ChatClient:
                 port = 5555
             
             # Kết nối
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket = Connection(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
             self.socket.settimeout(SOCKET_TIMEOUT)
             self.socket.connect((host, port))
             self.socket.settimeout(None)
+            self.server_address = (host, port)
             
             # Gửi LOGIN
             Protocol.send_message(
                 self.socket,
                 MessageType.LOGIN,
-                {"username": username}
+                {"username": username, **Protocol.handshake_offer()}
             )
             
             # Nhận response
@@ -111,6 +119,8 @@ class ChatClient:
                 return False, data.get("message", "Đăng nhập thất bại!")
             
             elif msg_type == MessageType.LOGIN_SUCCESS:
+                # Gắn codec/features server đã chọn (server cũ -> v1 + JSON)
+                self.session_handler.bind(self.socket, data)
                 self.username = username
                 self.connected = True
                 
@@ -138,6 +148,8 @@ class ChatClient:
                 
                 if msg_type is None:
                     self.connected = False
+                    if self._resume_session():
+                        continue
                     self.root.after(0, self.message_handler.show_system_message,
                                    "❌ Mất kết nối với server!")
                     break
@@ -149,10 +161,28 @@ class ChatClient:
                 if self.connected:
                     print(f"Error receiving: {e}")
                     self.connected = False
+                    if self._resume_session():
+                        continue
                     self.root.after(0, self.message_handler.show_system_message,
                                    "❌ Lỗi luồng nhận dữ liệu.")
                     break
     
+    def _resume_session(self):
+        """Thử resume phiên cũ (server hỗ trợ "resume") trước khi báo mất kết nối"""
+        if not self.is_running or not self.socket or not self.socket.session_id:
+            return False
+        try:
+            self.socket.close()
+        except:
+            pass
+        self.root.after(0, self.message_handler.show_system_message,
+                       "🔁 Mất kết nối, đang kết nối lại...")
+        if self.session_handler.try_resume():
+            self.root.after(0, self.message_handler.show_system_message,
+                           "✅ Đã kết nối lại server!")
+            return True
+        return False
+    
     def send_text_message(self, message, recipient=None):
         """Gửi tin nhắn text (group hoặc private)"""
         try:
@@ -176,6 +206,7 @@ class ChatClient:
     
     def on_closing(self):
         """Xử lý khi đóng app"""
+        self.is_running = False
         if self.connected:
             try:
                 self.socket.close()
@@ -1,10 +1,11 @@
 import threading
 import time
-import base64
 import tkinter as tk
 from tkinter import Toplevel, Label, Button, messagebox
 from PIL import Image, ImageTk
 from common.protocol import Protocol, MessageType
+from client.bitrate import BitrateController
+from client.tiles import TileEncoder
 
 # Cố gắng import OpenCV
 try:
@@ -21,6 +22,8 @@ class CallHandler:
         self.video_window = None
         self.peer_name = None
         self.stop_event = threading.Event()
+        self.bitrate = None
+        self.tile_encoder = None
 
     # ==================================================================
     # [FIX] THÊM HÀM NÀY ĐỂ UI GỌI ĐƯỢC
@@ -122,6 +125,9 @@ class CallHandler:
         self.in_call = True
         self.peer_name = peer_name
         self.stop_event.clear()
+        self.bitrate = BitrateController(self.client)
+        # Cửa sổ này không hiển thị video của peer (không ghép được delta): chỉ bỏ frame tĩnh
+        self.tile_encoder = TileEncoder(announce=False)
 
         # Mở cửa sổ hiển thị video
         self._open_video_window()
@@ -162,28 +168,31 @@ class CallHandler:
             
             ret, frame = self.cap.read()
             if not ret: break
+            width, height, quality, fps = self.bitrate.step()
 
-            # 1. Resize ảnh nhỏ lại để gửi nhanh hơn (320x240)
-            frame_resized = cv2.resize(frame, (320, 240))
+            # 1. Resize theo bậc hiện tại (mạng nghẽn thì nhỏ lại)
+            frame_resized = cv2.resize(frame, (width, height))
 
             # 2. Lật ngược ảnh cho giống gương (Mirror)
             frame_resized = cv2.flip(frame_resized, 1)
 
-            # 3. Nén ảnh thành JPEG -> Chuyển sang Base64
-            _, buffer = cv2.imencode('.jpg', frame_resized, [int(cv2.IMWRITE_JPEG_QUALITY), 60])
-            jpg_as_text = base64.b64encode(buffer).decode('utf-8')
+            # 3. Nén ảnh thành JPEG (gửi raw bytes qua binary frame, không Base64), hình không đổi thì bỏ qua
+            if self.bitrate.take_loss():
+                self.tile_encoder.force_keyframe()
+            payload = self.tile_encoder.encode(frame_resized, quality)
 
             # 4. Gửi dữ liệu qua Server
             try:
-                Protocol.send_message(
-                    self.client.socket,
-                    MessageType.VIDEO_DATA,
-                    {
-                        "recipient": self.peer_name,
-                        "data": jpg_as_text,
-                        "sender": self.client.username
-                    }
-                )
+                if payload is not None:
+                    Protocol.send_message(
+                        self.client.socket,
+                        MessageType.VIDEO_DATA,
+                        {
+                            "recipient": self.peer_name,
+                            "data": payload,
+                            "sender": self.client.username
+                        }
+                    )
             except Exception as e:
                 print(f"Lỗi gửi video: {e}")
                 break
@@ -191,8 +200,8 @@ class CallHandler:
             # 5. Hiển thị lên màn hình của mình
             self._update_local_preview(frame_resized)
             
-            # Giới hạn tốc độ gửi (khoảng 20 FPS)
-            time.sleep(0.05)
+            # Giới hạn tốc độ gửi theo fps của bậc hiện tại
+            time.sleep(1 / fps)
 
     def _update_local_preview(self, frame):
         """Vẽ hình ảnh lên cửa sổ Tkinter"""
@@ -210,6 +219,16 @@ class CallHandler:
             self.lbl_local.imgtk = imgtk # Giữ tham chiếu để không bị Garbage Collected
             self.lbl_local.configure(image=imgtk)
 
+    def on_media_feedback(self, data):
+        """Server báo peer nhận chậm -> giảm chất lượng video gửi đi"""
+        if self.bitrate is not None:
+            self.bitrate.on_feedback(data)
+
+    def on_keyframe_request(self, data):
+        """Peer xin keyframe -> frame kế tiếp gửi nguyên"""
+        if self.tile_encoder is not None:
+            self.tile_encoder.force_keyframe()
+
     def request_end_call(self):
         """Người dùng chủ động bấm nút Tắt"""
         if self.peer_name:
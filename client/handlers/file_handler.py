@@ -31,6 +31,7 @@ class UploadSession:
         self.cancelled = False
         self.sent_bytes = 0
         self.is_running = False
+        self.channel = None  # Channel ID của upload này (None = kiểu cũ, raw bytes)
 
     def is_connected(self):
         return getattr(self.client, 'connected', False) and self.client.socket
@@ -50,26 +51,47 @@ class UploadSession:
         self.cancelled = True
         self.is_running = False
 
+    def _send_chunk(self, chunk):
+        """Gửi 1 chunk: FILE_CHUNK trên channel riêng (server mới) hoặc raw bytes (server cũ)"""
+        if self.channel:
+            # Protocol.send_message tự chặn khi channel đầy -> không dồn cả file vào RAM
+            if not Protocol.send_message(self.client.socket, MessageType.FILE_CHUNK,
+                                         {"channel": self.channel, "data": chunk}):
+                raise OSError("Mất kết nối khi gửi file")
+            return
+        self.client.socket.sendall(chunk)
+
+    def _abort_on_server(self):
+        """Báo server huỷ upload trên channel (server cũ không hỗ trợ huỷ)"""
+        if self.channel and self.is_connected():
+            Protocol.send_message(self.client.socket, MessageType.FILE_ERROR,
+                                  {"channel": self.channel, "message": "cancelled"})
+
     def _run(self):
         try:
             if not self.is_connected(): return 
 
+            # Server hỗ trợ channel -> file đi thành FILE_CHUNK xen kẽ với tin nhắn chat
+            self.channel = None
+            if getattr(self.client.socket, "supports_channels", False):
+                self.channel = self.client.socket.open_channel()
+
             # 1. Gửi Header
+            header = {
+                "filename": self.filename,
+                "filesize": self.filesize,
+                "recipient": self.recipient,
+                "sender": self.client.username
+            }
+            if self.channel:
+                header["channel"] = self.channel
             try:
-                Protocol.send_message(
-                    self.client.socket,
-                    MessageType.FILE_UPLOAD,
-                    {
-                        "filename": self.filename,
-                        "filesize": self.filesize,
-                        "recipient": self.recipient,
-                        "sender": self.client.username
-                    }
-                )
+                Protocol.send_message(self.client.socket, MessageType.FILE_UPLOAD, header)
             except Exception:
                 return
 
-            time.sleep(0.5) # Đợi server xử lý header
+            if not self.channel:
+                time.sleep(0.5) # Đợi server xử lý header
 
             # 2. Gửi Data
             with open(self.file_path, "rb") as f:
@@ -81,13 +103,16 @@ class UploadSession:
                     # Check Cancel
                     if self.cancelled: 
                         print(f"❌ Upload cancelled: {self.filename}")
+                        self._abort_on_server()
                         return 
 
                     if not self.is_connected(): return
                     
                     # Check Pause
                     while self.paused:
-                        if self.cancelled: return
+                        if self.cancelled:
+                            self._abort_on_server()
+                            return
                         time.sleep(0.1)
 
                     start_time = time.time()
@@ -96,9 +121,9 @@ class UploadSession:
                     if not chunk: break
                     
                     try:
-                        self.client.socket.sendall(chunk)
+                        self._send_chunk(chunk)
                     except OSError as e:
-                        if e.winerror in [10038, 10054, 10053] or e.errno == 9: 
+                        if getattr(e, "winerror", None) in [10038, 10054, 10053] or e.errno == 9 or self.channel:
                             return
                         raise e 
 
@@ -1,5 +1,5 @@
 from tkinter import messagebox
-from common.protocol import MessageType
+from common.protocol import Protocol, MessageType
 from client.ui.message_ui import MessageUI
 from client.ui.chat_ui import ChatUI # Import ChatUI để chuyển màn hình
 
@@ -15,6 +15,8 @@ class MessageHandler:
         # --- 1. XỬ LÝ ĐĂNG NHẬP ---
         if msg_type == MessageType.LOGIN_SUCCESS:
             print("✅ Login Success -> Switching UI")
+            # Gắn codec/features ngay trên luồng nhận, trước khi đọc frame tiếp theo
+            self.client.session_handler.bind(self.client.socket, data)
             # Chuyển UI phải chạy trên Main Thread
             self.client.root.after(0, self._switch_to_chat)
             
@@ -26,6 +28,18 @@ class MessageHandler:
         elif msg_type == MessageType.LIST_USERS:
             self._handle_user_list(data)
 
+        elif msg_type in (MessageType.USER_ONLINE, MessageType.USER_OFFLINE):
+            self._handle_presence_delta(msg_type, data)
+
+        # Server sắp restart: sau khi bị ngắt, chờ đúng lượt rồi mới kết nối lại
+        elif msg_type == MessageType.SERVER_DRAIN:
+            self.client.reconnect_after = data.get("reconnect_after", 0)
+            print(f"🚰 Server đang restart, kết nối lại sau {self.client.reconnect_after}s")
+
+        # Heartbeat: trả lại nguyên "ts" để server đo RTT (feature "heartbeat")
+        elif msg_type == MessageType.PING:
+            Protocol.send_message(self.client.socket, MessageType.PONG, data)
+
         # --- 3. XỬ LÝ TIN NHẮN CHAT & FILE ---
         elif msg_type == MessageType.TEXT:
             # Gán loại tin nhắn để lưu lịch sử cho đúng
@@ -40,7 +54,30 @@ class MessageHandler:
         elif msg_type == MessageType.ERROR:
             self.client.root.after(0, lambda: messagebox.showerror("Lỗi Server", data.get("message")))
             
-        # --- 4. XỬ LÝ CUỘC GỌI ---
+        # --- 4. MEDIA (raw bytes từ binary frame) ---
+        elif msg_type == MessageType.VIDEO_DATA:
+            # Ghép ngay trên luồng nhận, chỉ frame mới nhất được vẽ (CallUI tự bỏ frame cũ chưa kịp vẽ)
+            if self.client.current_call:
+                self.client.current_call.process_incoming_video(data.get("data"))
+
+        elif msg_type == MessageType.AUDIO_DATA:
+            # Audio phát ngay trên luồng nhận, không cần đợi Tkinter
+            if self.client.current_call:
+                self.client.current_call.process_incoming_audio(data.get("data"))
+
+        elif msg_type == MessageType.MEDIA_FEEDBACK:
+            if self.client.current_call:
+                self.client.current_call.on_media_feedback(data)
+            elif getattr(self.client, "call_handler", None) and self.client.call_handler.in_call:
+                self.client.call_handler.on_media_feedback(data)
+
+        elif msg_type == MessageType.CALL_KEYFRAME:
+            if self.client.current_call:
+                self.client.current_call.on_keyframe_request(data)
+            elif getattr(self.client, "call_handler", None) and self.client.call_handler.in_call:
+                self.client.call_handler.on_keyframe_request(data)
+
+        # --- 5. XỬ LÝ CUỘC GỌI ---
         elif msg_type in [MessageType.CALL_REQUEST, MessageType.CALL_ACCEPT, MessageType.CALL_REJECT, MessageType.CALL_END, MessageType.CALL_BUSY, MessageType.CALL_ICE_CANDIDATE]:
             self._handle_call_message(msg_type, data)
 
@@ -63,8 +100,35 @@ class MessageHandler:
     def _handle_user_list(self, data):
         """Cập nhật danh sách người dùng online"""
         self.client.users = data.get("users", [])
+        # Server cũ không gửi version -> None: bỏ qua delta, chờ danh sách đầy đủ
+        self.client.presence_version = data.get("version")
         print(f"👥 Users updated: {self.client.users}")
-        
+        self._refresh_user_list()
+
+    def _handle_presence_delta(self, msg_type, data):
+        """Áp delta USER_ONLINE/USER_OFFLINE {"users", "version"} vào danh sách đang có"""
+        version = data.get("version")
+        current = self.client.presence_version
+        if version is None or current is None or version <= current:
+            # Chưa có danh sách đầy đủ / delta cũ (đã nằm trong LIST_USERS vừa nhận)
+            return
+        if version != current + 1:
+            # Lỡ 1 hoặc nhiều delta -> xin lại danh sách đầy đủ
+            print(f"⚠️ Presence gap ({current} -> {version}), requesting full list")
+            self.client.presence_version = None
+            Protocol.send_message(self.client.socket, MessageType.LIST_USERS, {})
+            return
+
+        users = data.get("users", [])
+        if msg_type == MessageType.USER_ONLINE:
+            self.client.users = self.client.users + [u for u in users if u not in self.client.users]
+        else:
+            self.client.users = [u for u in self.client.users if u not in users]
+        self.client.presence_version = version
+        print(f"👥 Users updated: {self.client.users}")
+        self._refresh_user_list()
+
+    def _refresh_user_list(self):
         # Nếu giao diện Chat đã mở thì update ngay
         if self.client.chat_ui:
             self.client.root.after(0, lambda: self.client.chat_ui.update_user_list(self.client.users))
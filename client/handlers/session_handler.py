@@ -0,0 +1,85 @@
+"""
+client/handlers/session_handler.py - Gắn phiên sau LOGIN và resume khi rớt mạng
+"""
+
+import random
+import socket
+import time
+
+from common.config import RESUME_GRACE_PERIOD, SOCKET_TIMEOUT
+from common.protocol import Protocol, MessageType
+from common.connection import Connection
+
+
+class SessionHandler:
+    def __init__(self, client):
+        self.client = client
+
+    def bind(self, connection, data):
+        """Gắn codec/features server đã chọn cho Connection (gọi khi nhận LOGIN_SUCCESS)"""
+        connection.bind_session(data)
+        # Server hỗ trợ resume -> đếm frame đã nhận để ack / resume
+        connection.track_seq = connection.supports_resume
+        # Gửi qua hàng đợi: tin nhắn chat không phải xếp sau cả file đang upload
+        connection.start_writer()
+
+    def try_resume(self):
+        """
+        Mất kết nối: thử kết nối lại trong thời gian server còn giữ phiên.
+        Server phát lại các frame bị lỡ, không cần đăng nhập lại từ đầu.
+        Returns: True nếu đã có kết nối mới (client.socket đã được thay)
+        """
+        old = self.client.socket
+        address = getattr(self.client, "server_address", None)
+        if old is None or address is None or not old.session_id:
+            return False
+
+        # Server restart (SERVER_DRAIN): chờ lượt server chia cho mình, tránh mọi client vào cùng lúc.
+        # Process mới không có phiên cũ -> đăng nhập lại như mới (resumed = False)
+        wait = getattr(self.client, "reconnect_after", 0) or 0
+        self.client.reconnect_after = 0
+        if wait:
+            time.sleep(wait)
+
+        deadline = time.monotonic() + RESUME_GRACE_PERIOD
+        delay = 0.5
+        while time.monotonic() < deadline and getattr(self.client, "is_running", True):
+            try:
+                connection = self._reconnect(address, old)
+                if connection is not None:
+                    self.client.socket = connection
+                    self.client.connected = True
+                    return True
+                return False  # Server từ chối (phiên hết hạn, trùng tên...)
+            except OSError as e:
+                print(f"🔁 Resume thất bại ({e}), thử lại sau {delay:.1f}s")
+            # Backoff có jitter: các client mất kết nối cùng lúc không thử lại cùng nhịp
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 5)
+        return False
+
+    def _reconnect(self, address, old):
+        connection = Connection(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        try:
+            connection.settimeout(SOCKET_TIMEOUT)
+            connection.connect(address)
+            Protocol.send_message(connection, MessageType.LOGIN, {
+                "username": self.client.username,
+                **Protocol.handshake_offer(),
+                "resume": {"session_id": old.session_id, "last_seq": old.recv_seq},
+            })
+            msg_type, data = Protocol.recv_message(connection)
+            connection.settimeout(None)
+        except OSError:
+            connection.close()
+            raise
+
+        if msg_type != MessageType.LOGIN_SUCCESS:
+            connection.close()
+            return None
+
+        self.bind(connection, data)
+        if data.get("resumed"):
+            # Server phát lại từ sau last_seq -> đếm tiếp
+            connection.recv_seq = connection.acked_seq = old.recv_seq
+        return connection
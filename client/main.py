@@ -15,11 +15,13 @@ if parent_dir not in sys.path:
 
 from common.config import Colors, UISettings
 from common.protocol import Protocol, MessageType
+from common.connection import Connection
 from client.ui.login_ui import LoginUI
 from client.ui.chat_ui import ChatUI
 from client.handlers.message_handler import MessageHandler
 from client.handlers.file_handler import FileHandler
 from client.handlers.call_handler import CallHandler
+from client.handlers.session_handler import SessionHandler
 
 class ClientApp:
     def __init__(self):
@@ -33,9 +35,12 @@ class ClientApp:
         # 2. Data & State
         self.username = None
         self.socket = None
+        self.server_address = None
         self.connected = False  # <--- [FIX] Thêm biến trạng thái kết nối
         self.is_running = True
         self.users = []
+        self.presence_version = None  # version của danh sách users (delta presence)
+        self.reconnect_after = 0  # Giây chờ trước khi kết nối lại (SERVER_DRAIN)
         self.messages = []
         self.colors = Colors
         self.current_call = None
@@ -44,6 +49,7 @@ class ClientApp:
         self.message_handler = MessageHandler(self)
         self.file_handler = FileHandler(self)
         self.call_handler = CallHandler(self)
+        self.session_handler = SessionHandler(self)
 
         # 4. UI Managers
         self.login_ui = None
@@ -69,15 +75,16 @@ class ClientApp:
                 host, port = "127.0.0.1", 5555
 
             # Connect
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket = Connection(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
             self.socket.connect((host, port))
+            self.server_address = (host, port)
             
             # [FIX] Đánh dấu đã kết nối thành công
             self.connected = True 
 
             # Send Login
             self.username = username
-            Protocol.send_message(self.socket, MessageType.LOGIN, {"username": username})
+            Protocol.send_message(self.socket, MessageType.LOGIN, {"username": username, **Protocol.handshake_offer()})
 
             # Start Listener Thread
             threading.Thread(target=self.receive_messages, daemon=True).start()
@@ -94,6 +101,8 @@ class ClientApp:
                 if not msg_type:
                     print("❌ Mất kết nối Server")
                     self.connected = False # [FIX] Cập nhật trạng thái khi mất kết nối
+                    if self._resume_session():
+                        continue
                     break
                 
                 # Chuyển cho MessageHandler xử lý
@@ -102,6 +111,8 @@ class ClientApp:
             except Exception as e:
                 print(f"❌ Error receiving: {e}")
                 self.connected = False # [FIX] Cập nhật trạng thái khi lỗi
+                if self._resume_session():
+                    continue
                 break
         
         # Cleanup khi vòng lặp kết thúc
@@ -109,6 +120,18 @@ class ClientApp:
             try: self.socket.close()
             except: pass
 
+    def _resume_session(self):
+        """Thử resume phiên cũ; socket cũ được đóng trước khi thay"""
+        if not self.is_running or not self.socket or not self.socket.session_id:
+            return False
+        try: self.socket.close()
+        except: pass
+        print("🔁 Đang kết nối lại...")
+        if self.session_handler.try_resume():
+            print("✅ Đã kết nối lại Server")
+            return True
+        return False
+
     def send_text_message(self, message, recipient=None):
         # Chỉ gửi nếu socket còn kết nối
         if self.socket and self.connected:
@@ -0,0 +1,213 @@
+"""
+client/tiles.py - Video gọi điện chỉ gửi phần thay đổi: bỏ frame tĩnh, gửi các ô (tile) đã đổi
+
+Bên gửi (TileEncoder) chia frame thành ô VIDEO_TILE_SIZE x VIDEO_TILE_SIZE, so với frame đã gửi
+trước đó bằng 1 phép tính NumPy trên cả frame (không lặp từng pixel):
+  - không ô nào đổi quá VIDEO_TILE_THRESHOLD -> không gửi gì (người nhận giữ nguyên hình)
+  - ít ô đổi -> delta: chỉ JPEG của các ô đó
+  - nhiều ô đổi / đổi kích thước / mỗi VIDEO_KEYFRAME_INTERVAL giây / vừa mất frame / peer xin -> keyframe
+Bên nhận (TileCompositor) ghép các ô vào frame đang hiển thị.
+
+Payload VIDEO_DATA:
+  - keyframe: JPEG bình thường (client cũ, Web đều hiển thị được), kèm segment COM (FF FE)
+    TILE_MARKER + >H (id keyframe) sau SOI = "tôi ghép được delta"; decoder JPEG bỏ qua segment này
+  - delta: DELTA_MAGIC + >HHHHHH (rộng, cao, cạnh ô, số ô, id keyframe, seq) + mỗi ô >HHI (x, y, số byte) + JPEG ô
+Chỉ gửi delta cho peer đã gửi keyframe có TILE_MARKER -> không bao giờ gửi delta cho client cũ / Web.
+
+Frame video có thể bị bỏ trên đường đi (hộp thư video ở hàng đợi gửi / server chỉ giữ frame mới nhất).
+Delta chỉ đúng khi đã ghép đủ mọi delta trước nó từ cùng keyframe: seq đánh số 1, 2, 3... sau mỗi keyframe.
+Thiếu keyframe / hụt seq -> bên nhận bỏ mọi delta tới keyframe kế tiếp (giữ hình cũ, không ghép sai ô)
+và xin keyframe ngay (CALL_KEYFRAME, take_keyframe_request) thay vì chờ VIDEO_KEYFRAME_INTERVAL.
+"""
+
+import struct
+import time
+
+from common.config import (
+    VIDEO_TILE_SIZE, VIDEO_TILE_THRESHOLD, VIDEO_TILE_MAX_DIRTY, VIDEO_KEYFRAME_INTERVAL,
+)
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = np = None
+
+TILE_MARKER = b"tcpchat-tiles/1"
+DELTA_MAGIC = b"VTD1"
+_KEYFRAME_ID = struct.Struct(">H")
+_COM_PREFIX = b"\xff\xfe" + struct.pack(">H", 2 + len(TILE_MARKER) + _KEYFRAME_ID.size) + TILE_MARKER
+_DELTA_HEADER = struct.Struct(">HHHHHH")
+_TILE_HEADER = struct.Struct(">HHI")
+
+
+def has_tile_marker(data):
+    """Keyframe của client ghép được delta (COM TILE_MARKER ngay sau SOI)"""
+    return data[2:2 + len(_COM_PREFIX)] == _COM_PREFIX
+
+
+def keyframe_id(data):
+    """Id keyframe trong segment COM (None nếu JPEG không có TILE_MARKER)"""
+    if not has_tile_marker(data):
+        return None
+    return _KEYFRAME_ID.unpack_from(data, 2 + len(_COM_PREFIX))[0]
+
+
+class TileEncoder:
+    """
+    encode(frame, quality) -> payload VIDEO_DATA, None = frame tĩnh, không cần gửi.
+    announce: keyframe có TILE_MARKER (chỉ bật khi client này ghép được delta).
+    peer_tiles: peer ghép được delta (đọc từ TileCompositor của cùng cuộc gọi).
+    """
+
+    def __init__(self, announce=True, tile=VIDEO_TILE_SIZE, threshold=VIDEO_TILE_THRESHOLD,
+                 max_dirty=VIDEO_TILE_MAX_DIRTY, keyframe_interval=VIDEO_KEYFRAME_INTERVAL):
+        self.announce = announce
+        self.tile = tile
+        self.threshold = threshold
+        self.max_dirty = max_dirty
+        self.keyframe_interval = keyframe_interval
+        self.peer_tiles = False
+        self.reference = None       # Frame đã gửi (từng ô đúng như lần gửi gần nhất của ô đó)
+        self.keyframe_id = 0        # Id keyframe gần nhất (delta ghi id này + seq để bên nhận thấy hụt)
+        self.seq = 0                # Seq của delta gần nhất kể từ keyframe đó
+        self._last_keyframe = 0.0
+        self._force_keyframe = False
+
+        # Thống kê
+        self.keyframes = 0
+        self.deltas = 0
+        self.skipped = 0
+
+    def force_keyframe(self):
+        """Có frame bị bỏ trên đường đi / peer xin keyframe: người nhận đã lỡ ô -> frame kế tiếp gửi nguyên"""
+        self._force_keyframe = True
+
+    def encode(self, frame, quality):
+        now = time.monotonic()
+        keyframe = (
+            self._force_keyframe or self.reference is None
+            or self.reference.shape != frame.shape
+            or now - self._last_keyframe >= self.keyframe_interval
+        )
+        if not keyframe:
+            dirty = self._dirty_tiles(frame)
+            if not len(dirty):
+                self.skipped += 1
+                return None
+            total = -(-frame.shape[0] // self.tile) * -(-frame.shape[1] // self.tile)
+            if self.peer_tiles and len(dirty) <= self.max_dirty * total:
+                return self._encode_delta(frame, dirty, quality)
+        return self._encode_keyframe(frame, quality, now)
+
+    def _dirty_tiles(self, frame):
+        """[(hàng, cột)] các ô chênh lệch trung bình quá threshold so với reference"""
+        t = self.tile
+        height, width, channels = frame.shape
+        # |frame - reference| trên uint8 (max - min: không tràn, không phải đổi sang int16)
+        diff = np.maximum(frame, self.reference)
+        diff -= np.minimum(frame, self.reference)
+        # Cộng theo ô: trước theo cột (mỗi ô rộng t * channels byte), rồi theo hàng.
+        # reduceat tự xử lý ô ở mép nhỏ hơn t x t, không cần pad
+        row_starts, col_starts = np.arange(0, height, t), np.arange(0, width, t)
+        sums = np.add.reduceat(diff.reshape(height, width * channels), col_starts * channels, axis=1, dtype=np.uint32)
+        sums = np.add.reduceat(sums, row_starts, axis=0)
+        # Chia đúng số pixel thật của từng ô
+        areas = np.outer(np.minimum(t, height - row_starts), np.minimum(t, width - col_starts)) * channels
+        return np.argwhere(sums > self.threshold * areas)
+
+    def _encode_keyframe(self, frame, quality, now):
+        _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        payload = buffer.tobytes()
+        self.keyframe_id = (self.keyframe_id + 1) & 0xFFFF
+        self.seq = 0
+        if self.announce:
+            payload = payload[:2] + _COM_PREFIX + _KEYFRAME_ID.pack(self.keyframe_id) + payload[2:]
+        self.reference = frame.copy()
+        self._last_keyframe = now
+        self._force_keyframe = False
+        self.keyframes += 1
+        return payload
+
+    def _encode_delta(self, frame, dirty, quality):
+        t = self.tile
+        height, width = frame.shape[:2]
+        self.seq = (self.seq + 1) & 0xFFFF
+        parts = [DELTA_MAGIC, _DELTA_HEADER.pack(width, height, t, len(dirty), self.keyframe_id, self.seq)]
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        for row, col in dirty:
+            y, x = int(row) * t, int(col) * t
+            block = frame[y:y + t, x:x + t]
+            _, buffer = cv2.imencode('.jpg', block, params)
+            parts.append(_TILE_HEADER.pack(x, y, len(buffer)))
+            parts.append(buffer.tobytes())
+            self.reference[y:y + t, x:x + t] = block
+        self.deltas += 1
+        return b"".join(parts)
+
+
+class TileCompositor:
+    """
+    apply(payload) -> frame để hiển thị (BGR), None nếu không hiển thị được
+    (delta không nối tiếp được frame đang có -> bỏ, chờ keyframe kế tiếp).
+    take_keyframe_request(): True khi cần xin peer gửi keyframe (tối đa 1 lần / request_interval giây).
+    peer_tiles: keyframe gần nhất của peer có TILE_MARKER.
+    """
+
+    def __init__(self, request_interval=0.5):
+        self.frame = None
+        self.peer_tiles = False
+        self.keyframe_id = None     # Id keyframe đang hiển thị
+        self.seq = 0                # Seq của delta đã ghép gần nhất
+        self.request_interval = request_interval
+        self._missing = False       # Đã hụt frame, đang chờ keyframe
+        self._last_request = None
+
+        # Thống kê
+        self.gaps = 0
+
+    def apply(self, data):
+        if data[:len(DELTA_MAGIC)] == DELTA_MAGIC:
+            return self._apply_delta(memoryview(data))
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return None
+        self.peer_tiles = has_tile_marker(data)
+        self.keyframe_id = keyframe_id(data)
+        self.seq = 0
+        self._missing = False
+        self.frame = frame
+        return frame
+
+    def take_keyframe_request(self):
+        if not self._missing:
+            return False
+        now = time.monotonic()
+        if self._last_request is not None and now - self._last_request < self.request_interval:
+            return False
+        self._last_request = now
+        return True
+
+    def _apply_delta(self, data):
+        offset = len(DELTA_MAGIC)
+        width, height, _, count, base, seq = _DELTA_HEADER.unpack_from(data, offset)
+        offset += _DELTA_HEADER.size
+        if (self._missing or self.frame is None or self.frame.shape[:2] != (height, width)
+                or base != self.keyframe_id or seq != (self.seq + 1) & 0xFFFF):
+            # Lỡ keyframe / delta trước đó: ghép tiếp sẽ để lại ô cũ -> giữ hình, chờ keyframe
+            if not self._missing:
+                self._missing = True
+                self.gaps += 1
+            return None
+        self.seq = seq
+        for _ in range(count):
+            x, y, size = _TILE_HEADER.unpack_from(data, offset)
+            offset += _TILE_HEADER.size
+            block = cv2.imdecode(np.frombuffer(data[offset:offset + size], dtype=np.uint8), cv2.IMREAD_COLOR)
+            offset += size
+            if block is None:
+                continue
+            region = self.frame[y:y + block.shape[0], x:x + block.shape[1]]
+            if region.shape == block.shape:
+                region[...] = block
+        return self.frame
@@ -8,6 +8,8 @@ import base64
 from PIL import Image, ImageTk
 from common.config import Colors, UISettings
 from common.protocol import Protocol, MessageType
+from client.bitrate import BitrateController
+from client.tiles import TileEncoder, TileCompositor
 
 # WebRTC imports (OpenCV + PyAudio)
 try:
@@ -35,6 +37,22 @@ class CallUI:
         self.is_muted = False
         self.is_camera_on = True
         
+        # Video nhận: chỉ giữ frame (đã ghép) mới nhất chờ vẽ, mỗi lúc tối đa 1 lần after() đang chờ
+        # -> mạng dồn frame tới thì bỏ frame cũ, hàng đợi sự kiện Tkinter không phình ra
+        self._video_lock = threading.Lock()
+        self._pending_video = None
+        self._video_scheduled = False
+        
+        # MEDIA_FEEDBACK: frame gửi cho peer bị server bỏ trong lần báo gần nhất (video, audio)
+        self.peer_dropped = (0, 0)
+        
+        # Độ phân giải / chất lượng / fps video gửi đi theo tình trạng mạng
+        self.bitrate = BitrateController(client)
+        
+        # Chỉ gửi ô đã thay đổi (peer cũng ghép được delta), bỏ frame tĩnh; ghép ô peer gửi tới
+        self.tile_encoder = TileEncoder()
+        self.compositor = TileCompositor()
+        
         # Setup Window
         self.window = Toplevel(client.root)
         self.window.title(f"{'Video' if call_type == 'video' else 'Audio'} Call - {peer_username}")
@@ -217,24 +235,29 @@ class CallUI:
     def _update_video_frame(self):
         if not self.call_active or not self.is_camera_on: return
         try:
+            width, height, quality, fps = self.bitrate.step()
             ret, frame = self.video_capture.read()
             if ret:
                 # 1. Local Mirror (Hiển thị phía mình)
                 if not hasattr(self, 'has_peer_video') or not self.has_peer_video:
                     self._render_frame_to_canvas(frame)
                 
-                # 2. Gửi đi (Resize 320x240 để tối ưu tốc độ mạng TCP)
-                frame_small = cv2.resize(frame, (320, 240))
-                # Nén JPEG chất lượng 50
-                _, buffer = cv2.imencode('.jpg', frame_small, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
-                # Encode Base64
-                jpg_as_text = base64.b64encode(buffer).decode('utf-8')
+                # 2. Gửi đi: kích thước / chất lượng theo bậc hiện tại (mạng nghẽn thì giảm)
+                frame_small = cv2.resize(frame, (width, height))
+                
+                # Keyframe JPEG / chỉ các ô đã đổi / không gửi gì nếu hình không đổi
+                self.tile_encoder.peer_tiles = self.compositor.peer_tiles
+                if self.bitrate.take_loss():
+                    self.tile_encoder.force_keyframe()
+                payload = self.tile_encoder.encode(frame_small, quality)
                 
-                Protocol.send_message(self.client.socket, MessageType.VIDEO_DATA, 
-                                      {"recipient": self.peer, "data": jpg_as_text})
+                # Gửi raw bytes (binary frame, không Base64)
+                if payload is not None:
+                    Protocol.send_message(self.client.socket, MessageType.VIDEO_DATA, 
+                                          {"recipient": self.peer, "data": payload})
             
-            # Gọi lại sau 30ms (~33 FPS)
-            self.window.after(30, self._update_video_frame) 
+            # Gọi lại theo fps của bậc hiện tại
+            self.window.after(int(1000 / fps), self._update_video_frame) 
         except Exception as e: 
             print(f"Video Loop Error: {e}")
 
@@ -273,35 +296,66 @@ class CallUI:
         """Callback thu âm thanh và gửi đi ngay lập tức"""
         if self.call_active and not self.is_muted:
             try:
-                data_str = base64.b64encode(in_data).decode('utf-8')
-                # Sử dụng Protocol.send_message nhưng cần thread-safe (thực tế socket.send là thread-safe)
+                # Gửi raw PCM bytes (binary frame), socket.sendall là thread-safe
                 Protocol.send_message(self.client.socket, MessageType.AUDIO_DATA, 
-                                      {"recipient": self.peer, "data": data_str})
+                                      {"recipient": self.peer, "data": in_data})
             except: pass
         return (in_data, pyaudio.paContinue)
 
     # --- INCOMING DATA HANDLERS (Được gọi từ CallHandler) ---
     
-    def process_incoming_video(self, data_str):
-        """Nhận dữ liệu video từ server -> hiển thị"""
+    def process_incoming_video(self, data):
+        """
+        Gọi từ luồng nhận (JPEG / delta các ô dạng raw bytes, hoặc Base64 từ client cũ).
+        Ghép ngay tại đây (delta nào cũng phải ghép, bỏ là mất ô tới keyframe sau),
+        chỉ phần vẽ mới bỏ frame cũ: thay frame chờ vẽ bằng frame mới, chỉ hẹn vẽ nếu chưa hẹn.
+        """
+        try:
+            img_data = data if isinstance(data, bytes) else base64.b64decode(data)
+            # Keyframe thay cả frame, delta ghép ô vào frame đang có
+            frame = self.compositor.apply(img_data)
+            # Delta không nối tiếp được (frame trước bị bỏ trên đường đi) -> xin keyframe ngay
+            if self.compositor.take_keyframe_request():
+                Protocol.send_message(self.client.socket, MessageType.CALL_KEYFRAME, {"recipient": self.peer})
+        except: return
+        if frame is None: return
+        
+        with self._video_lock:
+            # Copy: delta kế tiếp ghép thẳng vào frame của compositor trong lúc Tkinter đang vẽ
+            self._pending_video = frame.copy()
+            if self._video_scheduled:
+                return
+            self._video_scheduled = True
+        self.client.root.after(0, self._draw_pending_video)
+
+    def _draw_pending_video(self):
+        with self._video_lock:
+            frame, self._pending_video = self._pending_video, None
+            self._video_scheduled = False
+        if frame is None: return
         try:
             self.has_peer_video = True # Đánh dấu để ngừng hiện mirror local
-            
-            img_data = base64.b64decode(data_str)
-            np_arr = np.frombuffer(img_data, dtype=np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-            
-            if frame is not None: 
-                # Resize frame nhận được cho vừa canvas (640x480)
-                frame = cv2.resize(frame, (640, 480))
-                self._render_frame_to_canvas(frame)
+            # Resize frame nhận được cho vừa canvas (640x480)
+            frame = cv2.resize(frame, (640, 480))
+            self._render_frame_to_canvas(frame)
         except: pass
 
-    def process_incoming_audio(self, data_str):
+    def on_media_feedback(self, data):
+        """Server báo peer nhận chậm, đã bỏ bớt frame mình gửi"""
+        self.peer_dropped = (data.get("video_dropped", 0), data.get("audio_dropped", 0))
+        self.bitrate.on_feedback(data)
+        print(f"📉 {self.peer} nhận chậm: bỏ {self.peer_dropped[0]} frame video, "
+              f"{self.peer_dropped[1]} chunk audio trong {data.get('interval')}s")
+    
+    def on_keyframe_request(self, data):
+        """Peer lỡ frame video, không ghép tiếp được delta -> frame kế tiếp gửi nguyên"""
+        self.tile_encoder.force_keyframe()
+
+    def process_incoming_audio(self, data):
         """Nhận dữ liệu audio từ server -> phát ra loa"""
         try:
             if self.audio_output:
-                audio_data = base64.b64decode(data_str)
+                audio_data = data if isinstance(data, bytes) else base64.b64decode(data)
                 self.audio_output.write(audio_data)
         except: pass
 
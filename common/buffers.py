@@ -0,0 +1,46 @@
+"""
+common/buffers.py - Buffer nhận dữ liệu dùng lại được cho từng kết nối (recv_into, không copy)
+"""
+
+from common.framing import FrameDecoder
+
+
+class RecvBuffer:
+    """
+    Driver blocking cho FrameDecoder: recv_into thẳng vào buffer của decoder,
+    tách frame ngay trong buffer và trả về memoryview (không copy).
+    memoryview trả về chỉ hợp lệ tới lần read_frame() tiếp theo -
+    ai cần giữ payload lâu hơn thì tự bytes(...) nó.
+    """
+
+    def __init__(self, sock, decoder=None):
+        self.sock = sock
+        self.decoder = decoder or FrameDecoder()
+
+    @property
+    def capacity(self):
+        return self.decoder.capacity
+
+    @property
+    def pending(self):
+        """Số byte đã nhận nhưng chưa đọc"""
+        return self.decoder.pending
+
+    def take(self, n):
+        """Lấy tối đa n byte đang nằm sẵn trong buffer (không gọi recv)"""
+        return self.decoder.take(n)
+
+    def read_frame(self):
+        """
+        Đọc 1 frame hoàn chỉnh.
+        Returns: (length word, memoryview thân frame) hoặc (None, None) nếu socket đóng
+        """
+        while True:
+            raw = self.decoder.next_raw_frame()
+            if raw is not None:
+                return raw
+
+            got = self.sock.recv_into(self.decoder.get_buffer())
+            if not got:
+                return None, None
+            self.decoder.buffer_updated(got)
@@ -0,0 +1,82 @@
+"""
+Các codec để serialize phần thân JSON frame ({"type", "data"}).
+Codec được chọn lúc LOGIN (xem Protocol.negotiate_session) và gắn cố định cho từng kết nối.
+"""
+
+import json
+
+# msgpack / cbor2 là tuỳ chọn, thiếu thì chỉ còn JSON (stdlib)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class JsonCodec:
+    """JSON (stdlib) - codec mặc định, client cũ chỉ hiểu codec này"""
+    name = "json"
+
+    @staticmethod
+    def dumps(obj):
+        # ensure_ascii=False để hỗ trợ tiếng Việt
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    @staticmethod
+    def loads(data):
+        return json.loads(str(data, "utf-8"))
+
+
+class MsgpackCodec:
+    """MessagePack - nhỏ hơn và parse nhanh hơn JSON"""
+    name = "msgpack"
+
+    @staticmethod
+    def dumps(obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    @staticmethod
+    def loads(data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class CborCodec:
+    """CBOR (RFC 8949)"""
+    name = "cbor"
+
+    @staticmethod
+    def dumps(obj):
+        return cbor2.dumps(obj)
+
+    @staticmethod
+    def loads(data):
+        return cbor2.loads(bytes(data))
+
+
+# Codec có thể dùng trên máy này, theo thứ tự ưu tiên khi thương lượng
+CODECS = {}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec
+if cbor2 is not None:
+    CODECS[CborCodec.name] = CborCodec
+CODECS[JsonCodec.name] = JsonCodec
+
+DEFAULT_CODEC = JsonCodec
+
+
+def get_codec(name):
+    """Lấy codec theo tên, không có thì trả về JSON"""
+    return CODECS.get(name, DEFAULT_CODEC)
+
+
+def choose_codec(offered):
+    """Chọn codec tốt nhất mà cả hai bên cùng hỗ trợ (theo thứ tự ưu tiên của server)"""
+    offered = set(offered or ())
+    for name in CODECS:
+        if name in offered:
+            return CODECS[name]
+    return DEFAULT_CODEC
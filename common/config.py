@@ -16,6 +16,77 @@ CHUNK_SIZE = 8192
 SOCKET_TIMEOUT = 5
 UPLOAD_TIMEOUT = 10
 
+# Nén payload (deflate) - chỉ nén JSON frame lớn hơn ngưỡng, media (JPEG/PCM) không nén
+COMPRESSION_THRESHOLD = 512
+COMPRESSION_LEVEL = 6
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024  # 1 frame nén giải ra quá mức này -> từ chối (chống zip bomb)
+
+# Gộp nhiều frame gửi đi vào 1 syscall: flush sau tối đa 1ms hoặc khi đủ 64KB
+COALESCE_DELAY = 0.001
+COALESCE_MAX_BYTES = 64 * 1024
+
+# Resume phiên sau khi mất kết nối (feature "resume")
+RESUME_GRACE_PERIOD = 30      # Giây server giữ phiên chờ client kết nối lại
+REPLAY_BUFFER_SIZE = 1000     # Số frame tối đa server giữ lại để phát lại
+ACK_INTERVAL = 32             # Client gửi ACK riêng sau chừng này frame nếu chưa ack kèm tin nào
+
+# TCP Server asyncio (chạy chung event loop với FastAPI)
+USE_UVLOOP = True                 # Dùng uvloop nếu đã cài (Linux/macOS)
+RECV_HIGH_WATER = 4 * 1024 * 1024 # Dữ liệu nhận chưa xử lý vượt mức này -> tạm ngừng đọc socket
+
+# ChatServer (TCP-only): "thread" = 1 thread / client, "reactor" = selectors + worker pool
+SERVER_MODE = "thread"
+LISTEN_BACKLOG = 1024         # Hàng đợi accept của socket lắng nghe
+REACTOR_WORKERS = 8           # Số worker chạy handler ở chế độ reactor
+
+# Hàng đợi gửi có giới hạn cho mỗi kết nối: 1 client mạng chậm không làm chậm người khác
+OUTBOUND_CONTROL_LIMIT = 4 * 1024 * 1024  # Byte chat/presence chờ gửi tối đa
+OUTBOUND_BLOCK_TIMEOUT = 0.5  # Đầy: bên gửi chờ tối đa chừng này giây, quá hạn -> ngắt kết nối
+OUTBOUND_AUDIO_FRAMES = 8     # Audio chờ gửi tối đa (~190ms PCM), đầy thì bỏ chunk cũ nhất; video chỉ giữ frame mới nhất
+MEDIA_FEEDBACK_INTERVAL = 1.0 # Báo người gửi số frame media bị bỏ tối đa 1 lần / chừng này giây
+WEB_SEND_TIMEOUT = 2.0        # Hạn cho 1 lần ghi WebSocket; quá hạn tính 1 lần timeout
+WEB_SEND_MAX_TIMEOUTS = 3     # Quá hạn liên tiếp chừng này lần -> coi trình duyệt đã treo, ngắt kết nối
+
+# Presence: gom các lần login/logout trong khoảng này thành 1 lượt delta USER_ONLINE/USER_OFFLINE
+PRESENCE_COALESCE_WINDOW = 0.05
+
+# Heartbeat: server PING mỗi HEARTBEAT_INTERVAL giây, client "heartbeat" im lặng quá HEARTBEAT_TIMEOUT -> ngắt
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT_TIMEOUT = 45
+TIMER_WHEEL_TICK = 1.0        # Độ phân giải hẹn giờ (giây)
+TIMER_WHEEL_SLOTS = 64        # Số slot của timer wheel (hẹn xa hơn 1 vòng thì đếm thêm vòng)
+
+# Drain / restart không downtime (server/drain.py)
+DRAIN_TIMEOUT = 30            # Tổng thời gian tối đa chờ upload xong + gửi hết hàng đợi
+DRAIN_RECONNECT_SPREAD = 10   # Client kết nối lại rải đều trong chừng này giây
+HANDOFF_SOCKET = "/tmp/tcpchat-handoff.sock"  # Unix socket để process mới nhận socket lắng nghe
+
+# Video gọi điện tự điều chỉnh chất lượng (client/bitrate.py): các bậc (rộng, cao, JPEG quality, fps)
+VIDEO_LADDER = (
+    (160, 120, 35, 8),
+    (240, 180, 40, 12),
+    (320, 240, 50, 15),
+    (320, 240, 60, 20),
+    (480, 360, 65, 25),
+    (640, 480, 70, 30),
+)
+VIDEO_LADDER_START = 2        # Bậc lúc bắt đầu cuộc gọi
+ABR_QUEUE_HIGH = 256 * 1024   # Byte chờ gửi của chính mình vượt mức này -> nghẽn
+ABR_RTT_RISE = 0.15           # RTT tăng hơn RTT thấp nhất đã đo chừng này giây -> nghẽn
+ABR_PROBE_INTERVAL = 1.0      # Trong cuộc gọi: PING đo RTT mỗi chừng này giây
+ABR_DOWN_HOLD = 0.5           # Giảm bậc: tối đa 1 bậc / chừng này giây (giảm nhanh)
+ABR_UP_HOLD = 5.0             # Tăng bậc: phải ổn định liên tục chừng này giây (tăng chậm)
+
+# Video gọi điện chỉ gửi phần thay đổi (client/tiles.py): so từng ô với frame đã gửi trước
+VIDEO_TILE_SIZE = 32          # Cạnh 1 ô (pixel)
+VIDEO_TILE_THRESHOLD = 6.0    # Chênh lệch trung bình mỗi kênh màu (0-255) dưới mức này -> ô không đổi
+VIDEO_TILE_MAX_DIRTY = 0.5    # Quá nửa số ô đổi -> gửi nguyên frame (keyframe) cho rẻ hơn
+VIDEO_KEYFRAME_INTERVAL = 2.0 # Keyframe định kỳ (giây): người nhận lỡ ô nào cũng tự lành sau chừng này
+
+# Router (server/router.py): giới hạn chat / lệnh điều khiển của mỗi kết nối (token bucket)
+RATE_LIMIT_PER_SEC = 20       # Số message trung bình mỗi giây
+RATE_LIMIT_BURST = 40         # Gửi dồn tối đa chừng này message liền nhau
+
 class Colors:
     # --- BLUE & WHITE PALETTE (Dựa theo ảnh mẫu) ---
     BG_MAIN = "#FFFFFF"         # Nền chính: Trắng
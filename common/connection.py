@@ -0,0 +1,258 @@
+"""
+common/connection.py - Bọc socket TCP kèm trạng thái của phiên (version, codec, features)
+"""
+
+import socket
+import threading
+import time
+
+from common.buffers import RecvBuffer
+from common.codecs import DEFAULT_CODEC, get_codec
+from common.config import ACK_INTERVAL
+from common.framing import FrameEncoder
+from common.outbound import OutboundQueue, send_frames, on_event_loop
+from common.protocol import Protocol, MessageType
+
+
+class SessionState:
+    """
+    Trạng thái phiên dùng chung cho mọi kiểu kết nối (thread, asyncio, reactor):
+    version/codec/features đã thương lượng, encoder + decoder của phiên, số thứ tự để resume.
+    """
+
+    def _init_session(self, decoder):
+        self.decoder = decoder
+        # Trước khi LOGIN xong: luôn là protocol v1 + JSON (client cũ hiểu được)
+        self.version = 1
+        self.codec = DEFAULT_CODEC
+        self.features = frozenset()
+        self.encoder = FrameEncoder(binary=False)
+        
+        # Resume phiên (feature "resume"):
+        # - phía client: đếm frame có thứ tự đã nhận (recv_seq) và ack lại cho server
+        # - phía server: on_peer_ack nhận seq client đã xác nhận
+        self.session_id = None
+        self.track_seq = False
+        self.recv_seq = 0
+        self.acked_seq = 0
+        self.on_peer_ack = None
+        
+        # Heartbeat (server/heartbeat.py): lần cuối nhận frame + RTT đo bằng PING/PONG (giây)
+        self.last_seen = time.monotonic()
+        self.rtt = None
+
+    @property
+    def supports_binary(self):
+        return "binary" in self.features
+
+    @property
+    def supports_channels(self):
+        return "channels" in self.features
+
+    @property
+    def supports_resume(self):
+        return "resume" in self.features
+
+    @property
+    def supports_presence(self):
+        return "presence" in self.features
+
+    @property
+    def supports_heartbeat(self):
+        return "heartbeat" in self.features
+
+    def bind_session(self, session):
+        """Gắn version/codec/features (từ Protocol.negotiate_session hoặc LOGIN_SUCCESS)"""
+        self.version = session.get("version", 1)
+        self.codec = get_codec(session.get("codec"))
+        self.features = frozenset(session.get("features") or ())
+
+        # Nén deflate: mỗi chiều 1 context riêng, sống suốt phiên
+        compress = "deflate" in self.features
+        self.encoder = FrameEncoder(
+            codec=self.codec,
+            binary=self.supports_binary,
+            compressor=Protocol.new_compressor() if compress else None
+        )
+        self.decoder.codec = self.codec
+        self.decoder.decompressor = Protocol.new_decompressor() if compress else None
+        
+        self.session_id = session.get("session_id")
+
+    def _decode(self, word, body):
+        """
+        Decode 1 frame thô của phiên, chuyển ack của phía bên kia cho on_peer_ack.
+        Returns: (None, None) nếu context giải nén đã hỏng -> bên gọi đóng kết nối như khi ngắt.
+        """
+        decoder = self.decoder
+        msg_type, data = decoder.decode_frame(word, body)
+        if decoder.broken is not None:
+            print(f"❌ {decoder.broken}, đóng kết nối")
+            return None, None
+        self.last_seen = time.monotonic()
+
+        # Ack từ phía bên kia: kèm trong envelope hoặc message ACK riêng
+        if self.on_peer_ack is not None:
+            ack = decoder.peer_ack
+            if msg_type == MessageType.ACK and isinstance(data, dict):
+                ack = data.get("seq")
+            if ack is not None:
+                self.on_peer_ack(ack)
+
+        # PONG trả lời PING của server: "ts" là giờ lúc gửi PING -> RTT (trung bình trượt như TCP)
+        if msg_type == MessageType.PONG and isinstance(data, dict) and isinstance(data.get("ts"), (int, float)):
+            sample = self.last_seen - data["ts"]
+            self.rtt = sample if self.rtt is None else 0.875 * self.rtt + 0.125 * sample
+        return msg_type, data
+
+    def __repr__(self):
+        return f"<{type(self).__name__} v{self.version} {self.codec.name} {sorted(self.features)}>"
+
+
+class Connection(SessionState):
+    """
+    Socket + thông tin phiên đã thương lượng lúc LOGIN.
+    Dùng được ở mọi chỗ đang nhận socket (Protocol.send_message, recv_message, close...)
+    vì các thuộc tính khác được chuyển thẳng xuống socket gốc.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        # Buffer nhận dùng lại cho cả phiên (Protocol.recv_message tự dùng nếu có)
+        self.recv_buffer = RecvBuffer(sock)
+        self._init_session(self.recv_buffer.decoder)
+        # Khóa gửi giữ đúng thứ tự encode -> ghi (bắt buộc khi có nén)
+        self.send_lock = threading.Lock()
+        # Hàng đợi gửi + writer thread (bật bằng start_writer), None = gửi thẳng
+        self.outbound = None
+        # Channel ID cấp cho các luồng dữ liệu (upload file) trên kết nối này
+        self._next_channel = 0
+
+    def recv_message(self):
+        """Đọc + decode 1 frame từ buffer nhận (dùng qua Protocol.recv_message)"""
+        word, body = self.recv_buffer.read_frame()
+        if body is None:
+            return None, None
+        msg_type, data = self._decode(word, body)
+        if msg_type is None:
+            self.close()
+            return None, None
+
+        if self.track_seq and msg_type not in Protocol.UNSEQUENCED_TYPES:
+            self.recv_seq += 1
+            # Lâu không gửi gì để ack kèm -> gửi ACK riêng
+            if self.recv_seq - self.acked_seq >= ACK_INTERVAL:
+                Protocol.send_message(self, MessageType.ACK, {"seq": self.recv_seq})
+        return msg_type, data
+
+    def send_message(self, msg_type, data):
+        """Encode theo phiên rồi gửi (dùng qua Protocol.send_message)"""
+        channel = Protocol.channel_of(msg_type, data)
+        # Đợi channel dữ liệu có chỗ TRƯỚC khi giữ send_lock để không chặn tin nhắn chat
+        if self.outbound is not None:
+            self.outbound.wait_for_room(channel)
+        with self.send_lock:
+            # Ack kèm vào envelope JSON nếu có frame mới chưa ack
+            ack = None
+            if self.track_seq and self.recv_seq > self.acked_seq and not self.encoder.will_be_binary(msg_type, data):
+                ack = self.acked_seq = self.recv_seq
+            frame = self.encoder.encode(msg_type, data, ack=ack)
+            if msg_type in Protocol.MEDIA_TYPES:
+                self._write(frame, channel, msg_type, data.get("sender"))
+            else:
+                self._write(frame, channel)
+
+    def send_encoded(self, encoded):
+        """Gửi EncodedMessage: dùng lại frame đã encode cho wire format của phiên này"""
+        with self.send_lock:
+            if encoded.msg_type in Protocol.MEDIA_TYPES:
+                self._write(encoded.frame_for(self.encoder), media=encoded.msg_type, sender=encoded.sender)
+            else:
+                self._write(encoded.frame_for(self.encoder))
+
+    def _write(self, frame, channel=Protocol.CONTROL_CHANNEL, media=None, sender=None):
+        """Ghi 1 frame (gọi khi đang giữ send_lock). media: VIDEO_DATA / AUDIO_DATA"""
+        if self.outbound is None:
+            self.sock.sendall(frame)
+        elif not self.outbound.put(frame, channel, media, block=not on_event_loop(), sender=sender):
+            if self.outbound.overflowed:
+                # Client không nhận kịp: ngắt để không giữ RAM / chặn bên gửi mãi
+                print(f"🐢 Client nhận quá chậm, ngắt kết nối: {self._peer()}")
+                self.close()
+            raise OSError("Connection closed")
+
+    def outbound_stats(self):
+        """Độ sâu hàng đợi gửi + số frame bị bỏ (xem OutboundQueue.stats)"""
+        if self.outbound is None:
+            return {"frames": 0, "bytes": 0, "media_dropped": 0, "blocked": 0, "overflowed": False}
+        return self.outbound.stats()
+
+    def take_media_dropped(self, sender):
+        """(video, audio) của `sender` bị bỏ vì client nhận chậm, kể từ lần hỏi trước"""
+        if self.outbound is None:
+            return (0, 0)
+        return self.outbound.take_media_dropped(sender)
+
+    def _peer(self):
+        try: return self.sock.getpeername()
+        except OSError: return None
+
+    def open_channel(self):
+        """Cấp 1 channel ID mới (1..65535) cho 1 luồng dữ liệu"""
+        with self.send_lock:
+            self._next_channel = self._next_channel % 0xFFFF + 1
+            return self._next_channel
+
+    def start_writer(self, **queue_options):
+        """
+        Chuyển sang gửi qua hàng đợi: các frame nhỏ gửi liên tiếp (LOGIN_SUCCESS, LIST_USERS,
+        tin nhắn nhóm...) được gộp lại và ghi bằng 1 lần sendmsg.
+        """
+        if self.outbound is None:
+            self.outbound = OutboundQueue(**queue_options)
+            threading.Thread(target=self._writer_loop, daemon=True).start()
+
+    def _writer_loop(self):
+        outbound = self.outbound
+        while True:
+            batch = outbound.take_batch()
+            if batch is None:
+                return
+            try:
+                send_frames(self.sock, batch)
+            except OSError:
+                # Socket hỏng -> đóng để luồng nhận thấy disconnect và dọn dẹp
+                self.close()
+                return
+
+    def close(self):
+        if self.outbound is not None:
+            self.outbound.close()
+        # shutdown trước: luồng nhận đang chặn trong recv() thấy EOF ngay và tự dọn dẹp
+        try: self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+        self.sock.close()
+
+    def sendall(self, data):
+        """
+        Ghi thô (upload file kiểu cũ gửi raw bytes ngay sau FILE_UPLOAD): khi đã có hàng đợi gửi
+        thì phải xếp sau các frame đang chờ, nếu không raw bytes sẽ chen lên trước header.
+        """
+        if self.outbound is None:
+            return self.sock.sendall(data)
+        with self.send_lock:
+            self._write(bytes(data))
+
+    def recv(self, bufsize, *args):
+        """
+        recv thô (vd. upload file kiểu cũ gửi raw bytes ngay sau FILE_UPLOAD):
+        phải trả phần đã nằm sẵn trong recv_buffer trước, nếu không sẽ mất dữ liệu.
+        """
+        if self.recv_buffer.pending:
+            return self.recv_buffer.take(bufsize)
+        return self.sock.recv(bufsize, *args)
+
+    def __getattr__(self, name):
+        # sendall, recv, close, getpeername, fileno... -> socket gốc
+        return getattr(self.sock, name)
+
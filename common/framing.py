@@ -0,0 +1,361 @@
+"""
+common/framing.py - Encoder/Decoder frame kiểu sans-I/O (không tự đọc/ghi socket)
+
+FrameDecoder nhận từng mẩu bytes bất kỳ (feed) hoặc cho phép ghi thẳng vào buffer
+của nó (get_buffer/buffer_updated - cùng interface với asyncio.BufferedProtocol),
+giữ trạng thái giữa các lần gọi và trả ra các frame (msg_type, data) hoàn chỉnh.
+Dùng được với socket blocking, selectors lẫn asyncio.
+"""
+
+import json
+import struct
+import zlib
+
+from common.codecs import DEFAULT_CODEC
+from common.config import MAX_DECOMPRESSED_SIZE
+from common.protocol import Protocol, MessageType, CODE_TYPES
+
+_LENGTH = struct.Struct(">I")
+
+
+class FrameDecoder:
+    INITIAL_SIZE = 16 * 1024
+    # Buffer rỗng mà vẫn lớn hơn mức này (sau 1 frame lớn) thì trả bộ nhớ lại
+    MAX_IDLE_SIZE = 256 * 1024
+    # Khoảng trống tối thiểu / tối đa mỗi lần get_buffer
+    MIN_READ_SIZE = 4096
+    MAX_READ_SIZE = 1024 * 1024
+
+    def __init__(self, codec=None, size=INITIAL_SIZE, max_decompressed=MAX_DECOMPRESSED_SIZE):
+        self.codec = codec
+        # Context giải nén của kết nối (feature "deflate"), phải giải nén đúng thứ tự frame
+        self.decompressor = None
+        # Thân 1 frame nén giải ra tối đa chừng này byte
+        self.max_decompressed = max_decompressed
+        # Lý do context giải nén hỏng (None = bình thường). Đã hỏng thì mọi frame nén sau đó
+        # cũng giải sai -> chủ sở hữu phải đóng kết nối (SessionState._decode trả về (None, None))
+        self.broken = None
+        # "ack" đi kèm envelope của frame vừa decode (feature "resume"), None nếu không có
+        self.peer_ack = None
+        # Server bật: binary frame VIDEO_DATA/AUDIO_DATA trả ra RelayFrame (chuyển tiếp nguyên frame)
+        self.cut_through = False
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # Vị trí byte chưa đọc đầu tiên
+        self._end = 0    # Vị trí sau byte dữ liệu cuối cùng
+
+    # --- TRẠNG THÁI BUFFER ---
+
+    @property
+    def capacity(self):
+        return len(self._buf)
+
+    @property
+    def pending(self):
+        """Số byte đã nhận nhưng chưa tách thành frame"""
+        return self._end - self._start
+
+    def _needed(self):
+        """Số byte cần có để tách được frame kế tiếp"""
+        pending = self._end - self._start
+        if pending < 4:
+            return 4
+        word = _LENGTH.unpack_from(self._view, self._start)[0]
+        return 4 + (word & Protocol.LENGTH_MASK)
+
+    def _reallocate(self, size):
+        """Chuyển dữ liệu chưa đọc sang buffer mới (không resize tại chỗ vì memoryview đang được export)"""
+        pending = self._end - self._start
+        buf = bytearray(size)
+        buf[:pending] = self._view[self._start:self._end]
+        self._buf = buf
+        self._view = memoryview(buf)
+        self._start = 0
+        self._end = pending
+
+    def _reserve(self, free):
+        """Đảm bảo còn ít nhất `free` byte trống sau _end"""
+        if self._start == self._end:
+            self._start = self._end = 0
+            if len(self._buf) > self.MAX_IDLE_SIZE and free <= self.INITIAL_SIZE:
+                self._reallocate(self.INITIAL_SIZE)
+
+        if len(self._buf) - self._end >= free:
+            return
+
+        pending = self._end - self._start
+        if pending + free > len(self._buf):
+            # Frame lớn hơn buffer -> cấp phát buffer lớn hơn (gấp đôi để tránh grow liên tục)
+            self._reallocate(max(pending + free, 2 * len(self._buf)))
+        else:
+            # Dồn phần dữ liệu còn lại về đầu buffer (tobytes để tránh copy chồng vùng nhớ)
+            self._buf[:pending] = self._view[self._start:self._end].tobytes()
+            self._start, self._end = 0, pending
+
+    # --- NẠP DỮ LIỆU ---
+
+    def get_buffer(self, sizehint=-1):
+        """
+        Vùng nhớ trống để recv_into ghi thẳng vào (asyncio.BufferedProtocol.get_buffer).
+        Đủ chỗ cho cả phần còn thiếu của frame hiện tại để frame lớn không phải đọc nhiều lần
+        (tối đa MAX_READ_SIZE: raw bytes upload kiểu cũ bị đọc nhầm thành header không được
+        khiến buffer phình lên hàng trăm MB).
+        """
+        missing = min(self._needed() - (self._end - self._start), self.MAX_READ_SIZE)
+        self._reserve(max(sizehint, missing, self.MIN_READ_SIZE))
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """Báo đã ghi nbytes vào vùng get_buffer() trả về"""
+        self._end += nbytes
+
+    def feed(self, data):
+        """Nạp 1 mẩu bytes bất kỳ, trả về list các frame (msg_type, data) đã hoàn chỉnh"""
+        n = len(data)
+        self._reserve(n)
+        self._view[self._end:self._end + n] = data
+        self._end += n
+        return list(self)
+
+    def take(self, n):
+        """Lấy tối đa n byte thô đang nằm trong buffer (không tách frame)"""
+        n = min(n, self._end - self._start)
+        data = self._view[self._start:self._start + n].tobytes()
+        self._start += n
+        return data
+
+    # --- TÁCH FRAME ---
+
+    def next_raw_frame(self):
+        """
+        Tách 1 frame nếu đã đủ dữ liệu.
+        Returns: (length word, memoryview thân frame) hoặc None nếu chưa đủ.
+        memoryview chỉ hợp lệ tới lần nạp dữ liệu tiếp theo.
+        """
+        pending = self._end - self._start
+        if pending < 4:
+            return None
+        word = _LENGTH.unpack_from(self._view, self._start)[0]
+        total = 4 + (word & Protocol.LENGTH_MASK)
+        if pending < total:
+            return None
+
+        body = self._view[self._start + 4:self._start + total]
+        self._start += total
+        return word, body
+
+    def decode_frame(self, word, body):
+        """Decode thân frame theo loại frame (binary / nén / codec của phiên)"""
+        self.peer_ack = None
+        if word & Protocol.BINARY_FRAME_BIT:
+            if self.cut_through:
+                relay = RelayFrame.parse(word, body)
+                if relay is not None:
+                    return relay.msg_type, relay
+            return Protocol.decode_binary_message(body)
+        if word & Protocol.COMPRESSED_BIT:
+            if self.broken is not None:
+                return MessageType.ERROR, self.broken
+            if self.decompressor is None:
+                return MessageType.ERROR, "Nhận frame nén khi chưa thương lượng deflate"
+            try:
+                body = self.decompressor.decompress(body, self.max_decompressed)
+                if self.decompressor.unconsumed_tail:
+                    raise ValueError(f"Frame giải nén vượt quá {self.max_decompressed} byte")
+            except (zlib.error, ValueError) as e:
+                # Dữ liệu nén hỏng / giải ra quá lớn: context đã lệch với bên gửi (bỏ dở phần còn lại
+                # hoặc zlib ở trạng thái lỗi), không thể giải tiếp frame nén nào nữa
+                self.broken = f"Giải nén thất bại: {e}"
+                return MessageType.ERROR, self.broken
+        try:
+            message = Protocol.decode_envelope(body, self.codec)
+            self.peer_ack = message.get("ack")
+            return message["type"], message["data"]
+        except Exception as e:
+            return MessageType.ERROR, str(e)
+
+    def next_frame(self):
+        """Frame (msg_type, data) kế tiếp hoặc None nếu chưa đủ dữ liệu"""
+        raw = self.next_raw_frame()
+        if raw is None:
+            return None
+        return self.decode_frame(*raw)
+
+    def __iter__(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+
+class FrameEncoder:
+    """
+    Encode message thành bytes theo codec/features của phiên (không tự gửi).
+    Nếu có compressor thì các frame phải được gửi đúng thứ tự encode.
+    """
+
+    def __init__(self, codec=None, binary=True, compressor=None):
+        self.codec = codec
+        self.binary = binary
+        self.compressor = compressor
+
+    def will_be_binary(self, msg_type, data):
+        return self.binary and Protocol.is_binary(msg_type, data)
+
+    def encode(self, msg_type, data, ack=None):
+        return Protocol.encode_message(
+            msg_type, data, codec=self.codec, binary=self.binary, compressor=self.compressor, ack=ack
+        )
+
+    def encode_many(self, messages):
+        """Encode nhiều message (msg_type, data) thành 1 khối bytes liên tục"""
+        return b"".join(self.encode(msg_type, data) for msg_type, data in messages)
+
+
+class EncodedMessage:
+    """
+    1 message encode 1 lần cho mỗi wire format rồi dùng chung cho mọi người nhận (broadcast):
+    - frame(codec, binary): frame TCP chưa nén, cache theo (codec, binary)
+    - frame_for(encoder): frame cho 1 kết nối; kết nối có nén chỉ phải nén lại, không serialize lại
+    - text: JSON text cho WebSocket (thay cho ws.send_json encode riêng từng người)
+    """
+
+    def __init__(self, msg_type, data):
+        self.msg_type = msg_type
+        self.data = data
+        self._frames = {}
+        self._text = None
+
+    @property
+    def sender(self):
+        """Người gửi gốc (hàng đợi gửi đếm frame media bị bỏ theo người gửi)"""
+        return self.data.get("sender") if isinstance(self.data, dict) else None
+
+    def frame(self, codec=None, binary=True):
+        codec = codec or DEFAULT_CODEC
+        key = (codec.name, binary)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = Protocol.encode_message(
+                self.msg_type, self.data, codec=codec, binary=binary
+            )
+        return frame
+
+    def frame_for(self, encoder):
+        frame = self.frame(encoder.codec, encoder.binary)
+        # Media có thể bị hàng đợi bỏ -> không nén (xem Protocol.COMPRESSED_BIT)
+        if encoder.compressor is not None and self.msg_type not in Protocol.MEDIA_TYPES:
+            frame = Protocol.compress_frame(frame, encoder.compressor)
+        return frame
+
+    @property
+    def text(self):
+        if self._text is None:
+            # Giống Starlette send_json
+            self._text = json.dumps(self.data, separators=(",", ":"), ensure_ascii=False)
+        return self._text
+
+
+class RelayFrame(EncodedMessage):
+    """
+    Binary frame VIDEO_DATA/AUDIO_DATA chuyển tiếp kiểu cut-through (FrameDecoder.cut_through):
+    chỉ đọc header cố định (type, flags, độ dài sender/recipient) để lấy recipient,
+    payload (JPEG/PCM) không decode, không encode lại.
+    - parse(word, body): copy nguyên frame ra bytes 1 lần (độc lập với buffer nhận)
+    - stamp(sender): ghi người gửi thật vào header; client vốn đã ghi đúng tên mình thì giữ nguyên frame
+    - frame_for(encoder): kết nối hiểu binary frame nhận đúng frame đó; client cũ (JSON) / Web
+      mới phải dựng dict + Base64
+    - get("sender" / "recipient" / "channel" / "data"): đọc như dict của decode_binary_message
+    """
+
+    def __init__(self, msg_type, frame, sender, recipient, channel, payload_offset):
+        self.msg_type = msg_type
+        self._sender = sender
+        self.recipient = recipient
+        self.channel = channel
+        self._frame = frame
+        self._payload_offset = payload_offset
+        self._data = None
+        self._frames = {}
+        self._text = None
+
+    @classmethod
+    def parse(cls, word, body):
+        """RelayFrame từ thân binary frame, None nếu không phải media / header hỏng"""
+        try:
+            code, flags, sender_len, recipient_len = Protocol.BINARY_HEADER.unpack_from(body)
+            msg_type = CODE_TYPES.get(code)
+            if msg_type not in Protocol.MEDIA_TYPES:
+                return None
+            offset = _LENGTH.size + Protocol.BINARY_HEADER.size
+            frame = _LENGTH.pack(word) + body
+            channel = Protocol.CONTROL_CHANNEL
+            if flags & Protocol.FLAG_CHANNEL:
+                channel = Protocol.CHANNEL_FIELD.unpack_from(frame, offset)[0]
+                offset += Protocol.CHANNEL_FIELD.size
+            sender = frame[offset:offset + sender_len].decode(Protocol.ENCODING)
+            offset += sender_len
+            recipient = frame[offset:offset + recipient_len].decode(Protocol.ENCODING)
+            offset += recipient_len
+        except (struct.error, UnicodeDecodeError):
+            return None
+        if offset > len(frame):
+            return None
+        return cls(msg_type, frame, sender or None, recipient or None, channel, offset)
+
+    @property
+    def sender(self):
+        return self._sender
+
+    @property
+    def payload(self):
+        return memoryview(self._frame)[self._payload_offset:]
+
+    def stamp(self, sender):
+        """Đóng dấu người gửi (không tin tên client tự ghi). Returns: self"""
+        if sender == self.sender:
+            return self
+        payload = self.payload
+        self._frame = Protocol.encode_binary_message(
+            self.msg_type, payload, sender=sender, recipient=self.recipient, channel=self.channel
+        )
+        self._payload_offset = len(self._frame) - len(payload)
+        self._sender = sender
+        self._data = None
+        self._frames.clear()
+        self._text = None
+        return self
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = {
+                "sender": self.sender,
+                "recipient": self.recipient,
+                "channel": self.channel,
+                "data": self.payload.tobytes(),
+            }
+        return self._data
+
+    def get(self, key, default=None):
+        if key == "data":
+            return self.data["data"]
+        value = getattr(self, key, None) if key in ("sender", "recipient", "channel") else None
+        return default if value is None else value
+
+    def frame(self, codec=None, binary=True):
+        if binary:
+            return self._frame
+        return super().frame(codec, binary)
+
+    @property
+    def text(self):
+        if self._text is None:
+            # Web chỉ cần người gửi + Base64 (như relay_media gửi cho Web trước đây)
+            self._text = json.dumps({
+                "type": self.msg_type,
+                "sender": self.sender,
+                "data": Protocol.encode_base64(self.payload.tobytes()),
+            }, separators=(",", ":"), ensure_ascii=False)
+        return self._text
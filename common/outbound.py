@@ -0,0 +1,309 @@
+"""
+common/outbound.py - Hàng đợi gửi của 1 kết nối: gộp nhiều frame nhỏ thành 1 lần ghi (sendmsg),
+giới hạn theo lớp message để 1 client nhận chậm không kéo chậm bên gửi
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+from common.config import (
+    COALESCE_DELAY, COALESCE_MAX_BYTES,
+    OUTBOUND_CONTROL_LIMIT, OUTBOUND_AUDIO_FRAMES, OUTBOUND_BLOCK_TIMEOUT,
+)
+from common.protocol import MessageType
+
+# Số buffer tối đa cho 1 lần sendmsg (IOV_MAX trên Linux/macOS là 1024)
+MAX_IOV = 1024
+
+
+def send_frames(sock, frames):
+    """
+    Ghi nhiều frame bằng 1 syscall scatter/gather (sendmsg), xử lý cả trường hợp ghi thiếu.
+    Windows không có sendmsg -> nối lại rồi sendall.
+    """
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(frames))
+        return
+
+    pending = deque(memoryview(f) for f in frames)
+    while pending:
+        batch = [pending[i] for i in range(min(len(pending), MAX_IOV))]
+        sent = sock.sendmsg(batch)
+        # Bỏ các frame đã gửi hết, cắt phần đã gửi của frame dở dang
+        while sent:
+            head = pending[0]
+            if sent >= len(head):
+                sent -= len(head)
+                pending.popleft()
+            else:
+                pending[0] = head[sent:]
+                sent = 0
+
+
+def on_event_loop():
+    """Thread hiện tại đang chạy event loop -> không được chặn chờ hàng đợi gửi"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class MediaLanes:
+    """
+    Media chờ gửi của 1 kết nối (dùng chung cho OutboundQueue, AsyncConnection, ReactorConnection, WebOutbound):
+    - video: hộp thư 1 chỗ, frame mới thay frame chưa kịp gửi -> độ trễ không tăng theo hàng đợi,
+      người nhận chậm chỉ thấy ít fps hơn
+    - audio: FIFO ngắn (audio_limit chunk), đầy thì bỏ chunk cũ nhất (bỏ cả chuỗi gây giật tiếng)
+    Frame bị bỏ được đếm theo người gửi (take_dropped) để server báo lại MEDIA_FEEDBACK.
+    Không tự khoá: chủ sở hữu gọi khi đang giữ lock của mình (hoặc trên event loop).
+    """
+
+    def __init__(self, audio_limit=OUTBOUND_AUDIO_FRAMES):
+        self.audio_limit = audio_limit
+        self.video = None           # (frame, sender) mới nhất chưa gửi
+        self.audio = deque()        # (frame, sender)
+        self.nbytes = 0
+        self.dropped = 0
+        self._dropped_by = {}       # {sender: [video, audio]} chưa báo
+
+    def __len__(self):
+        return len(self.audio) + (self.video is not None)
+
+    def put(self, frame, msg_type, sender=None):
+        """Returns: frame bị bỏ để nhường chỗ (None nếu không bỏ frame nào)"""
+        if msg_type == MessageType.VIDEO_DATA:
+            old, self.video = self.video, (frame, sender)
+            lane = 0
+        else:
+            old = self.audio.popleft() if len(self.audio) >= self.audio_limit else None
+            self.audio.append((frame, sender))
+            lane = 1
+        self.nbytes += len(frame)
+        if old is None:
+            return None
+        self.nbytes -= len(old[0])
+        self.dropped += 1
+        counts = self._dropped_by.get(old[1])
+        if counts is None:
+            counts = self._dropped_by[old[1]] = [0, 0]
+        counts[lane] += 1
+        return old[0]
+
+    def take(self):
+        """Mọi frame đang chờ: audio trước (nhạy trễ hơn), rồi frame video mới nhất"""
+        frames = [frame for frame, _ in self.audio]
+        self.audio.clear()
+        if self.video is not None:
+            frames.append(self.video[0])
+            self.video = None
+        self.nbytes = 0
+        return frames
+
+    def pop(self):
+        """1 frame kế tiếp theo cùng thứ tự như take() (WebOutbound ghi từng message)"""
+        if self.audio:
+            frame = self.audio.popleft()[0]
+        else:
+            frame, self.video = self.video[0], None
+        self.nbytes -= len(frame)
+        return frame
+
+    def take_dropped(self, sender):
+        """(video, audio) của `sender` đã bị bỏ kể từ lần gọi trước"""
+        counts = self._dropped_by.pop(sender, None)
+        return (0, 0) if counts is None else tuple(counts)
+
+    def clear(self):
+        self.video = None
+        self.audio.clear()
+        self.nbytes = 0
+
+
+class OutboundQueue:
+    """
+    Frame đã encode chờ gửi, chia theo channel. Writer lấy ra theo lô: đợi thêm tối đa
+    max_delay kể từ frame đầu tiên (hoặc tới khi đủ max_bytes) để gộp các frame nhỏ.
+
+    Xếp lịch công bằng giữa các channel: channel 0 (chat, presence, gọi điện) luôn đi trước,
+    rồi tới media, các channel dữ liệu (upload file) luân phiên mỗi lượt 1 frame.
+
+    Mỗi lớp message có giới hạn + chính sách riêng khi client nhận không kịp:
+    - channel 0: tối đa control_limit byte; đầy thì put() chờ tối đa block_timeout,
+      vẫn đầy -> overflowed = True, bên gửi ngắt kết nối (slow consumer)
+    - media: MediaLanes - video chỉ giữ frame mới nhất, audio tối đa audio_limit chunk
+    - channel dữ liệu: tối đa channel_limit byte, bên gửi gọi wait_for_room() trước khi put()
+      để bị chặn lại khi channel đã đầy (backpressure)
+    """
+
+    CONTROL_CHANNEL = 0
+
+    def __init__(self, max_delay=COALESCE_DELAY, max_bytes=COALESCE_MAX_BYTES, channel_limit=4 * COALESCE_MAX_BYTES,
+                 control_limit=OUTBOUND_CONTROL_LIMIT, audio_limit=OUTBOUND_AUDIO_FRAMES,
+                 block_timeout=OUTBOUND_BLOCK_TIMEOUT):
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.channel_limit = channel_limit
+        self.control_limit = control_limit
+        self.block_timeout = block_timeout
+        self._media = MediaLanes(audio_limit)
+        self._channels = {}        # {channel: deque(frame)}
+        self._channel_bytes = {}   # {channel: số byte đang chờ}
+        self._ready = deque()      # Vòng luân phiên các channel dữ liệu đang có frame
+        self._count = 0
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self.closed = False
+
+        # Thống kê (stats())
+        self.blocked = 0           # Số lần bên gửi phải chờ vì channel 0 đầy
+        self.overflowed = False    # Channel 0 vẫn đầy sau block_timeout
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def queued_bytes(self):
+        return self._bytes
+
+    @property
+    def media_dropped(self):
+        """Frame media bị bỏ vì client nhận chậm"""
+        return self._media.dropped
+
+    def take_media_dropped(self, sender):
+        with self._cond:
+            return self._media.take_dropped(sender)
+
+    def stats(self):
+        """Độ sâu hàng đợi + số frame bị bỏ (giống nhau cho mọi kiểu kết nối)"""
+        with self._cond:
+            return {
+                "frames": self._count,
+                "bytes": self._bytes,
+                "media_dropped": self._media.dropped,
+                "blocked": self.blocked,
+                "overflowed": self.overflowed,
+            }
+
+    def wait_for_room(self, channel):
+        """Chặn tới khi channel dữ liệu còn chỗ (không cho 1 file lớn dồn hết vào RAM)"""
+        if channel == self.CONTROL_CHANNEL:
+            return
+        with self._cond:
+            while not self.closed and self._channel_bytes.get(channel, 0) >= self.channel_limit:
+                self._cond.wait()
+
+    def put(self, frame, channel=CONTROL_CHANNEL, media=None, block=True, sender=None):
+        """
+        Xếp 1 frame. media: VIDEO_DATA / AUDIO_DATA (sender: người gửi gốc, để đếm frame bị bỏ).
+        block=False: không được chờ (đang chạy trên event loop) -> channel 0 đầy
+        là overflow ngay. Returns: False nếu queue đã đóng hoặc vừa overflow.
+        """
+        with self._cond:
+            if self.closed:
+                return False
+
+            if media:
+                # Video/audio cũ không còn giá trị: thay / bỏ frame cũ, không chặn bên gửi
+                dropped = self._media.put(frame, media, sender)
+                if dropped is None:
+                    self._count += 1
+                self._bytes += len(frame) - (len(dropped) if dropped is not None else 0)
+                if self._count == 1 or self._bytes >= self.max_bytes:
+                    self._cond.notify_all()
+                return True
+            elif channel == self.CONTROL_CHANNEL and self._channel_bytes.get(channel, 0) >= self.control_limit:
+                if block:
+                    self.blocked += 1
+                    deadline = time.monotonic() + self.block_timeout
+                    while not self.closed and self._channel_bytes.get(channel, 0) >= self.control_limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                if self.closed:
+                    return False
+                if self._channel_bytes.get(channel, 0) >= self.control_limit:
+                    self.overflowed = True
+                    return False
+
+            queue = self._channels.get(channel)
+            if queue is None:
+                queue = self._channels[channel] = deque()
+            if not queue and channel > self.CONTROL_CHANNEL:
+                self._ready.append(channel)
+            queue.append(frame)
+            self._channel_bytes[channel] = self._channel_bytes.get(channel, 0) + len(frame)
+            self._count += 1
+            self._bytes += len(frame)
+
+            # Chỉ đánh thức writer khi có frame đầu tiên hoặc đã đủ 1 lô
+            if self._count == 1 or self._bytes >= self.max_bytes:
+                self._cond.notify_all()
+            return True
+
+    def _pop(self, channel):
+        queue = self._channels[channel]
+        frame = queue.popleft()
+        self._channel_bytes[channel] -= len(frame)
+        self._count -= 1
+        self._bytes -= len(frame)
+        if not queue:
+            del self._channels[channel]
+            del self._channel_bytes[channel]
+        return frame
+
+    def take_batch(self):
+        """Chặn tới khi có 1 lô frame để gửi. Returns: list frame, hoặc None khi queue đã đóng."""
+        with self._cond:
+            while not self._count and not self.closed:
+                self._cond.wait()
+            if self.closed:
+                return None
+
+            # Đợi gộp thêm frame trong khoảng max_delay
+            deadline = time.monotonic() + self.max_delay
+            while self._bytes < self.max_bytes and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self.closed:
+                return None
+
+            # 1. Toàn bộ channel điều khiển, rồi media
+            batch = []
+            while self.CONTROL_CHANNEL in self._channels:
+                batch.append(self._pop(self.CONTROL_CHANNEL))
+            media = self._media.take()
+            self._count -= len(media)
+            self._bytes -= sum(len(f) for f in media)
+            batch.extend(media)
+
+            # 2. Luân phiên các channel dữ liệu, mỗi lượt 1 frame, tới khi đủ 1 lô
+            size = sum(len(f) for f in batch)
+            while self._ready and size < self.max_bytes:
+                channel = self._ready.popleft()
+                frame = self._pop(channel)
+                batch.append(frame)
+                size += len(frame)
+                if channel in self._channels:
+                    self._ready.append(channel)
+
+            # Đánh thức bên gửi đang bị backpressure / chờ channel 0
+            self._cond.notify_all()
+            return batch
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._media.clear()
+            self._channels.clear()
+            self._channel_bytes.clear()
+            self._ready.clear()
+            self._count = 0
+            self._bytes = 0
+            self._cond.notify_all()
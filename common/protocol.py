@@ -2,8 +2,16 @@
 Protocol cho ứng dụng chat - Định nghĩa cấu trúc message (FULL FIXED)
 """
 
-import json
 import struct
+import zlib
+
+from common.codecs import CODECS, DEFAULT_CODEC, choose_codec
+from common.config import COMPRESSION_LEVEL, COMPRESSION_THRESHOLD
+
+# Version 1: client cũ (chỉ JSON, không thương lượng)
+# Version 2: thương lượng codec + features lúc LOGIN
+PROTOCOL_VERSION = 2
+FEATURES = frozenset({"binary", "deflate", "channels", "resume", "presence", "heartbeat"})
 
 class MessageType:
     """Các loại message"""
@@ -11,6 +19,7 @@ class MessageType:
     LOGIN = "LOGIN"
     LOGIN_SUCCESS = "LOGIN_SUCCESS"
     LOGIN_FAILURE = "LOGIN_FAILURE"
+    LOGIN_FAILED = LOGIN_FAILURE   # Tên cũ ChatServer / ChatClient đang dùng
     
     # Text messages
     TEXT = "TEXT"
@@ -28,6 +37,13 @@ class MessageType:
     # User management
     LIST_USERS = "LIST_USERS"
     USER_INFO = "USER_INFO"
+    USER_ONLINE = "USER_ONLINE"
+    USER_OFFLINE = "USER_OFFLINE"
+    
+    # Rooms (chat nhóm theo phòng; TEXT/FILE_INFO kèm "room" chỉ gửi cho thành viên)
+    ROOM_CREATE = "ROOM_CREATE"
+    ROOM_JOIN = "ROOM_JOIN"
+    ROOM_LEAVE = "ROOM_LEAVE"
     
     # Video/Audio Call & WebRTC
     CALL_REQUEST = "CALL_REQUEST"
@@ -35,18 +51,69 @@ class MessageType:
     CALL_REJECT = "CALL_REJECT"
     CALL_END = "CALL_END"
     CALL_BUSY = "CALL_BUSY"
+    CALL_KEYFRAME = "CALL_KEYFRAME"  # Người nhận video lỡ frame, xin peer gửi keyframe: {"recipient"}
     
     # [QUAN TRỌNG] Thêm dòng này để sửa lỗi AttributeError
     CALL_ICE_CANDIDATE = "CALL_ICE_CANDIDATE" 
+    WEBRTC_OFFER = "WEBRTC_OFFER"
+    WEBRTC_ANSWER = "WEBRTC_ANSWER"
+    WEBRTC_ICE = "WEBRTC_ICE"
     
     # Media Data
     VIDEO_DATA = "VIDEO_DATA"
     AUDIO_DATA = "AUDIO_DATA"
+    MEDIA_FEEDBACK = "MEDIA_FEEDBACK"  # Server báo người gửi: {"peer", "video_dropped", "audio_dropped", "interval"}
     
     # System
     ERROR = "ERROR"
     PING = "PING"
     PONG = "PONG"
+    ACK = "ACK"                    # Client xác nhận đã nhận tới seq nào (feature "resume")
+    SERVER_DRAIN = "SERVER_DRAIN"  # Server sắp restart: kết nối lại sau "reconnect_after" giây
+
+
+# Mã số (1 byte) cho từng loại message, dùng trong header của binary frame.
+# Chỉ được THÊM mã mới, không đổi mã cũ để không phá client đang chạy.
+TYPE_CODES = {
+    MessageType.LOGIN: 1,
+    MessageType.LOGIN_SUCCESS: 2,
+    MessageType.LOGIN_FAILURE: 3,
+    MessageType.TEXT: 10,
+    MessageType.PRIVATE_TEXT: 11,
+    MessageType.FILE_UPLOAD: 20,
+    MessageType.FILE_DOWNLOAD: 21,
+    MessageType.FILE_INFO: 22,
+    MessageType.FILE_DATA: 23,
+    MessageType.FILE_CHUNK: 24,
+    MessageType.FILE_COMPLETE: 25,
+    MessageType.FILE_ERROR: 26,
+    MessageType.LIST_USERS: 30,
+    MessageType.USER_INFO: 31,
+    MessageType.USER_ONLINE: 32,
+    MessageType.USER_OFFLINE: 33,
+    MessageType.CALL_REQUEST: 40,
+    MessageType.CALL_ACCEPT: 41,
+    MessageType.CALL_REJECT: 42,
+    MessageType.CALL_END: 43,
+    MessageType.CALL_BUSY: 44,
+    MessageType.CALL_ICE_CANDIDATE: 45,
+    MessageType.WEBRTC_OFFER: 46,
+    MessageType.WEBRTC_ANSWER: 47,
+    MessageType.WEBRTC_ICE: 48,
+    MessageType.CALL_KEYFRAME: 49,
+    MessageType.VIDEO_DATA: 50,
+    MessageType.AUDIO_DATA: 51,
+    MessageType.MEDIA_FEEDBACK: 52,
+    MessageType.ERROR: 60,
+    MessageType.PING: 61,
+    MessageType.PONG: 62,
+    MessageType.ACK: 63,
+    MessageType.SERVER_DRAIN: 64,
+    MessageType.ROOM_CREATE: 70,
+    MessageType.ROOM_JOIN: 71,
+    MessageType.ROOM_LEAVE: 72,
+}
+CODE_TYPES = {code: msg_type for msg_type, code in TYPE_CODES.items()}
 
 class Protocol:
     """Xử lý encode/decode message"""
@@ -54,36 +121,227 @@ class Protocol:
     HEADER_SIZE = 4  # 4 bytes cho message length
     ENCODING = "utf-8"
     
+    # Có 2 loại frame, phân biệt bằng bit cao nhất của 4 byte length:
+    #   JSON frame:   [4 bytes length][JSON {"type", "data"}]
+    #   Binary frame: [4 bytes 0x80000000 | length][binary header][sender][recipient][raw payload]
+    # Binary header: type code (1 byte), flags (1 byte), độ dài sender (1 byte), độ dài recipient (1 byte)
+    #   flags & FLAG_CHANNEL: sau header có thêm 2 byte channel ID (không có = channel 0, kênh điều khiển)
+    # Bit 30: thân JSON frame đã nén deflate bằng context riêng của kết nối (feature "deflate").
+    #   Media (MEDIA_TYPES) không bao giờ nén: hàng đợi gửi có thể bỏ frame media, mà frame nén
+    #   bị bỏ thì context nén 2 phía lệch nhau -> mọi frame nén sau đó giải nén hỏng
+    BINARY_FRAME_BIT = 0x80000000
+    COMPRESSED_BIT = 0x40000000
+    LENGTH_MASK = 0x3FFFFFFF
+    BINARY_HEADER = struct.Struct(">BBBB")
+    CHANNEL_FIELD = struct.Struct(">H")
+    FLAG_CHANNEL = 0x01
+    
+    # Các loại message không đánh số thứ tự / không phát lại khi resume (media cũ thì bỏ luôn)
+    UNSEQUENCED_TYPES = frozenset({
+        MessageType.VIDEO_DATA,
+        MessageType.AUDIO_DATA,
+        MessageType.MEDIA_FEEDBACK,
+        MessageType.CALL_KEYFRAME,
+        MessageType.PING,
+        MessageType.PONG,
+        MessageType.ACK,
+    })
+    
+    # Media real-time: client nhận chậm thì bỏ frame cũ thay vì dồn hàng đợi (OutboundQueue)
+    MEDIA_TYPES = frozenset({
+        MessageType.VIDEO_DATA,
+        MessageType.AUDIO_DATA,
+    })
+    
+    # Lệnh vào/ra room (server/rooms.py)
+    ROOM_COMMANDS = frozenset({
+        MessageType.ROOM_CREATE,
+        MessageType.ROOM_JOIN,
+        MessageType.ROOM_LEAVE,
+    })
+    
+    # Channel 0: chat/presence/gọi điện. Mỗi upload file chạy trên 1 channel riêng (1..65535)
+    CONTROL_CHANNEL = 0
+    
+    # Các loại message gửi payload dạng raw bytes (không JSON, không Base64)
+    BINARY_TYPES = frozenset({
+        MessageType.VIDEO_DATA,
+        MessageType.AUDIO_DATA,
+        MessageType.FILE_CHUNK,
+    })
+    
+    @staticmethod
+    def channel_of(msg_type, data):
+        """Channel mà frame này được xếp lịch gửi (chỉ binary frame mới nằm ngoài channel 0)"""
+        if Protocol.is_binary(msg_type, data):
+            return data.get("channel", Protocol.CONTROL_CHANNEL)
+        return Protocol.CONTROL_CHANNEL
+    
+    @staticmethod
+    def is_binary(msg_type, data):
+        """Message này có đi bằng binary frame không (chọn theo msg_type + payload là bytes)"""
+        return (
+            msg_type in Protocol.BINARY_TYPES
+            and isinstance(data, dict)
+            and isinstance(data.get("data"), (bytes, bytearray, memoryview))
+        )
+    
+    # --- HANDSHAKE (LOGIN / LOGIN_SUCCESS) ---
+    
+    @staticmethod
+    def handshake_offer():
+        """Các trường client gửi kèm LOGIN để thương lượng"""
+        return {
+            "version": PROTOCOL_VERSION,
+            "codecs": list(CODECS),
+            "features": sorted(FEATURES),
+        }
+    
+    @staticmethod
+    def negotiate_session(login_data, features=FEATURES):
+        """
+        Server chọn version/codec/features từ LOGIN của client.
+        Client cũ không gửi "version" -> v1 + JSON, không có feature nào.
+        features: các feature server này bật (mặc định tất cả)
+        """
+        client_version = login_data.get("version", 1) if isinstance(login_data, dict) else 1
+        if client_version < 2:
+            return {"version": 1, "codec": DEFAULT_CODEC.name, "features": []}
+        
+        return {
+            "version": min(client_version, PROTOCOL_VERSION),
+            "codec": choose_codec(login_data.get("codecs")).name,
+            "features": sorted(features & set(login_data.get("features") or ())),
+        }
+    
+    # --- ENCODE / DECODE ---
+    
+    @staticmethod
+    def new_compressor(level=None):
+        """Context nén deflate (raw, không header zlib) dùng suốt 1 kết nối"""
+        return zlib.compressobj(COMPRESSION_LEVEL if level is None else level, zlib.DEFLATED, -15)
+    
+    @staticmethod
+    def new_decompressor():
+        return zlib.decompressobj(-15)
+    
     @staticmethod
-    def encode_message(msg_type, data):
+    def encode_message(msg_type, data, codec=None, binary=True, compressor=None, ack=None):
         """
         Encode message thành bytes
         Format: [4 bytes length][JSON data]
+        (Media/file chunk có payload bytes sẽ tự chuyển sang binary frame)
+        - codec: codec của phiên (mặc định JSON)
+        - binary: phía nhận có hiểu binary frame không (client cũ -> Base64 trong JSON)
+        - compressor: context nén của kết nối; chỉ nén thân >= COMPRESSION_THRESHOLD, không nén media.
+          Các frame dùng chung 1 context nên phải gửi đúng thứ tự đã encode, không được bỏ frame nào.
+        - ack: seq đã nhận, gửi kèm trong envelope JSON (client cũ bỏ qua key lạ)
         """
+        if Protocol.is_binary(msg_type, data):
+            if binary:
+                return Protocol.encode_binary_message(
+                    msg_type, data["data"],
+                    sender=data.get("sender"), recipient=data.get("recipient"),
+                    channel=data.get("channel", Protocol.CONTROL_CHANNEL)
+                )
+            data = dict(data, data=Protocol.encode_base64(bytes(data["data"])))
+        
         message = {
             "type": msg_type,
             "data": data
         }
+        if ack is not None:
+            message["ack"] = ack
+        
+        body = (codec or DEFAULT_CODEC).dumps(message)
         
-        # ensure_ascii=False để hỗ trợ tiếng Việt
-        json_str = json.dumps(message, ensure_ascii=False)
-        json_bytes = json_str.encode(Protocol.ENCODING)
+        flags = 0
+        if compressor is not None and msg_type not in Protocol.MEDIA_TYPES and len(body) >= COMPRESSION_THRESHOLD:
+            body = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            flags = Protocol.COMPRESSED_BIT
         
         # Thêm header chứa độ dài message
-        length = len(json_bytes)
-        header = struct.pack(">I", length)  # Big-endian unsigned int
+        header = struct.pack(">I", flags | len(body))  # Big-endian unsigned int
+        
+        return header + body
+    
+    @staticmethod
+    def compress_frame(frame, compressor):
+        """Nén 1 JSON frame đã encode sẵn (frame encode 1 lần rồi gửi cho nhiều kết nối có nén)"""
+        word = struct.unpack_from(">I", frame)[0]
+        if word & (Protocol.BINARY_FRAME_BIT | Protocol.COMPRESSED_BIT):
+            return frame
+        if len(frame) - Protocol.HEADER_SIZE < COMPRESSION_THRESHOLD:
+            return frame
         
-        return header + json_bytes
+        body = compressor.compress(memoryview(frame)[Protocol.HEADER_SIZE:]) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return struct.pack(">I", Protocol.COMPRESSED_BIT | len(body)) + body
+    
+    @staticmethod
+    def encode_binary_message(msg_type, payload, sender=None, recipient=None, flags=0, channel=0):
+        """
+        Encode binary frame: payload giữ nguyên dạng bytes
+        Format: [4 bytes 0x80000000 | length][type][flags][len sender][len recipient]([channel])[sender][recipient][payload]
+        """
+        sender_bytes = (sender or "").encode(Protocol.ENCODING)
+        recipient_bytes = (recipient or "").encode(Protocol.ENCODING)
+        if len(sender_bytes) > 255 or len(recipient_bytes) > 255:
+            raise ValueError("Tên sender/recipient quá dài cho binary frame")
+        
+        channel_bytes = b""
+        if channel:
+            flags |= Protocol.FLAG_CHANNEL
+            channel_bytes = Protocol.CHANNEL_FIELD.pack(channel)
+        
+        header = Protocol.BINARY_HEADER.pack(
+            TYPE_CODES[msg_type], flags, len(sender_bytes), len(recipient_bytes)
+        ) + channel_bytes
+        length = len(header) + len(sender_bytes) + len(recipient_bytes) + len(payload)
+        return b"".join((
+            struct.pack(">I", Protocol.BINARY_FRAME_BIT | length),
+            header, sender_bytes, recipient_bytes, payload
+        ))
+    
+    @staticmethod
+    def decode_binary_message(data):
+        """
+        Decode phần thân của binary frame
+        Returns: (msg_type, {"sender", "recipient", "channel", "data": bytes})
+        """
+        try:
+            code, flags, sender_len, recipient_len = Protocol.BINARY_HEADER.unpack_from(data)
+            offset = Protocol.BINARY_HEADER.size
+            channel = Protocol.CONTROL_CHANNEL
+            if flags & Protocol.FLAG_CHANNEL:
+                channel = Protocol.CHANNEL_FIELD.unpack_from(data, offset)[0]
+                offset += Protocol.CHANNEL_FIELD.size
+            sender = bytes(data[offset:offset + sender_len]).decode(Protocol.ENCODING)
+            offset += sender_len
+            recipient = bytes(data[offset:offset + recipient_len]).decode(Protocol.ENCODING)
+            offset += recipient_len
+            
+            return CODE_TYPES[code], {
+                "sender": sender or None,
+                "recipient": recipient or None,
+                "channel": channel,
+                "data": bytes(data[offset:]),
+            }
+        except Exception as e:
+            return MessageType.ERROR, str(e)
     
     @staticmethod
-    def decode_message(data):
+    def decode_envelope(data, codec=None):
+        """Decode thân JSON frame thành envelope đầy đủ {"type", "data", ["ack"]}"""
+        return (codec or DEFAULT_CODEC).loads(data)
+    
+    @staticmethod
+    def decode_message(data, codec=None):
         """
         Decode message từ bytes
         Returns: (msg_type, data)
         """
         try:
-            json_str = data.decode(Protocol.ENCODING)
-            message = json.loads(json_str)
+            message = Protocol.decode_envelope(data, codec)
             return message["type"], message["data"]
         except Exception as e:
             return MessageType.ERROR, str(e)
@@ -96,20 +354,26 @@ class Protocol:
         """
         if not sock: return None, None
         try:
+            # Connection tự đọc từ buffer nhận riêng (không copy) và decode theo phiên
+            if hasattr(sock, "recv_buffer"):
+                return sock.recv_message()
+            
             # Đọc header (4 bytes)
             header = Protocol._recv_exact(sock, Protocol.HEADER_SIZE)
             if not header:
                 return None, None
             
-            # Giải mã độ dài message
-            msg_length = struct.unpack(">I", header)[0]
+            # Giải mã độ dài message + loại frame
+            word = struct.unpack(">I", header)[0]
             
             # Đọc message data
-            msg_data = Protocol._recv_exact(sock, msg_length)
-            if not msg_data:
+            msg_data = Protocol._recv_exact(sock, word & Protocol.LENGTH_MASK)
+            if msg_data is None:
                 return None, None
             
             # Decode message
+            if word & Protocol.BINARY_FRAME_BIT:
+                return Protocol.decode_binary_message(msg_data)
             return Protocol.decode_message(msg_data)
             
         except Exception as e:
@@ -117,25 +381,44 @@ class Protocol:
     
     @staticmethod
     def _recv_exact(sock, n):
-        """Nhận chính xác n bytes từ socket"""
-        data = bytearray()
-        while len(data) < n:
+        """Nhận chính xác n bytes từ socket (recv_into thẳng vào buffer, không copy lại)"""
+        data = bytearray(n)
+        view = memoryview(data)
+        received = 0
+        while received < n:
             try:
-                packet = sock.recv(n - len(data))
-                if not packet:
+                got = sock.recv_into(view[received:])
+                if not got:
                     return None
-                data.extend(packet)
+                received += got
             except:
                 return None
-        return bytes(data)
+        return data
     
     @staticmethod
     def send_message(sock, msg_type, data):
         """Gửi message qua socket"""
         if not sock: return False
         try:
-            message = Protocol.encode_message(msg_type, data)
-            sock.sendall(message)
+            # Connection/phiên tự encode theo codec, nén và giữ đúng thứ tự ghi
+            if hasattr(sock, "send_message"):
+                sock.send_message(msg_type, data)
+            else:
+                sock.sendall(Protocol.encode_message(msg_type, data))
+            return True
+        except Exception as e:
+            print(f"Error sending message: {e}")
+            return False
+    
+    @staticmethod
+    def send_encoded(sock, encoded):
+        """Gửi 1 EncodedMessage (frame đã encode sẵn, dùng chung cho nhiều người nhận)"""
+        if not sock: return False
+        try:
+            if hasattr(sock, "send_encoded"):
+                sock.send_encoded(encoded)
+            else:
+                sock.sendall(encoded.frame())
             return True
         except Exception as e:
             print(f"Error sending message: {e}")
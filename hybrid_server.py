@@ -79,20 +79,10 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
     # 1. Đăng ký user vào Bridge
     await global_bridge.add_web(username, websocket)
     
-    # 2. Gửi danh sách user hiện tại cho người mới vào
+    # 2. Người mới nhận danh sách user đầy đủ; mọi người khác nhận delta USER_ONLINE
+    # (add_web đã báo presence, user upload ẩn không nằm trong danh sách)
     try:
-        # Lấy tất cả user đang kết nối (bao gồm cả user upload ẩn)
-        all_users = list(global_bridge.tcp_clients.keys()) + list(global_bridge.web_clients.keys())
-        
-        # [FIX QUAN TRỌNG] Lọc bỏ các user ảo dùng để upload
-        # Chỉ lấy những user KHÔNG chứa chữ "_upload_"
-        real_users = [u for u in all_users if "_upload_" not in u]
-
-        # Gửi danh sách ĐÃ LỌC
-        await websocket.send_json({"type": "SYSTEM", "users": real_users})
-        
-        # Thông báo cho mọi người có user mới online (Gửi danh sách sạch)
-        await global_bridge.broadcast({"type": "SYSTEM", "users": real_users})
+        await global_bridge.web_clients.get(username, websocket).send_json(global_bridge.presence.snapshot())
     except: pass
 
     # 3. Chuyển giao việc lắng nghe cho Bridge
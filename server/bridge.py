@@ -4,7 +4,16 @@ server/bridge.py - Bridge quản lý kết nối Hybrid + Hỗ trợ Upload & Do
 """
 from fastapi import WebSocket, WebSocketDisconnect
 from common.protocol import Protocol, MessageType
+from common.framing import EncodedMessage, RelayFrame
 from common.config import SERVER_STORAGE_DIR
+from server.web_outbound import WebOutbound
+from server.registry import ConnectionRegistry
+from server.presence import PresenceService, send_presence
+from server.heartbeat import rtt_ms
+from server.rooms import RoomIndex, room_name, fan_out, handle_room_command, notify_join, notify_leave
+from server.router import ClientContext, standard_router
+from server.media import MediaFeedback
+from common.outbound import on_event_loop
 import asyncio
 import json
 import os
@@ -15,68 +24,202 @@ from datetime import datetime
 DOWNLOAD_SPEED_LIMIT = 50 * 1024  
 DOWNLOAD_CHUNK_SIZE = 8192 * 4 
 
+
+def web_type(raw_type):
+    """Loại message gửi cho Web: FILE* -> FILE_INFO, *CALL* giữ nguyên, SYSTEM, còn lại TEXT"""
+    str_type = str(raw_type).upper()
+    if "FILE" in str_type: return "FILE_INFO"
+    elif "CALL" in str_type: return raw_type
+    elif "SYSTEM" in str_type: return "SYSTEM"
+    else: return "TEXT"
+
+# Tính sẵn cho mọi MessageType: handle_message chỉ tra dict
+_WEB_TYPES = {
+    raw_type: web_type(raw_type)
+    for name, raw_type in vars(MessageType).items() if not name.startswith("_")
+}
+
+# Trường riêng chép vào payload theo loại (ngoài type/sender/recipient/message/content/timestamp)
+_PAYLOAD_FIELDS = {
+    "FILE_INFO": ("filename", "original_filename", "filesize", "file_type"),
+    "SYSTEM": ("users",),
+}
+
 class BridgeManager:
     def __init__(self):
-        self.tcp_clients = {}    # {username: socket}
-        self.web_clients = {}    # {username: websocket} (User Chat Chính)
-        self.upload_clients = {} # {username: websocket} (User Upload/Download Ẩn)
+        # Danh bạ kết nối dùng chung giữa thread TCP và event loop (copy-on-write, xem registry.py)
+        self.registry = ConnectionRegistry()
         
         self.active_uploads = {} # {username: {file_handle, filename, ...}}
+        
+        # Chế độ cluster (server/cluster.py): user ở worker khác được chuyển tiếp qua bus
+        self.bus = None
+        
+        # Online/offline gửi dạng delta có version; server gắn event loop khi khởi động
+        self.presence = PresenceService(self.all_users, self._deliver_presence)
+        
+        # Room -> thành viên (kèm kết nối để gửi): chat theo phòng chỉ chạm tới người trong phòng
+        self.rooms = RoomIndex()
+
+        # Người nhận chậm bị bỏ frame media -> báo lại người gửi (MEDIA_FEEDBACK)
+        self.media_feedback = MediaFeedback()
+
+        # Bảng định tuyến message từ Web: loại không có trong bảng đi qua handle_message
+        self.web_router = standard_router(fallback=self._on_web_message)
+        self.web_router.add("FILE_UPLOAD_START", self._on_upload_start)
+        self.web_router.add("FILE_UPLOAD_CANCEL", self._on_upload_cancel)
+        self.web_router.add("FILE_DOWNLOAD_REQUEST", self._on_download_request)
+        self.web_router.add(MessageType.LIST_USERS, self._on_list_users)
+        self.web_router.add(Protocol.ROOM_COMMANDS, self._on_room)
 
         if not os.path.exists(SERVER_STORAGE_DIR):
             os.makedirs(SERVER_STORAGE_DIR)
 
+    # --- DANH BẠ (snapshot chỉ đọc, ghi qua registry) ---
+
+    @property
+    def tcp_clients(self):
+        """{username: socket} Desktop"""
+        return self.registry.snapshot.tcp
+
+    @property
+    def web_clients(self):
+        """{username: WebOutbound} (User Chat Chính, gửi qua hàng đợi riêng)"""
+        return self.registry.snapshot.web
+
+    @property
+    def upload_clients(self):
+        """{username: websocket} (User Upload/Download Ẩn)"""
+        return self.registry.snapshot.uploads
+
     def add_tcp(self, username, socket):
-        if username in self.tcp_clients:
+        old = self.registry.set_tcp(username, socket)
+        if old is not None and old is not socket:
             print(f"🔄 [Bridge] Kick old TCP: {username}")
-            try: self.tcp_clients[username].close()
+            try: old.close()
             except: pass
-        self.tcp_clients[username] = socket
+            self._drop_rooms(username, "tcp")
+        self._publish_presence(username, True)
         print(f"✅ [Bridge] TCP User added: {username}")
 
+    # --- DANH SÁCH USER (LOCAL + CÁC WORKER KHÁC) ---
+
+    def local_users(self):
+        """User đang kết nối vào process này"""
+        return list(self.registry.snapshot.users)
+
+    def all_users(self):
+        """User online trên toàn server (cộng cả các worker khác khi chạy cluster)"""
+        users = self.local_users()
+        if self.bus is not None:
+            local = set(users)
+            users += [u for u in self.bus.remote_users if u not in local]
+        return users
+
+    def outbound_stats(self):
+        """Độ sâu hàng đợi gửi + số frame bị bỏ của từng user đang kết nối (GET /stats/outbound)"""
+        snapshot = self.registry.snapshot
+        stats = {}
+        for username, sock in snapshot.tcp.items():
+            # ResumableSession chưa gắn kết nối thì không có outbound_stats
+            get_stats = getattr(sock, "outbound_stats", None)
+            if get_stats is not None:
+                stats[username] = {"transport": "tcp", "rtt_ms": rtt_ms(sock), **get_stats()}
+        for username, ws in snapshot.web.items():
+            stats.setdefault(username, {"transport": "web", **ws.stats()})
+        return stats
+
+    def _publish_presence(self, username, online):
+        if self.bus is not None:
+            self.bus.publish("presence", username, online)
+        self.presence.changed()
+
+    def _deliver_presence(self, deltas, snapshot):
+        """1 lượt thay đổi online/offline (chạy trên event loop): Web luôn nhận delta"""
+        registry = self.registry.snapshot
+        for _, payload in deltas:
+            text = EncodedMessage(payload["type"], payload).text
+            for ws in registry.web.values():
+                try: ws.put_text(text)
+                except: pass
+        send_presence(registry.tcp.values(), deltas, snapshot)
+
+    async def kick_local(self, username):
+        """User vừa đăng nhập ở worker khác -> đóng phiên cũ ở đây"""
+        entry = self.registry.pop_user(username)
+        if entry.tcp is not None or entry.web is not None:
+            self.presence.changed()
+            self._drop_rooms(username)
+        if entry.tcp is not None:
+            print(f"🔄 [Bridge] Kick old TCP (đăng nhập ở worker khác): {username}")
+            try: entry.tcp.close()
+            except: pass
+        websocket = entry.web
+        if websocket is not None:
+            print(f"🔄 [Bridge] Kick old Web (đăng nhập ở worker khác): {username}")
+            try: await websocket.close()
+            except: pass
+
     async def add_web(self, username, websocket: WebSocket):
         await websocket.accept()
         
         # [UPDATED] Hỗ trợ cả _upload_ và _download_
         if "_upload_" in username or "_download_" in username:
-            self.upload_clients[username] = websocket
+            self.registry.set_upload(username, websocket)
             # print(f"🔌 [Bridge] Ghost connection added: {username}")
             return 
 
-        if username in self.web_clients:
+        old = self.registry.set_web(username, WebOutbound(websocket))
+        if old is not None:
             print(f"🔄 [Bridge] Kick old Web: {username}")
-            try: await self.web_clients[username].close()
+            try: await old.close()
             except: pass
-        self.web_clients[username] = websocket
+            self._drop_rooms(username, "web")
+        self._publish_presence(username, True)
         print(f"✅ [Bridge] Web User added: {username}")
 
-    async def remove_web(self, username):
+    async def remove_web(self, username, websocket=None):
+        """websocket: chỉ gỡ nếu user vẫn dùng đúng kết nối này (không gỡ nhầm phiên mới sau khi kick)"""
         # [UPDATED] Kiểm tra cả upload và download
         if "_upload_" in username or "_download_" in username:
-            if username in self.upload_clients:
-                del self.upload_clients[username]
-        elif username in self.web_clients:
-            del self.web_clients[username]
-            print(f"👋 [Bridge] Web User removed: {username}")
+            self.registry.remove_upload(username)
+        else:
+            removed = self.registry.remove_web(username, websocket)
+            if removed is not None:
+                removed.stop()
+                self._drop_rooms(username, "web")
+                self.media_feedback.forget(username)
+                self._publish_presence(username, False)
+                print(f"👋 [Bridge] Web User removed: {username}")
 
         if username in self.active_uploads:
             try: self.active_uploads[username]["file_handle"].close()
             except: pass
             del self.active_uploads[username]
 
-    def remove_tcp(self, username):
-        if username in self.tcp_clients:
-            del self.tcp_clients[username]
+    def remove_tcp(self, username, socket=None):
+        """
+        socket: chỉ gỡ nếu user vẫn dùng đúng kết nối này.
+        Returns: True nếu đã gỡ (người gọi cập nhật danh sách user)
+        """
+        if not self.registry.remove_tcp(username, socket):
+            return False
+        self._drop_rooms(username, "tcp")
+        self.media_feedback.forget(username)
+        self._publish_presence(username, False)
         print(f"👋 [Bridge] TCP User removed: {username}")
+        return True
 
     # --- MAIN LOOP CHO WEB CLIENT ---
     async def listen_to_web_user(self, username):
-        websocket = self.web_clients.get(username) or self.upload_clients.get(username)
+        snapshot = self.registry.snapshot
+        websocket = snapshot.web.get(username) or snapshot.uploads.get(username)
         
         if not websocket:
             print(f"⚠️ [Bridge] Listen failed: No socket for {username}")
             return
 
+        ctx = ClientContext(websocket, username, slot="web")
         try:
             while True:
                 message = await websocket.receive()
@@ -85,67 +228,7 @@ class BridgeManager:
                 if "text" in message and message["text"]:
                     try:
                         data = json.loads(message["text"])
-                        msg_type = data.get("type")
-
-                        if msg_type == "FILE_UPLOAD_START":
-                            meta = data.get("data")
-                            
-                            # [FIX 404] Tin tưởng tên file từ Client
-                            safe_filename = meta["filename"] 
-                            original_filename = meta.get("original_filename", safe_filename)
-
-                            filepath = os.path.join(SERVER_STORAGE_DIR, safe_filename)
-                            
-                            self.active_uploads[username] = {
-                                "file_handle": open(filepath, "wb"),
-                                "total": meta["filesize"],
-                                "received": 0,
-                                "filename": safe_filename,
-                                "original_filename": original_filename,
-                                "recipient": meta["recipient"]
-                            }
-                            print(f"🌍 Web Upload Start: {safe_filename}")
-
-                        elif msg_type == "FILE_UPLOAD_CANCEL":
-                            if username in self.active_uploads:
-                                self.active_uploads[username]["file_handle"].close()
-                                del self.active_uploads[username]
-                                print(f"❌ Web Upload Cancelled: {username}")
-
-                        # [ADDED] DOWNLOAD VỚI RATE LIMIT
-                        elif msg_type == "FILE_DOWNLOAD_REQUEST":
-                            meta = data.get("data")
-                            filename = meta["filename"]
-                            offset = meta.get("offset", 0)
-                            filepath = os.path.join(SERVER_STORAGE_DIR, filename)
-
-                            if os.path.exists(filepath):
-                                print(f"⬇️ Download Start: {filename} (Offset: {offset})")
-                                
-                                with open(filepath, "rb") as f:
-                                    f.seek(offset)
-                                    while True:
-                                        start_time = time.time() # Bấm giờ
-
-                                        chunk = f.read(DOWNLOAD_CHUNK_SIZE) 
-                                        if not chunk: break 
-                                        
-                                        await websocket.send_bytes(chunk)
-                                        
-                                        # Rate Limiting Logic
-                                        elapsed = time.time() - start_time
-                                        expected = len(chunk) / DOWNLOAD_SPEED_LIMIT
-                                        if elapsed < expected:
-                                            await asyncio.sleep(expected - elapsed)
-                                        else:
-                                            await asyncio.sleep(0)
-                                    
-                                    await websocket.send_json({"type": "DOWNLOAD_COMPLETE", "filename": filename})
-                            else:
-                                await websocket.send_json({"type": "ERROR", "message": "File not found"})
-
-                        else:
-                            await self.handle_message(data, sender=username)
+                        await self.web_router.dispatch_async(ctx, data.get("type"), data)
 
                     except json.JSONDecodeError:
                         print(f"⚠️ JSON Error from {username}: {message['text']}")
@@ -166,61 +249,134 @@ class BridgeManager:
                             del self.active_uploads[username]
 
         except WebSocketDisconnect:
-            await self.remove_web(username)
+            await self.remove_web(username, websocket)
         except Exception as e:
             # print(f"🔥 Critical Web Error {username}: {e}")
-            await self.remove_web(username)
+            await self.remove_web(username, websocket)
+
+    # --- HANDLER THEO LOẠI MESSAGE CỦA WEB: handler(ctx, msg_type, data), ctx.conn là websocket ---
+
+    def _on_upload_start(self, ctx, msg_type, data):
+        meta = data.get("data")
+        
+        # [FIX 404] Tin tưởng tên file từ Client
+        safe_filename = meta["filename"] 
+        original_filename = meta.get("original_filename", safe_filename)
+
+        filepath = os.path.join(SERVER_STORAGE_DIR, safe_filename)
+        
+        self.active_uploads[ctx.username] = {
+            "file_handle": open(filepath, "wb"),
+            "total": meta["filesize"],
+            "received": 0,
+            "filename": safe_filename,
+            "original_filename": original_filename,
+            "recipient": meta["recipient"]
+        }
+        print(f"🌍 Web Upload Start: {safe_filename}")
+
+    def _on_upload_cancel(self, ctx, msg_type, data):
+        username = ctx.username
+        if username in self.active_uploads:
+            self.active_uploads[username]["file_handle"].close()
+            del self.active_uploads[username]
+            print(f"❌ Web Upload Cancelled: {username}")
+
+    async def _on_list_users(self, ctx, msg_type, data):
+        # Client lỡ version presence -> gửi lại danh sách đầy đủ
+        await ctx.conn.send_json(self.presence.snapshot())
+
+    async def _on_room(self, ctx, msg_type, data):
+        await self.handle_room(msg_type, data, ctx.username, ctx.conn, "web")
 
-    # Trong server/bridge.py
+    # [ADDED] DOWNLOAD VỚI RATE LIMIT
+    async def _on_download_request(self, ctx, msg_type, data):
+        websocket = ctx.conn
+        meta = data.get("data")
+        filename = meta["filename"]
+        offset = meta.get("offset", 0)
+        filepath = os.path.join(SERVER_STORAGE_DIR, filename)
 
-    async def handle_message(self, message_dict, sender=None):
+        if os.path.exists(filepath):
+            print(f"⬇️ Download Start: {filename} (Offset: {offset})")
+            
+            with open(filepath, "rb") as f:
+                f.seek(offset)
+                while True:
+                    start_time = time.time() # Bấm giờ
+
+                    chunk = f.read(DOWNLOAD_CHUNK_SIZE) 
+                    if not chunk: break 
+                    
+                    await websocket.send_bytes(chunk)
+                    
+                    # Rate Limiting Logic
+                    elapsed = time.time() - start_time
+                    expected = len(chunk) / DOWNLOAD_SPEED_LIMIT
+                    if elapsed < expected:
+                        await asyncio.sleep(expected - elapsed)
+                    else:
+                        await asyncio.sleep(0)
+                
+                await websocket.send_json({"type": "DOWNLOAD_COMPLETE", "filename": filename})
+        else:
+            await websocket.send_json({"type": "ERROR", "message": "File not found"})
+
+    async def _on_web_message(self, ctx, msg_type, data):
+        """Loại còn lại (chat, gọi điện...): định tuyến qua handle_message"""
+        await self.handle_message(data, sender=ctx.username)
+
+    async def handle_message(self, message_dict, sender=None, local_only=False):
+        """local_only: message đến từ worker khác qua bus -> chỉ giao cho user ở process này"""
         try:
             raw_type = message_dict.get("type")
             recipient = message_dict.get("recipient")
             
-            # Chuẩn hóa msg_type
-            str_type = str(raw_type).upper()
-            if "FILE" in str_type: msg_type = "FILE_INFO"
-            elif "CALL" in str_type: msg_type = raw_type
-            elif "SYSTEM" in str_type: msg_type = "SYSTEM"
-            else: msg_type = "TEXT"
+            # Chuẩn hóa msg_type: tra bảng tính sẵn (loại lạ mới phải so chuỗi)
+            msg_type = _WEB_TYPES.get(raw_type) or web_type(raw_type)
 
             # Xử lý trường hợp recipient rỗng
             if recipient == "": recipient = None
+            room = None if recipient else room_name(message_dict)
 
-            # Tạo payload chuẩn để gửi đi
+            # Tạo payload chuẩn để gửi đi: trường chung + trường riêng của loại (file, danh sách user)
+            text = message_dict.get("message") or message_dict.get("content")
             payload = {
                 "type": msg_type,
                 "sender": sender,
                 "recipient": recipient,
-                "message": message_dict.get("message") or message_dict.get("content"),
-                "content": message_dict.get("message") or message_dict.get("content"),
+                "message": text,
+                "content": text,
                 "timestamp": message_dict.get("timestamp") or datetime.now().isoformat(),
-                "filename": message_dict.get("filename"),
-                "original_filename": message_dict.get("original_filename"),
-                "filesize": message_dict.get("filesize"),
-                "file_type": message_dict.get("file_type"),
-                "users": message_dict.get("users")
             }
+            for field in _PAYLOAD_FIELDS.get(msg_type, ()):
+                payload[field] = message_dict.get(field)
+            if room: payload["room"] = room
 
             # --- LOGIC XỬ LÝ ĐỊNH TUYẾN ---
             if recipient:
                 print(f"🔒 [Bridge] Private Chat: {sender} -> {recipient}")
                 
                 received = False
+                # Cả 2 kết nối của người nhận lấy từ cùng 1 snapshot
+                entry = self.registry.snapshot.get(recipient)
                 
-                # 1. Gửi cho người nhận là Web Client
-                if recipient in self.web_clients:
-                    try: 
-                        await self.web_clients[recipient].send_json(payload)
-                        received = True
-                    except: pass
+                # 1. Gửi cho người nhận là Web Client (xếp vào hàng đợi, lỗi được log)
+                if entry.web is not None and Protocol.send_message(entry.web, msg_type, payload):
+                    received = True
                 
                 # 2. Gửi cho người nhận là Desktop (TCP) Client
-                if recipient in self.tcp_clients:
-                    self._send_tcp_safe(recipient, raw_type, payload)
+                if entry.tcp is not None:
+                    Protocol.send_message(entry.tcp, raw_type, payload)
                     received = True
 
+                # 3. Người nhận đang ở worker khác (cluster) -> chuyển nguyên message qua bus
+                if not received and not local_only and self.bus is not None:
+                    owner = self.bus.owner_of(recipient)
+                    if owner is not None:
+                        self.bus.send(owner, "message", message_dict, sender)
+                        received = True
+
                 if not received:
                     print(f"⚠️ Không tìm thấy người nhận: {recipient}")
 
@@ -231,29 +387,137 @@ class BridgeManager:
                 # if sender in self.tcp_clients:
                 #    self._send_tcp_safe(sender, raw_type, payload)
 
+            elif room:
+                # Chat theo room - chỉ gửi cho thành viên
+                await self.room_broadcast(room, payload, sender=sender, original_type=raw_type, local_only=local_only)
+
             else:
                 # Chat nhóm (Broadcast) - Gửi cho tất cả trừ người gửi
-                await self.broadcast(payload, sender=sender, original_type=raw_type)
+                await self.broadcast(payload, sender=sender, original_type=raw_type, local_only=local_only)
 
         except Exception as e:
             print(f"❌ Handle Message Error: {e}")
 
-    async def broadcast(self, payload, sender=None, original_type=None):
-        # ... (Giữ nguyên logic cũ của bạn) ...
-        for user, ws in self.web_clients.items():
-            if user == sender: continue
-            try: await ws.send_json(payload)
-            except: pass
+    async def relay_media(self, msg_type, data, sender=None, local_only=False):
+        """
+        Chuyển tiếp VIDEO_DATA/AUDIO_DATA tới người nhận.
+        Desktop nhận nguyên raw bytes (binary frame), chỉ Web mới cần Base64 trong JSON.
+        data: RelayFrame (binary frame chuyển nguyên, chỉ đóng dấu sender) hoặc dict (client cũ gửi JSON)
+        """
+        recipient = data.get("recipient")
+        if isinstance(data, RelayFrame):
+            self._relay_frame(data.stamp(sender), recipient, local_only)
+            return
+        media = data.get("data")
+        if not recipient or media is None: return
+
+        entry = self.registry.snapshot.get(recipient)
+        if entry.tcp is not None:
+            Protocol.send_message(entry.tcp, msg_type, {"sender": sender, "recipient": recipient, "data": media})
+            self._media_feedback(sender, recipient, entry.tcp)
+        elif entry.web is not None:
+            if isinstance(media, (bytes, bytearray, memoryview)):
+                media = Protocol.encode_base64(bytes(media))
+            Protocol.send_message(entry.web, msg_type, {"sender": sender, "data": media})
+            self._media_feedback(sender, recipient, entry.web)
+        elif not local_only and self.bus is not None and self.bus.owner_of(recipient) is not None:
+            self.bus.send(self.bus.owner_of(recipient), "media", msg_type, data, sender)
+
+    def _relay_frame(self, relay, recipient, local_only):
+        """Desktop hiểu binary frame nhận nguyên frame, Desktop cũ / Web nhận JSON Base64 (dựng 1 lần)"""
+        if not recipient: return
+        entry = self.registry.snapshot.get(recipient)
+        handle = entry.tcp if entry.tcp is not None else entry.web
+        if handle is not None:
+            Protocol.send_encoded(handle, relay)
+            self._media_feedback(relay.sender, recipient, handle)
+        elif not local_only and self.bus is not None and self.bus.owner_of(recipient) is not None:
+            self.bus.send(self.bus.owner_of(recipient), "media", relay.msg_type, relay, relay.sender)
+
+    def _media_feedback(self, sender, recipient, handle):
+        """Người gửi ở worker này (Desktop hoặc Web) mới báo được; ở worker khác thì bỏ qua"""
+        entry = self.registry.snapshot.get(sender)
+        sender_handle = entry.tcp if entry.tcp is not None else entry.web
+        self.media_feedback.after_relay(sender, sender_handle, recipient, handle)
+
+    async def broadcast(self, payload, sender=None, original_type=None, exclude=None, local_only=False):
+        """
+        Gửi payload cho mọi Web + TCP client (trừ sender / exclude).
+        Payload chỉ serialize 1 lần: text JSON dùng chung cho Web, frame dùng chung cho TCP.
+        local_only: không chuyển tiếp cho các worker khác (cluster)
+        """
+        skip = set(exclude or ())
+        if sender: skip.add(sender)
+
+        if not local_only and self.bus is not None:
+            self.bus.publish("broadcast", payload, sender, original_type, skip)
+
         tcp_msg_type = original_type if original_type else payload.get("type")
         if payload.get("type") == "SYSTEM": tcp_msg_type = MessageType.LIST_USERS
-        for user, sock in self.tcp_clients.items():
-            if user == sender: continue
-            self._send_tcp_safe(user, tcp_msg_type, payload)
-
-    def _send_tcp_safe(self, username, msg_type, data):
-        # ... (Giữ nguyên logic cũ của bạn) ...
-        if username in self.tcp_clients:
-            try: Protocol.send_message(self.tcp_clients[username], msg_type, data)
-            except: pass
+        encoded = EncodedMessage(tcp_msg_type, payload)
+
+        # 1 snapshot cho cả lượt gửi: login/logout giữa chừng không làm hỏng vòng lặp.
+        # Chỉ xếp hàng, không await từng người: mỗi WebSocket có task ghi riêng với hạn cho từng lần ghi
+        failed = fan_out(self.registry.snapshot.users, encoded, skip)
+        if failed:
+            print(f"⚠️ [Bridge] Broadcast lỗi với {len(failed)} người nhận: {failed[:10]}")
+
+    # --- ROOMS ---
+
+    async def handle_room(self, msg_type, data, username, handle, slot="tcp"):
+        """ROOM_CREATE / ROOM_JOIN / ROOM_LEAVE (chạy trên event loop). handle: kết nối đã gửi lệnh"""
+        handle_room_command(self.rooms, msg_type, data, username, handle, slot, bus=self.bus)
+
+    def remote_room_member(self, room, username, joined):
+        """User ở worker khác vào/ra room (từ ClusterBus): báo cho thành viên ở đây"""
+        if joined:
+            notify_join(self.rooms, room, username)
+        else:
+            notify_leave(self.rooms, room, username)
+
+    async def room_broadcast(self, room, payload, sender=None, original_type=None, local_only=False):
+        """
+        Gửi payload cho thành viên của room (trừ sender), 1 frame encode 1 lần.
+        Chạy cluster: mỗi worker gửi cho thành viên của mình, message được chuyển cho mọi worker.
+        """
+        members = self.rooms.members(room)
+        if not local_only:
+            if sender not in members:
+                print(f"⚠️ [Room] {sender} không ở trong room {room}")
+                return
+            if self.bus is not None:
+                self.bus.publish("room", room, payload, sender, original_type)
+
+        encoded = EncodedMessage(original_type or payload.get("type"), payload)
+        failed = fan_out(members, encoded, skip=(sender,))
+        if failed:
+            print(f"⚠️ [Room] {room}: gửi lỗi với {len(failed)} người nhận: {failed[:10]}")
+
+    def _drop_rooms(self, username, slot=None):
+        """Kết nối của user đã đóng: gỡ khỏi các room, báo ROOM_LEAVE cho thành viên còn lại"""
+        left = self.rooms.drop(username, slot)
+        if not left:
+            return
+
+        def notify():
+            for room in left:
+                notify_leave(self.rooms, room, username)
+                if self.bus is not None:
+                    self.bus.publish("room_member", room, username, False)
+
+        # Thread TCP gọi remove_tcp: WebOutbound chỉ dùng được trên event loop
+        loop = self.presence.loop
+        if loop is None or on_event_loop():
+            notify()
+        else:
+            loop.call_soon_threadsafe(notify)
+
+    def _send_tcp_safe(self, username, msg_type, data=None, encoded=None):
+        sock = self.tcp_clients.get(username)
+        if sock is None: return
+        if encoded is not None:
+            Protocol.send_encoded(sock, encoded)
+        else:
+            Protocol.send_message(sock, msg_type, data)
 
 global_bridge = BridgeManager()
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""
+server/cluster.py - Chạy server thành N process (mỗi process 1 event loop + 1 core)
+
+- Mọi worker cùng bind TCP 5555 và HTTP 8000 bằng SO_REUSEPORT, kernel chia kết nối cho các worker.
+- Mỗi worker chỉ giữ user kết nối vào nó; user ở worker khác được biết qua presence trên bus.
+- Bus: mỗi worker nghe 1 Unix socket trong thư mục riêng (mode 0700), gửi cho worker khác
+  bằng frame [4 bytes length][pickle]. Bus chỉ dùng nội bộ giữa các process của cùng 1 server.
+
+Chạy: python server/main.py --workers 4
+"""
+
+import asyncio
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import struct
+import tempfile
+
+# Worker đọc cấu hình cluster từ biến môi trường (process cha gán trước khi chạy uvicorn)
+ENV_WORKER_ID = "CHAT_WORKER_ID"
+ENV_WORKERS = "CHAT_WORKERS"
+ENV_BUS_DIR = "CHAT_BUS_DIR"
+
+_LENGTH = struct.Struct(">I")
+
+
+def cluster_env():
+    """(worker_id, workers, bus_dir) nếu process này là worker của cluster, không thì None"""
+    if ENV_WORKER_ID not in os.environ:
+        return None
+    return int(os.environ[ENV_WORKER_ID]), int(os.environ[ENV_WORKERS]), os.environ[ENV_BUS_DIR]
+
+
+class ClusterBus:
+    """
+    Bus giữa các worker: presence (user nào đang ở worker nào) + chuyển tiếp message
+    cho user không thuộc worker này. Chạy trên event loop của worker.
+    """
+
+    def __init__(self, worker_id, workers, bus_dir, bridge):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.bus_dir = bus_dir
+        self.bridge = bridge
+        self.remote_users = {}      # {username: worker_id}
+        self.remote_rooms = {}      # {room: {username: worker_id}} thành viên room ở worker khác
+        # Hàm gọi khi danh sách user ở worker khác thay đổi (PresenceService.changed)
+        self.on_presence = None
+        self._queues = {}           # {worker_id: asyncio.Queue} frame chờ gửi cho từng worker
+        self._server = None
+        self._tasks = []
+
+    def _path(self, worker_id):
+        return os.path.join(self.bus_dir, f"worker-{worker_id}.sock")
+
+    @property
+    def peers(self):
+        return [i for i in range(self.workers) if i != self.worker_id]
+
+    async def start(self):
+        path = self._path(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._serve_peer, path)
+        loop = asyncio.get_running_loop()
+        for peer in self.peers:
+            self._queues[peer] = asyncio.Queue()
+            self._tasks.append(loop.create_task(self._sender(peer)))
+        # Xin danh sách user của các worker đã chạy trước
+        self.publish("hello")
+        print(f"🔗 [Cluster] Worker {self.worker_id}/{self.workers} bus: {path}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # --- GỬI ---
+
+    def send(self, worker_id, op, *args):
+        """Xếp 1 lệnh cho worker khác (không chờ); thứ tự giữa 2 worker được giữ nguyên"""
+        queue = self._queues.get(worker_id)
+        if queue is not None:
+            body = pickle.dumps((op, self.worker_id, args), pickle.HIGHEST_PROTOCOL)
+            queue.put_nowait(_LENGTH.pack(len(body)) + body)
+
+    def publish(self, op, *args):
+        for peer in self.peers:
+            self.send(peer, op, *args)
+
+    def owner_of(self, username):
+        """Worker đang giữ user (không phải worker này), None nếu không có"""
+        return self.remote_users.get(username)
+
+    def room_members(self, room):
+        """{username: worker_id} thành viên của room ở các worker khác"""
+        return self.remote_rooms.get(room, {})
+
+    def _set_room_member(self, room, username, worker_id, joined):
+        """Returns: True nếu danh sách thành viên thay đổi"""
+        members = self.remote_rooms.get(room, {})
+        if joined:
+            if members.get(username) == worker_id:
+                return False
+            self.remote_rooms[room] = {**members, username: worker_id}
+            return True
+        if members.get(username) != worker_id:
+            return False
+        members = {u: w for u, w in members.items() if u != username}
+        if members:
+            self.remote_rooms[room] = members
+        else:
+            del self.remote_rooms[room]
+        return True
+
+    async def _sender(self, peer):
+        """1 kết nối tới mỗi worker khác; worker đó chưa lên / bị restart thì kết nối lại"""
+        queue = self._queues[peer]
+        delay = 0.1
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(self._path(peer))
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2)
+                continue
+            delay = 0.1
+            try:
+                while True:
+                    frames = [await queue.get()]
+                    while not queue.empty():
+                        frames.append(queue.get_nowait())
+                    writer.writelines(frames)
+                    await writer.drain()
+            except OSError:
+                # Frame đang gửi dở bị mất: worker kia đã chết, user của nó cũng đã offline
+                writer.close()
+
+    # --- NHẬN ---
+
+    async def _serve_peer(self, reader, writer):
+        sender = None
+        try:
+            while True:
+                header = await reader.readexactly(_LENGTH.size)
+                body = await reader.readexactly(_LENGTH.unpack(header)[0])
+                op, sender, args = pickle.loads(body)
+                try:
+                    await self._dispatch(op, sender, args)
+                except Exception as e:
+                    print(f"❌ [Cluster] Lỗi xử lý '{op}' từ worker {sender}: {e}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Worker này đang tắt
+            return
+        finally:
+            writer.close()
+        if sender is not None:
+            await self._drop_worker(sender)
+
+    async def _drop_worker(self, worker_id):
+        """Worker khác chết / khởi động lại: user của nó coi như offline"""
+        gone = [u for u, owner in self.remote_users.items() if owner == worker_id]
+        for username in gone:
+            del self.remote_users[username]
+        if gone and self.on_presence is not None:
+            self.on_presence()
+        # Thành viên room của worker đó cũng rời room
+        for room, members in list(self.remote_rooms.items()):
+            for username, owner in members.items():
+                if owner == worker_id and self._set_room_member(room, username, worker_id, False):
+                    self.bridge.remote_room_member(room, username, False)
+
+    async def _dispatch(self, op, sender, args):
+        bridge = self.bridge
+        if op == "hello":
+            # Worker mới lên: gửi cho nó toàn bộ user đang ở đây
+            for username in bridge.local_users():
+                self.send(sender, "presence", username, True)
+            for room, username in bridge.rooms.memberships():
+                self.send(sender, "room_member", room, username, True)
+        elif op == "presence":
+            username, online = args
+            if online:
+                self.remote_users[username] = sender
+                # Cùng tên đăng nhập ở worker khác -> đá phiên cũ ở đây (như add_tcp/add_web)
+                await bridge.kick_local(username)
+            elif self.remote_users.get(username) == sender:
+                del self.remote_users[username]
+            if self.on_presence is not None:
+                self.on_presence()
+        elif op == "message":
+            await bridge.handle_message(*args, local_only=True)
+        elif op == "media":
+            await bridge.relay_media(*args, local_only=True)
+        elif op == "broadcast":
+            await bridge.broadcast(*args, local_only=True)
+        elif op == "room":
+            await bridge.room_broadcast(*args, local_only=True)
+        elif op == "room_member":
+            room, username, joined = args
+            if self._set_room_member(room, username, sender, joined):
+                bridge.remote_room_member(room, username, joined)
+
+
+# --- KHỞI ĐỘNG CLUSTER ---
+
+def _reuseport_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def _run_worker(worker_id, workers, bus_dir, host, port):
+    os.environ[ENV_WORKER_ID] = str(worker_id)
+    os.environ[ENV_WORKERS] = str(workers)
+    os.environ[ENV_BUS_DIR] = bus_dir
+
+    import uvicorn
+    from server.main import app
+    from server.tcp_server_async import preferred_loop
+
+    config = uvicorn.Config(app, loop=preferred_loop(), ws_per_message_deflate=True)
+    uvicorn.Server(config).run(sockets=[_reuseport_socket(host, port)])
+
+
+def run_cluster(workers, host="0.0.0.0", port=8000):
+    """Chạy `workers` process, mỗi process 1 server đầy đủ (Web + TCP)"""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("Hệ điều hành không hỗ trợ SO_REUSEPORT, hãy chạy 1 worker")
+
+    bus_dir = tempfile.mkdtemp(prefix="tcpchat-bus-")
+    processes = [
+        multiprocessing.Process(
+            target=_run_worker, args=(i, workers, bus_dir, host, port),
+            name=f"chat-worker-{i}"
+        )
+        for i in range(workers)
+    ]
+    print(f"🚀 Cluster {workers} worker (HTTP {port}, TCP 5555, bus {bus_dir})")
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("🛑 Cluster đang tắt...")
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(bus_dir, ignore_errors=True)
@@ -0,0 +1,141 @@
+"""
+server/drain.py - Drain nhẹ nhàng + chuyển socket lắng nghe cho process mới (restart không downtime)
+
+Drain (DrainController.drain):
+  1. Ngừng accept (TCP + HTTP/WebSocket); process mới (nếu có) nhận các kết nối mới
+  2. Chờ upload đang chạy xong (Web: BridgeManager.active_uploads, Desktop: channel_uploads
+     + upload raw kiểu cũ AsyncTCPServer.raw_uploads)
+  3. Gửi SERVER_DRAIN {"reconnect_after"} cho từng client, mỗi người 1 độ trễ ngẫu nhiên trong
+     DRAIN_RECONNECT_SPREAD giây -> client không kết nối lại cùng 1 lúc
+  4. Chờ hàng đợi gửi trống rồi đóng các kết nối
+Mỗi bước chờ tối đa tới hạn chung DRAIN_TIMEOUT.
+
+Handoff: process đang chạy nghe trên Unix socket HANDOFF_SOCKET. Process mới kết nối vào, nhận
+các fd lắng nghe (SCM_RIGHTS) và accept ngay trên chính các socket đó, process cũ chuyển sang drain.
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+from common.config import DRAIN_TIMEOUT, DRAIN_RECONNECT_SPREAD
+from common.protocol import Protocol, MessageType
+
+
+class DrainController:
+    def __init__(self, bridge, tcp_server, timeout=DRAIN_TIMEOUT, spread=DRAIN_RECONNECT_SPREAD):
+        self.bridge = bridge
+        self.tcp_server = tcp_server
+        self.timeout = timeout
+        self.spread = spread
+        self.draining = False
+
+    async def drain(self, http_servers=()):
+        """Chạy trên event loop. http_servers: các asyncio.Server của uvicorn (ngừng accept HTTP)"""
+        if self.draining:
+            return
+        self.draining = True
+        deadline = time.monotonic() + self.timeout
+        print("🚰 [Drain] Ngừng nhận kết nối mới")
+
+        # 1. Ngừng accept (không chờ wait_closed: nó chờ cả các kết nối đang mở)
+        self.tcp_server.stop_accepting()
+        for server in http_servers:
+            server.close()
+
+        # 2. Upload đang chạy được làm nốt
+        if not await self._wait(self._uploads_done, deadline):
+            print("⚠️ [Drain] Hết thời gian chờ upload, vẫn tiếp tục đóng")
+
+        # 3. Báo client kết nối lại (rải đều, tránh dồn cùng lúc)
+        snapshot = self.bridge.registry.snapshot
+        for username, entry in snapshot.users.items():
+            for handle in (entry.tcp, entry.web):
+                if handle is not None:
+                    Protocol.send_message(handle, MessageType.SERVER_DRAIN, {
+                        "type": MessageType.SERVER_DRAIN,
+                        "reconnect_after": round(random.uniform(0, self.spread), 2),
+                    })
+        print(f"🚰 [Drain] Đã báo {len(snapshot.users)} user kết nối lại trong {self.spread}s")
+
+        # 4. Gửi nốt hàng đợi rồi đóng
+        await self._wait(self._queues_empty, deadline)
+        for entry in snapshot.users.values():
+            if entry.tcp is not None:
+                try: entry.tcp.close()
+                except: pass
+            if entry.web is not None:
+                try: await entry.web.close(code=1012)  # 1012 = Service Restart
+                except: pass
+        print("✅ [Drain] Xong")
+
+    def _uploads_done(self):
+        return (
+            not self.bridge.active_uploads
+            and not self.tcp_server.file_handler.channel_uploads
+            and not getattr(self.tcp_server, "raw_uploads", None)
+        )
+
+    def _queues_empty(self):
+        return all(s["frames"] == 0 for s in self.bridge.outbound_stats().values())
+
+    async def _wait(self, condition, deadline):
+        while not condition():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+
+# --- HANDOFF SOCKET LẮNG NGHE QUA UNIX SOCKET ---
+
+def listen_socket(host, port):
+    """Socket lắng nghe tự tạo (lần chạy đầu, chưa có process cũ để nhận)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+def serve_handoff(path, get_listeners, on_handoff):
+    """
+    Chờ process mới xin socket lắng nghe (thread riêng, chỉ phục vụ 1 lần).
+    get_listeners() -> {tên: socket}; on_handoff() gọi sau khi đã gửi xong (từ thread này).
+    """
+    try: os.unlink(path)
+    except FileNotFoundError: pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def run():
+        with listener:
+            conn, _ = listener.accept()
+            with conn:
+                listeners = get_listeners()
+                names = list(listeners)
+                socket.send_fds(conn, [json.dumps(names).encode()], [listeners[n].fileno() for n in names])
+            # Process mới đã nhận: path giờ thuộc về nó
+            print(f"🤝 [Handoff] Đã chuyển {', '.join(names)} cho process mới")
+        on_handoff()
+
+    threading.Thread(target=run, daemon=True, name="handoff").start()
+    return listener
+
+
+def receive_listeners(path):
+    """Xin socket lắng nghe của process đang chạy. Returns: {tên: socket}, None nếu không có"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(path)
+            message, fds, _, _ = socket.recv_fds(conn, 4096, 16)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    names = json.loads(message)
+    print(f"🤝 [Handoff] Nhận {', '.join(names)} từ process cũ")
+    return {name: socket.socket(fileno=fd) for name, fd in zip(names, fds)}
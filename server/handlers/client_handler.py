@@ -3,24 +3,31 @@ Xử lý connection từng client - CẬP NHẬT
 Server/handlers/client_handler.py
 """
 
-from datetime import datetime
-from common.protocol import Protocol, MessageType
+from common.protocol import Protocol, MessageType, FEATURES
+from common.connection import Connection
 from server.handlers.message_handler import MessageHandler
 from server.handlers.file_handler import FileHandler
+from server.rooms import handle_room_command, notify_leave
+from server.router import standard_router
 
 class ClientHandler:
     def __init__(self, server, client_socket, address):
         self.server = server
-        self.client_socket = client_socket
+        # Chế độ reactor truyền sẵn kết nối non-blocking (ReactorConnection)
+        self.client_socket = client_socket if hasattr(client_socket, "send_message") else Connection(client_socket)
         self.address = address
+        # VIDEO_DATA/AUDIO_DATA binary: chuyển tiếp nguyên frame (RelayFrame), không decode payload
+        self.client_socket.decoder.cut_through = True
         self.username = None
+        # Dữ liệu riêng của middleware (token bucket...)
+        self.state = {}
         
         # Handlers
         self.message_handler = MessageHandler(server)
         self.file_handler = FileHandler(server)
     
     def handle(self):
-        """Xử lý client connection"""
+        """Xử lý client connection (chế độ thread: 1 thread / client)"""
         try:
             while self.server.running:
                 # Nhận message
@@ -29,106 +36,8 @@ class ClientHandler:
                 if msg_type is None:
                     break
                 
-                # Xử lý LOGIN
-                if msg_type == MessageType.LOGIN:
-                    if not self._handle_login(data):
-                        return
-                
-                # Xử lý TEXT message
-                elif msg_type == MessageType.TEXT:
-                    self.message_handler.handle_text_message(
-                        self.client_socket,
-                        self.username,
-                        data
-                    )
-                
-                # Xử lý FILE UPLOAD
-                elif msg_type == MessageType.FILE_UPLOAD:
-                    self.file_handler.handle_file_upload(
-                        self.client_socket,
-                        self.username,
-                        data
-                    )
-                
-                # Xử lý FILE DOWNLOAD
-                elif msg_type == MessageType.FILE_DOWNLOAD:
-                    self.file_handler.handle_file_download(
-                        self.client_socket,
-                        data
-                    )
-                
-                # Xử lý CALL - NEW
-                elif msg_type == MessageType.CALL_REQUEST:
-                    self.message_handler.handle_call_request(
-                        self.client_socket,
-                        self.username,
-                        data
-                    )
-                
-                elif msg_type == MessageType.CALL_ACCEPT:
-                    self.message_handler.handle_call_accept(
-                        self.client_socket,
-                        self.username,
-                        data
-                    )
-                
-                elif msg_type == MessageType.CALL_REJECT:
-                    self.message_handler.handle_call_reject(
-                        self.client_socket,
-                        self.username,
-                        data
-                    )
-                
-                elif msg_type == MessageType.CALL_BUSY:
-                    self.message_handler.handle_call_busy(
-                        self.client_socket,
-                        self.username,
-                        data
-                    )
-                
-                elif msg_type == MessageType.CALL_END:
-                    self.message_handler.handle_call_end(
-                        self.client_socket,
-                        self.username,
-                        data
-                    )
-                
-                # Xử lý WebRTC signaling - NEW
-                elif msg_type == MessageType.WEBRTC_OFFER:
-                    self.message_handler.handle_webrtc_signal(
-                        self.client_socket,
-                        self.username,
-                        MessageType.WEBRTC_OFFER,
-                        data
-                    )
-                
-                elif msg_type == MessageType.WEBRTC_ANSWER:
-                    self.message_handler.handle_webrtc_signal(
-                        self.client_socket,
-                        self.username,
-                        MessageType.WEBRTC_ANSWER,
-                        data
-                    )
-                
-                elif msg_type == MessageType.WEBRTC_ICE:
-                    self.message_handler.handle_webrtc_signal(
-                        self.client_socket,
-                        self.username,
-                        MessageType.WEBRTC_ICE,
-                        data
-                    )
-                # Thêm xử lý cho VIDEO_DATA và AUDIO_DATA
-                elif msg_type in [MessageType.VIDEO_DATA, MessageType.AUDIO_DATA]:
-                    self.message_handler.handle_media_data(
-                        self.client_socket,
-                        self.username,
-                        msg_type,
-                        data
-                    )
-
-                # Xử lý PING
-                elif msg_type == MessageType.PING:
-                    Protocol.send_message(self.client_socket, MessageType.PONG, {})
+                if self.dispatch(msg_type, data) is False:
+                    return
         
         except Exception as e:
             print(f"❌ Error handling {self.username or self.address}: {e}")
@@ -136,6 +45,21 @@ class ClientHandler:
         finally:
             self._cleanup()
     
+    def dispatch(self, msg_type, data):
+        """
+        Xử lý 1 message của client (dùng chung cho chế độ thread và reactor)
+        Returns: False nếu phải đóng kết nối
+        """
+        return router.dispatch(self, msg_type, data)
+    
+    def reply(self, msg_type, data):
+        """Gửi trả lời cho client (middleware của router dùng)"""
+        return Protocol.send_message(self.client_socket, msg_type, data)
+    
+    def finish(self):
+        """Client ngắt kết nối (chế độ reactor)"""
+        self._cleanup()
+    
     def _handle_login(self, data):
         """
         Xử lý đăng nhập
@@ -152,9 +76,9 @@ class ClientHandler:
             self.client_socket.close()
             return False
         
-        # Thêm client vào danh sách
-        self.username = username
-        self.server.clients[username] = self.client_socket
+        # Thương lượng version/codec (LOGIN_SUCCESS vẫn gửi bằng JSON)
+        # Server legacy chưa giữ phiên -> không nhận "resume"
+        session = Protocol.negotiate_session(data, features=FEATURES - {"resume"})
         
         # Gửi thông báo thành công
         Protocol.send_message(
@@ -162,41 +86,40 @@ class ClientHandler:
             MessageType.LOGIN_SUCCESS,
             {
                 "username": username,
-                "message": "Đăng nhập thành công!"
+                "message": "Đăng nhập thành công!",
+                **session
             }
         )
+        self.client_socket.bind_session(session)
+        # Từ đây các frame gửi cho client được gộp lại trước khi ghi
+        self.client_socket.start_writer()
+        self.server.heartbeat.track(self.client_socket)
         
-        # Gửi danh sách user
-        self.server.send_user_list()
+        # Thêm client vào danh sách
+        self.username = username
+        self.server.clients[username] = self.client_socket
         
-        # Thông báo user online
-        self.server.broadcast(
-            MessageType.USER_ONLINE,
-            {
-                "username": username,
-                "timestamp": datetime.now().isoformat()
-            },
-            exclude=username
-        )
+        # Người mới: danh sách đầy đủ; mọi người khác nhận delta USER_ONLINE
+        Protocol.send_message(self.client_socket, MessageType.LIST_USERS, self.server.presence.snapshot())
+        self.server.send_user_list()
         
         print(f"✅ {username} logged in")
         return True
     
     def _cleanup(self):
         """Cleanup khi client disconnect"""
+        self.server.heartbeat.untrack(self.client_socket)
+        self.file_handler.abort_all_uploads(self.client_socket)
+        
         if self.username and self.username in self.server.clients:
             del self.server.clients[self.username]
             
-            # Thông báo user offline
-            self.server.broadcast(
-                MessageType.USER_OFFLINE,
-                {
-                    "username": self.username,
-                    "timestamp": datetime.now().isoformat()
-                }
-            )
+            # Rời mọi room đang ở
+            for room in self.server.rooms.drop(self.username):
+                notify_leave(self.server.rooms, room, self.username)
+            self.server.media_feedback.forget(self.username)
             
-            # Cập nhật user list
+            # Mọi người nhận delta USER_OFFLINE
             self.server.send_user_list()
             
             print(f"👋 {self.username} disconnected")
@@ -204,4 +127,78 @@ class ClientHandler:
         try:
             self.client_socket.close()
         except:
-            pass
\ No newline at end of file
+            pass
+
+
+# --- BẢNG ĐỊNH TUYẾN: handler(client_handler, msg_type, data) ---
+router = standard_router()
+
+@router.on(MessageType.LOGIN)
+def _login(h, msg_type, data):
+    return h._handle_login(data)
+
+@router.on(MessageType.TEXT)
+def _text(h, msg_type, data):
+    h.message_handler.handle_text_message(h.client_socket, h.username, data)
+
+@router.on(MessageType.FILE_UPLOAD)
+def _file_upload(h, msg_type, data):
+    h.file_handler.handle_file_upload(h.client_socket, h.username, data)
+
+# Chunk của upload chạy trên channel riêng
+@router.on(MessageType.FILE_CHUNK)
+def _file_chunk(h, msg_type, data):
+    h.file_handler.handle_file_chunk(h.client_socket, h.username, data)
+
+# Client huỷ upload trên channel
+@router.on(MessageType.FILE_ERROR)
+def _file_error(h, msg_type, data):
+    if data.get("channel"):
+        h.file_handler.abort_upload(h.client_socket, data.get("channel"))
+
+@router.on(MessageType.FILE_DOWNLOAD)
+def _file_download(h, msg_type, data):
+    h.file_handler.handle_file_download(h.client_socket, data)
+
+# Gọi điện: mỗi loại 1 handler của MessageHandler
+_CALL_HANDLERS = {
+    MessageType.CALL_REQUEST: MessageHandler.handle_call_request,
+    MessageType.CALL_ACCEPT: MessageHandler.handle_call_accept,
+    MessageType.CALL_REJECT: MessageHandler.handle_call_reject,
+    MessageType.CALL_BUSY: MessageHandler.handle_call_busy,
+    MessageType.CALL_END: MessageHandler.handle_call_end,
+    MessageType.CALL_KEYFRAME: MessageHandler.handle_call_keyframe,
+}
+
+@router.on(*_CALL_HANDLERS)
+def _call(h, msg_type, data):
+    _CALL_HANDLERS[msg_type](h.message_handler, h.client_socket, h.username, data)
+
+# WebRTC signaling
+@router.on(MessageType.WEBRTC_OFFER, MessageType.WEBRTC_ANSWER, MessageType.WEBRTC_ICE)
+def _webrtc(h, msg_type, data):
+    h.message_handler.handle_webrtc_signal(h.client_socket, h.username, msg_type, data)
+
+@router.on(MessageType.VIDEO_DATA, MessageType.AUDIO_DATA)
+def _media(h, msg_type, data):
+    h.message_handler.handle_media_data(h.client_socket, h.username, msg_type, data)
+
+# Client lỡ version presence -> gửi lại danh sách đầy đủ
+@router.on(MessageType.LIST_USERS)
+def _list_users(h, msg_type, data):
+    Protocol.send_message(h.client_socket, MessageType.LIST_USERS, h.server.presence.snapshot())
+
+# Vào/ra room
+@router.on(*Protocol.ROOM_COMMANDS)
+def _room(h, msg_type, data):
+    handle_room_command(h.server.rooms, msg_type, data, h.username, h.client_socket)
+
+# PING: trả lại nguyên "ts" để bên kia tính RTT
+@router.on(MessageType.PING)
+def _ping(h, msg_type, data):
+    Protocol.send_message(h.client_socket, MessageType.PONG, data or {})
+
+# PONG trả lời heartbeat: RTT đã tính lúc decode
+@router.on(MessageType.PONG)
+def _pong(h, msg_type, data):
+    pass
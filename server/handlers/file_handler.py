@@ -1,21 +1,68 @@
 import os
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from common.protocol import Protocol, MessageType
 from common.config import CHUNK_SIZE
 
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
 class FileHandler:
     def __init__(self, server):
         self.server = server
         # Đảm bảo thư mục lưu trữ file tồn tại
         if not os.path.exists(self.server.storage_dir):
             os.makedirs(self.server.storage_dir)
+        
+        # Upload đang chạy theo channel: {(socket, channel): {file_handle, filepath, received, ...}}
+        self.channel_uploads = {}
+        # Thread ghi đĩa (chỉ tạo khi chạy trên event loop, xem _run_disk)
+        self._writer = None
 
-    def handle_file_upload(self, client_socket, username, data):
+    def _run_disk(self, func, *args, then=None):
+        """
+        Chạy 1 thao tác đĩa (open/write/close/remove...), then(kết quả) chạy sau khi xong.
+        Server asyncio: gọi trên event loop -> đẩy sang thread ghi đĩa riêng, đĩa chậm không chặn
+        mọi kết nối khác; 1 worker nên các thao tác trên cùng file vẫn đúng thứ tự,
+        then được gọi lại trên event loop. Server thread: chạy luôn trên thread của client.
+        func không được raise (lỗi ghi vào upload["error"] / trả về).
+        """
+        loop = _running_loop()
+        if loop is None:
+            result = func(*args)
+            if then is not None:
+                then(result)
+            return
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-writer")
+        future = self._writer.submit(func, *args)
+        if then is not None:
+            future.add_done_callback(lambda f: loop.call_soon_threadsafe(then, f.result()))
+
+    def storage_path(self, filename):
+        """Tên file lưu trên server (thêm timestamp để tránh trùng tên) và đường dẫn đầy đủ"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        safe_filename = f"{timestamp}_{filename}"
+        return safe_filename, os.path.join(self.server.storage_dir, safe_filename)
+
+    def handle_file_upload(self, client_socket, username, data, reply_to=None):
         """
         Xử lý upload file theo dạng STREAM (nhận từng chunk).
         Hỗ trợ Client Pause/Resume và hiển thị Progress Bar.
+        Client có "channel" -> dữ liệu đến bằng FILE_CHUNK xen kẽ với tin nhắn khác (không chặn luồng nhận).
+        Client cũ -> raw bytes nối ngay sau header.
+        reply_to: nơi gửi FILE_INFO / ERROR (ResumableSession để giữ seq), mặc định chính client_socket
         """
+        reply_to = reply_to or client_socket
+        if data.get("channel"):
+            return self.begin_channel_upload(client_socket, username, data, reply_to)
+        
         try:
             # 1. Đọc Metadata từ Header (Client đã gửi JSON trước đó)
             filename = data.get("filename")
@@ -26,9 +73,7 @@ class FileHandler:
             print(f"📤 [Server] Bắt đầu nhận file Stream: {filename} ({filesize} bytes) từ {username}")
 
             # 2. Tạo đường dẫn lưu file (Thêm timestamp để tránh trùng tên)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(self.server.storage_dir, safe_filename)
+            safe_filename, filepath = self.storage_path(filename)
 
             # 3. Vòng lặp nhận dữ liệu Raw (Binary)
             received = 0
@@ -47,7 +92,114 @@ class FileHandler:
                     received += len(chunk)
 
             print(f"✅ [Server] Đã nhận xong file: {safe_filename}")
+            self._finish_upload(reply_to, username, filename, safe_filename, filesize, file_type, recipient)
+
+        except Exception as e:
+            print(f"❌ Lỗi khi nhận file stream: {e}")
+            # Gửi thông báo lỗi lại cho client để họ biết
+            try:
+                Protocol.send_message(reply_to, MessageType.ERROR, {"message": f"Upload thất bại: {str(e)}"})
+            except: pass
+
+    # ------------------------------------------------------------------------
+    # UPLOAD THEO CHANNEL (FILE_CHUNK xen kẽ với chat)
+    # ------------------------------------------------------------------------
+    def begin_channel_upload(self, client_socket, username, data, reply_to=None):
+        """Mở file cho 1 upload trên channel riêng, các chunk đến sau qua handle_file_chunk"""
+        filename = data.get("filename")
+        channel = data.get("channel")
+        safe_filename, filepath = self.storage_path(filename)
+
+        print(f"📤 [Server] Bắt đầu nhận file (channel {channel}): {filename} ({data.get('filesize')} bytes) từ {username}")
+        upload = self.channel_uploads[(client_socket, channel)] = {
+            "file_handle": None,
+            "error": None,
+            "filepath": filepath,
+            "filename": filename,
+            "safe_filename": safe_filename,
+            "filesize": data.get("filesize", 0),
+            "file_type": data.get("file_type", "file"),
+            "recipient": data.get("recipient"),
+            "received": 0,
+            "reply_to": reply_to or client_socket,
+        }
+        self._run_disk(self._open_file, upload)
+        # File rỗng: xong luôn
+        if not data.get("filesize"):
+            self._complete_channel_upload(client_socket, username, channel)
+
+    def handle_file_chunk(self, client_socket, username, data):
+        """Ghi 1 FILE_CHUNK vào file của channel tương ứng"""
+        channel = data.get("channel")
+        upload = self.channel_uploads.get((client_socket, channel))
+        if not upload:
+            return  # Upload đã bị huỷ / không tồn tại
+
+        chunk = data.get("data") or b""
+        # bytes(): chunk có thể là memoryview vào buffer nhận, ghi ở thread khác thì phải copy
+        self._run_disk(self._write_file, upload, bytes(chunk))
+        upload["received"] += len(chunk)
+        if upload["received"] >= upload["filesize"]:
+            self._complete_channel_upload(client_socket, username, channel)
+
+    def _complete_channel_upload(self, client_socket, username, channel):
+        upload = self.channel_uploads.pop((client_socket, channel))
+        self._run_disk(self._close_file, upload, then=partial(self._channel_upload_closed, username, upload))
 
+    def _channel_upload_closed(self, username, upload, error):
+        """File đã đóng (sau mọi lần ghi): báo lỗi hoặc gửi FILE_INFO"""
+        if error is not None:
+            print(f"❌ Lỗi khi ghi file {upload['safe_filename']}: {error}")
+            try:
+                Protocol.send_message(upload["reply_to"], MessageType.ERROR, {"message": f"Upload thất bại: {error}"})
+            except: pass
+            return
+        print(f"✅ [Server] Đã nhận xong file: {upload['safe_filename']}")
+        self._finish_upload(
+            upload["reply_to"], username, upload["filename"], upload["safe_filename"],
+            upload["filesize"], upload["file_type"], upload["recipient"]
+        )
+
+    def abort_upload(self, client_socket, channel):
+        """Client huỷ upload (FILE_ERROR kèm channel) -> đóng và xoá file dở dang"""
+        upload = self.channel_uploads.pop((client_socket, channel), None)
+        if upload:
+            self._run_disk(self._close_file, upload, True)
+            print(f"❌ [Server] Upload bị huỷ: {upload['filename']}")
+
+    # --- THAO TÁC ĐĨA (chạy qua _run_disk, không raise) ---
+
+    @staticmethod
+    def _open_file(upload):
+        try: upload["file_handle"] = open(upload["filepath"], "wb")
+        except OSError as e: upload["error"] = e
+
+    @staticmethod
+    def _write_file(upload, chunk):
+        if upload["error"] is not None:
+            return
+        try: upload["file_handle"].write(chunk)
+        except OSError as e: upload["error"] = e
+
+    @staticmethod
+    def _close_file(upload, remove=False):
+        """Đóng file; bị huỷ / ghi lỗi thì xoá file dở dang. Returns: lỗi ghi (None nếu không lỗi)"""
+        if upload["file_handle"] is not None:
+            try: upload["file_handle"].close()
+            except OSError as e: upload["error"] = upload["error"] or e
+        if remove or upload["error"] is not None:
+            try: os.remove(upload["filepath"])
+            except OSError: pass
+        return upload["error"]
+
+    def abort_all_uploads(self, client_socket):
+        """Client ngắt kết nối -> huỷ mọi upload đang dở của client đó"""
+        for key in [k for k in self.channel_uploads if k[0] is client_socket]:
+            self.abort_upload(client_socket, key[1])
+
+    def _finish_upload(self, reply_to, username, filename, safe_filename, filesize, file_type, recipient):
+        """Upload xong: báo lại cho sender (reply_to) và chuyển FILE_INFO cho người nhận"""
+        try:
             # 4. Tạo gói tin thông báo hoàn thành
             file_info_msg = {
                 "type": "FILE_INFO",
@@ -65,7 +217,7 @@ class FileHandler:
             # ==================================================================
             # Giúp Client Sender vẽ bong bóng file vào khung chat của chính mình
             try:
-                Protocol.send_message(client_socket, MessageType.FILE_INFO, file_info_msg)
+                Protocol.send_message(reply_to, MessageType.FILE_INFO, file_info_msg)
             except Exception as e:
                 print(f"⚠️ Lỗi gửi phản hồi cho sender: {e}")
 
@@ -75,11 +227,15 @@ class FileHandler:
             # Sử dụng Bridge để gửi cho cả Web Client và Desktop Client khác
             from server.bridge import global_bridge
             
-            # Vì function này chạy trong Thread TCP, cần gọi async thread-safe để tương tác với Event Loop chính
-            if self.server.main_loop and self.server.main_loop.is_running():
+            # Server asyncio: đang chạy ngay trên Event Loop chính -> tạo task, không cần chuyển thread
+            # Server thread: cần gọi async thread-safe để tương tác với Event Loop chính
+            main_loop = getattr(self.server, "main_loop", None)
+            if main_loop and _running_loop() is main_loop:
+                main_loop.create_task(global_bridge.handle_message(file_info_msg, sender=username))
+            elif main_loop and main_loop.is_running():
                 asyncio.run_coroutine_threadsafe(
                     global_bridge.handle_message(file_info_msg, sender=username),
-                    self.server.main_loop
+                    main_loop
                 )
             else:
                 # Fallback: Nếu không chạy mode Hybrid, dùng Broadcast thường
@@ -87,11 +243,7 @@ class FileHandler:
                 self.server.broadcast(MessageType.FILE_INFO, file_info_msg)
 
         except Exception as e:
-            print(f"❌ Lỗi khi nhận file stream: {e}")
-            # Gửi thông báo lỗi lại cho client để họ biết
-            try:
-                Protocol.send_message(client_socket, MessageType.ERROR, {"message": f"Upload thất bại: {str(e)}"})
-            except: pass
+            print(f"❌ Lỗi khi gửi thông báo file: {e}")
 
     def handle_file_download(self, client_socket, data):
         """
@@ -104,11 +256,14 @@ class FileHandler:
             print(f"ℹ️ [Server] Client {client_socket.getpeername()} yêu cầu tải file: {filename}")
             
             filepath = os.path.join(self.server.storage_dir, filename)
-            if not os.path.exists(filepath):
-                 Protocol.send_message(client_socket, MessageType.ERROR, {"message": "File không tồn tại trên server"})
-                 return
-            
-            # Nếu muốn chuyển sang tải qua TCP Socket thay vì HTTP, code sẽ viết ở đây.
+            self._run_disk(os.path.exists, filepath, then=partial(self._download_checked, client_socket))
             
         except Exception as e:
-            print(f"❌ Download error: {e}")
\ No newline at end of file
+            print(f"❌ Download error: {e}")
+
+    def _download_checked(self, client_socket, exists):
+        if not exists:
+            Protocol.send_message(client_socket, MessageType.ERROR, {"message": "File không tồn tại trên server"})
+            return
+        
+        # Nếu muốn chuyển sang tải qua TCP Socket thay vì HTTP, code sẽ viết ở đây.
\ No newline at end of file
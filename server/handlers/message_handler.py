@@ -5,6 +5,8 @@ Server/handlers/message_handler.py
 
 from datetime import datetime
 from common.protocol import Protocol, MessageType
+from common.framing import EncodedMessage, RelayFrame
+from server.rooms import room_name, fan_out
 
 class MessageHandler:
     def __init__(self, server):
@@ -13,6 +15,7 @@ class MessageHandler:
     def handle_text_message(self, client_socket, username, data):
         """Xử lý tin nhắn text"""
         recipient = data.get("recipient")  # Lấy tên người nhận (nếu có)
+        room = None if recipient else room_name(data)  # Chat theo room (nếu có)
         message_content = data.get("message", "")
         
         timestamp = datetime.now().isoformat()
@@ -24,7 +27,17 @@ class MessageHandler:
             "timestamp": timestamp
         }
         
-        if recipient:
+        if room:
+            # CHAT THEO ROOM: chỉ thành viên (kể cả người gửi, giống chat nhóm)
+            members = self.server.rooms.members(room)
+            if username not in members:
+                Protocol.send_message(client_socket, MessageType.ERROR, {"message": f"Bạn không ở trong room {room}"})
+                return
+            msg_data["room"] = room
+            print(f"🚪 [{username} @ {room}] {message_content}")
+            fan_out(members, EncodedMessage(MessageType.TEXT, msg_data))
+        
+        elif recipient:
             # CHAT RIÊNG
             # 1. Gửi cho người nhận
             if recipient in self.server.clients:
@@ -129,6 +142,19 @@ class MessageHandler:
                 }
             )
     
+    def handle_call_keyframe(self, client_socket, username, data):
+        """Người nhận video lỡ frame -> chuyển lời xin keyframe cho người gửi video"""
+        recipient = data.get("recipient")
+        
+        if recipient in self.server.clients:
+            Protocol.send_message(
+                self.server.clients[recipient],
+                MessageType.CALL_KEYFRAME,
+                {
+                    "sender": username
+                }
+            )
+    
     def handle_webrtc_signal(self, client_socket, username, msg_type, data):
         """Xử lý WebRTC signaling"""
         peer = data.get("peer")
@@ -149,19 +175,31 @@ class MessageHandler:
         Chuyển tiếp dữ liệu media (Video/Audio) trực tiếp đến người nhận
         """
         recipient = data.get("recipient")
-        media_content = data.get("data") # Dữ liệu đã mã hóa Base64
+        
+        # Binary frame (RelayFrame): chỉ đóng dấu sender vào header, chuyển nguyên frame
+        if isinstance(data, RelayFrame):
+            target = self.server.clients.get(recipient)
+            if target is not None:
+                Protocol.send_encoded(target, data.stamp(username))
+                self.server.media_feedback.after_relay(username, client_socket, recipient, target)
+            return
+        
+        media_content = data.get("data") # Base64 (client cũ gửi JSON)
         
         # Nếu người nhận đang online, chuyển tiếp ngay lập tức
         if recipient and recipient in self.server.clients:
             try:
-                from common.protocol import Protocol
                 Protocol.send_message(
                     self.server.clients[recipient],
                     msg_type,
                     {
                         "sender": username,
+                        "recipient": recipient,
                         "data": media_content
                     }
                 )
+                self.server.media_feedback.after_relay(
+                    username, client_socket, recipient, self.server.clients[recipient]
+                )
             except Exception as e:
                 print(f"Error relaying media to {recipient}: {e}")
\ No newline at end of file
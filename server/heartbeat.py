@@ -0,0 +1,161 @@
+"""
+server/heartbeat.py - Heartbeat (PING/PONG), đo RTT và ngắt kết nối chết bằng timer wheel
+
+- Mỗi HEARTBEAT_INTERVAL giây server gửi PING {"ts"} cho từng kết nối Desktop đã đăng nhập,
+  client trả PONG cùng "ts" -> SessionState.rtt (trung bình trượt, giây).
+- Mọi frame nhận được đều làm mới SessionState.last_seen. Client có feature "heartbeat" (hứa trả
+  lời PING) im lặng quá HEARTBEAT_TIMEOUT giây -> coi như chết, ngắt kết nối; phần dọn dẹp sẵn có
+  (remove_tcp -> PresenceService) báo offline theo lượt. Client cũ không bị ngắt vì im lặng,
+  PING chỉ để lộ socket hỏng qua lỗi ghi.
+- Hẹn giờ bằng hashed timer wheel: thêm / huỷ O(1), mỗi tick chỉ xét đúng 1 slot
+  -> hàng chục nghìn kết nối không cần quét cả danh sách.
+"""
+
+import threading
+import time
+from functools import partial
+
+from common.config import HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, TIMER_WHEEL_TICK, TIMER_WHEEL_SLOTS
+from common.protocol import Protocol, MessageType
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: slot = (slot hiện tại + số tick) % số slot, hẹn xa hơn 1 vòng thì
+    đếm thêm số vòng (rounds). advance() gọi mỗi tick, trả các callback đến hạn.
+    """
+
+    def __init__(self, tick=TIMER_WHEEL_TICK, slots=TIMER_WHEEL_SLOTS):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]   # [{key: [rounds, callback]}]
+        self._where = {}                           # {key: slot} để huỷ O(1)
+        self._current = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, delay, callback):
+        """Hẹn callback() sau delay giây (làm tròn lên theo tick); key đã có hẹn thì thay hẹn cũ"""
+        ticks = max(1, -int(-delay // self.tick))
+        size = len(self._slots)
+        with self._lock:
+            self._cancel(key)
+            slot = (self._current + ticks) % size
+            self._slots[slot][key] = [(ticks - 1) // size, callback]
+            self._where[key] = slot
+
+    def cancel(self, key):
+        with self._lock:
+            self._cancel(key)
+
+    def _cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self):
+        """Sang tick kế tiếp. Returns: [callback] đến hạn (người gọi tự chạy, ngoài lock)"""
+        due = []
+        with self._lock:
+            self._current = (self._current + 1) % len(self._slots)
+            slot = self._slots[self._current]
+            for key, timer in list(slot.items()):
+                if timer[0] > 0:
+                    timer[0] -= 1
+                    continue
+                del slot[key]
+                del self._where[key]
+                due.append(timer[1])
+        return due
+
+
+class HeartbeatMonitor:
+    """
+    track(conn, evict): theo dõi 1 kết nối đã đăng nhập; evict() ngắt kết nối khi nó chết
+    (mặc định conn.close). untrack(conn) khi kết nối đã đóng.
+    start(loop): tick trên event loop (AsyncTCPServer / TCPServer), None = thread riêng.
+    """
+
+    def __init__(self, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT, tick=TIMER_WHEEL_TICK):
+        self.interval = interval
+        self.timeout = timeout
+        self.wheel = TimerWheel(tick)
+        self.loop = None
+        self.running = False
+
+        # Thống kê (stats())
+        self.pings = 0
+        self.evicted = 0
+
+    # --- THEO DÕI KẾT NỐI ---
+
+    def track(self, conn, evict=None):
+        conn.last_seen = time.monotonic()
+        self.wheel.schedule(conn, self.interval, partial(self._check, conn, evict or conn.close))
+
+    def untrack(self, conn):
+        self.wheel.cancel(conn)
+
+    def _check(self, conn, evict):
+        now = time.monotonic()
+        idle = now - conn.last_seen
+        if getattr(conn, "closed", False):
+            return
+        if conn.supports_heartbeat and idle >= self.timeout:
+            self._evict(conn, evict, f"không phản hồi {idle:.0f}s")
+            return
+        self.pings += 1
+        if not Protocol.send_message(conn, MessageType.PING, {"ts": now}):
+            self._evict(conn, evict, "gửi PING lỗi")
+            return
+        self.wheel.schedule(conn, self.interval, partial(self._check, conn, evict))
+
+    def _evict(self, conn, evict, reason):
+        self.evicted += 1
+        try: peer = conn.getpeername()
+        except Exception: peer = None
+        print(f"💀 Kết nối chết ({reason}), ngắt: {peer}")
+        try: evict()
+        except: pass
+
+    # --- TICK ---
+
+    def start(self, loop=None):
+        if self.running:
+            return
+        self.running = True
+        self.loop = loop
+        if loop is None:
+            threading.Thread(target=self._run_thread, daemon=True, name="heartbeat").start()
+        else:
+            loop.call_soon_threadsafe(loop.call_later, self.wheel.tick, self._tick_on_loop)
+
+    def stop(self):
+        self.running = False
+
+    def _run_thread(self):
+        while self.running:
+            time.sleep(self.wheel.tick)
+            self._advance()
+
+    def _tick_on_loop(self):
+        if not self.running:
+            return
+        self._advance()
+        self.loop.call_later(self.wheel.tick, self._tick_on_loop)
+
+    def _advance(self):
+        for callback in self.wheel.advance():
+            try: callback()
+            except Exception as e:
+                print(f"❌ Heartbeat error: {e}")
+
+    def stats(self):
+        return {"tracked": len(self.wheel), "pings": self.pings, "evicted": self.evicted}
+
+
+def rtt_ms(conn):
+    """RTT đo được của kết nối (ms), None nếu chưa có PONG nào"""
+    rtt = getattr(conn, "rtt", None)
+    return None if rtt is None else round(rtt * 1000, 1)
@@ -4,6 +4,7 @@ import shutil
 from datetime import datetime
 from contextlib import asynccontextmanager
 import asyncio 
+import signal
 
 # --- CẤU HÌNH ĐƯỜNG DẪN ---
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,24 +18,59 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
 from server.bridge import global_bridge
-from server.tcp_server_thread import TCPServer
-from common.config import SERVER_STORAGE_DIR
+from server.tcp_server_async import AsyncTCPServer, preferred_loop
+from server.cluster import ClusterBus, cluster_env, run_cluster
+from server.drain import DrainController, serve_handoff, receive_listeners, listen_socket
+from common.config import SERVER_STORAGE_DIR, HANDOFF_SOCKET
 
 os.makedirs(SERVER_STORAGE_DIR, exist_ok=True)
 
+# Restart không downtime (--handoff): socket lắng nghe tự tạo / nhận từ process cũ, uvicorn.Server để drain
+LISTENERS = {}
+uvicorn_server = None
+
 # --- LIFESPAN ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Lấy hoặc tạo event loop cho TCP Server chạy nền
+    # Chạy trong cluster (--workers N): nối bus với các worker khác
+    cluster = cluster_env()
+    bus = None
+    if cluster:
+        bus = ClusterBus(*cluster, global_bridge)
+        global_bridge.bus = bus
+
+    # TCP Server chạy ngay trên event loop này (không cần thread riêng)
+    tcp_server = AsyncTCPServer(reuse_port=bool(cluster), sock=LISTENERS.get("tcp"))
+    await tcp_server.start()
+    app.state.tcp_server = tcp_server
+
+    # Drain: ngừng accept, chờ upload, báo client kết nối lại rải đều, gửi nốt hàng đợi rồi thoát
+    drain = DrainController(global_bridge, tcp_server)
+    loop = asyncio.get_running_loop()
+
+    async def drain_and_exit():
+        await drain.drain(http_servers=getattr(uvicorn_server, "servers", ()))
+        if uvicorn_server is not None:
+            uvicorn_server.should_exit = True
+        else:
+            os.kill(os.getpid(), signal.SIGTERM)
+
     try:
-        main_loop = asyncio.get_running_loop()
-    except RuntimeError:
-        main_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(main_loop)
-
-    tcp_thread = TCPServer(main_loop)
-    tcp_thread.daemon = True 
-    tcp_thread.start()
+        # kill -USR1 <pid>: drain rồi thoát
+        loop.add_signal_handler(signal.SIGUSR1, lambda: loop.create_task(drain_and_exit()))
+    except (NotImplementedError, AttributeError):
+        pass  # Windows
+    if LISTENERS:
+        # Process mới chạy --handoff: nhận socket lắng nghe, process này chuyển sang drain
+        serve_handoff(
+            HANDOFF_SOCKET,
+            lambda: {"http": LISTENERS["http"], "tcp": tcp_server.listen_sockets[0]},
+            lambda: asyncio.run_coroutine_threadsafe(drain_and_exit(), loop)
+        )
+    if bus:
+        # User ở worker khác vào/ra -> gửi delta cho user ở đây
+        bus.on_presence = global_bridge.presence.changed
+        await bus.start()
     
     print("\n" + "="*40)
     print("✅ FULL-STACK SERVER ĐÃ SẴN SÀNG!")
@@ -44,6 +80,9 @@ async def lifespan(app: FastAPI):
     
     yield 
     print("🛑 Server đang tắt...")
+    await tcp_server.stop()
+    if bus:
+        await bus.stop()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -59,6 +98,16 @@ app.mount("/downloads", StaticFiles(directory=SERVER_STORAGE_DIR), name="downloa
 async def get():
     return FileResponse(os.path.join(static_dir, 'index.html'))
 
+# --- THỐNG KÊ HÀNG ĐỢI GỬI (client nhận chậm, frame media bị bỏ) ---
+@app.get("/stats/outbound")
+async def outbound_stats():
+    return global_bridge.outbound_stats()
+
+# --- THỐNG KÊ ROUTER (số message / thời gian xử lý theo loại, message bị chặn) ---
+@app.get("/stats/router")
+async def router_stats():
+    return {"web": global_bridge.web_router.stats(), "tcp": app.state.tcp_server.router.stats()}
+
 # --- API UPLOAD FILE (GIỮ LẠI ĐỂ TƯƠNG THÍCH DESKTOP/FALLBACK) ---
 @app.post("/upload")
 async def upload_file(
@@ -107,13 +156,9 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
     # 1. Đăng ký user vào Bridge
     await global_bridge.add_web(username, websocket)
     
-    # 2. Gửi danh sách user cập nhật
+    # 2. Người mới nhận danh sách đầy đủ; mọi người khác nhận delta USER_ONLINE (add_web đã báo presence)
     try:
-        users = list(global_bridge.tcp_clients.keys()) + list(global_bridge.web_clients.keys())
-        # Gửi riêng cho người mới
-        await websocket.send_json({"type": "SYSTEM", "users": users})
-        # Thông báo cho mọi người
-        await global_bridge.broadcast({"type": "SYSTEM", "users": users})
+        await global_bridge.web_clients.get(username, websocket).send_json(global_bridge.presence.snapshot())
     except: pass
 
     # 3. [FIX QUAN TRỌNG] Chuyển giao việc lắng nghe cho Bridge
@@ -122,4 +167,27 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
     await global_bridge.listen_to_web_user(username)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Hybrid Chat Server (Web + Desktop)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Số process (>1: SO_REUSEPORT + bus giữa các worker)")
+    parser.add_argument("--handoff", action="store_true",
+                        help="Restart không downtime: nhận socket lắng nghe từ process đang chạy (nếu có), "
+                             "process cũ tự drain")
+    args = parser.parse_args()
+    if args.workers > 1:
+        run_cluster(args.workers)
+        sys.exit(0)
+
+    if args.handoff:
+        LISTENERS.update(receive_listeners(HANDOFF_SOCKET) or {"http": listen_socket("0.0.0.0", 8000)})
+        uvicorn_server = uvicorn.Server(
+            uvicorn.Config(app, loop=preferred_loop(), ws_per_message_deflate=True)
+        )
+        uvicorn_server.run(sockets=[LISTENERS["http"]])
+        sys.exit(0)
+
+    # permessage-deflate: trình duyệt tự thương lượng nén cho từng kết nối WebSocket
+    # uvloop (nếu có) chạy cả Web lẫn TCP Server vì dùng chung 1 event loop
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, ws_per_message_deflate=True,
+                loop=preferred_loop())
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+server/media.py - Báo lại cho người gửi media số frame bị bỏ ở phía người nhận (MEDIA_FEEDBACK)
+
+Hàng đợi gửi của người nhận (MediaLanes) đếm frame bị bỏ theo người gửi: video bị frame mới
+thay khi chưa kịp gửi, audio bị đẩy khỏi FIFO. Sau mỗi lần chuyển tiếp, tối đa 1 lần mỗi
+`interval` giây cho mỗi cặp (người gửi, người nhận), số đếm được lấy ra và gửi về người gửi:
+{"peer", "video_dropped", "audio_dropped", "interval"} -> người gửi giảm fps / chất lượng.
+Không bỏ frame nào thì không gửi gì.
+"""
+
+import threading
+import time
+
+from common.config import MEDIA_FEEDBACK_INTERVAL
+from common.protocol import Protocol, MessageType
+
+
+class MediaFeedback:
+    def __init__(self, interval=MEDIA_FEEDBACK_INTERVAL):
+        self.interval = interval
+        self._last = {}      # {(sender, recipient): lần hỏi gần nhất}
+        self._lock = threading.Lock()
+        self.sent = 0
+
+    def after_relay(self, sender, sender_handle, recipient, recipient_handle):
+        """Gọi sau khi xếp 1 frame media cho recipient_handle (đã xếp hàng, chưa chắc đã gửi)"""
+        if sender_handle is None or recipient_handle is None:
+            return
+        key = (sender, recipient)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is None:
+                # Cặp mới: bắt đầu tính từ đây
+                self._last[key] = now
+                return
+            if now - last < self.interval:
+                return
+            self._last[key] = now
+        take_dropped = getattr(recipient_handle, "take_media_dropped", None)
+        if take_dropped is None:
+            return
+        video, audio = take_dropped(sender)
+        if not video and not audio:
+            return
+        self.sent += 1
+        Protocol.send_message(sender_handle, MessageType.MEDIA_FEEDBACK, {
+            "type": MessageType.MEDIA_FEEDBACK,
+            "peer": recipient,
+            "video_dropped": video,
+            "audio_dropped": audio,
+            "interval": round(now - last, 2),
+        })
+
+    def forget(self, username):
+        """User đã ngắt kết nối: bỏ mọi cặp có user này"""
+        with self._lock:
+            for key in [k for k in self._last if username in k]:
+                del self._last[key]
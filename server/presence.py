@@ -0,0 +1,90 @@
+"""
+server/presence.py - Trạng thái online có version, gửi delta thay vì cả danh sách
+
+- Login/logout chỉ đánh dấu "có thay đổi" (changed); sau PRESENCE_COALESCE_WINDOW giây mới so
+  danh sách hiện tại với bản đã công bố -> 1 lượt login dồn dập chỉ tốn 1 lần tính + 1 lần gửi.
+- Mỗi lần gửi: USER_ONLINE / USER_OFFLINE {"users": [...], "version": n}, version tăng 1 mỗi delta.
+- Danh sách đầy đủ LIST_USERS {"users", "version"} chỉ gửi cho người mới vào, client phát hiện
+  lỡ version (gửi LIST_USERS lên để xin lại) và client cũ không có feature "presence".
+"""
+
+import threading
+
+from common.config import PRESENCE_COALESCE_WINDOW
+from common.framing import EncodedMessage
+from common.protocol import Protocol, MessageType
+
+
+def send_presence(sockets, deltas, snapshot):
+    """
+    Gửi 1 lượt thay đổi cho các kết nối Desktop: delta cho client hỗ trợ "presence",
+    danh sách đầy đủ cho client cũ. Mỗi message chỉ encode 1 lần.
+    """
+    encoded = [EncodedMessage(msg_type, payload) for msg_type, payload in deltas]
+    full = None
+    for sock in sockets:
+        # ResumableSession đang chờ resume không có features -> gửi đầy đủ (an toàn khi phát lại)
+        if getattr(sock, "supports_presence", False):
+            for message in encoded:
+                Protocol.send_encoded(sock, message)
+        else:
+            if full is None:
+                full = EncodedMessage(MessageType.LIST_USERS, snapshot)
+            Protocol.send_encoded(sock, full)
+
+
+class PresenceService:
+    """
+    list_users(): danh sách user đang online (đã lọc kết nối ẩn)
+    deliver(deltas, snapshot): gửi [(msg_type, payload)] + danh sách đầy đủ cho mọi client
+    loop: event loop để chạy deliver (Bridge cần vì WebSocket); None = chạy trên thread Timer
+    """
+
+    def __init__(self, list_users, deliver, loop=None, window=PRESENCE_COALESCE_WINDOW):
+        self.list_users = list_users
+        self.deliver = deliver
+        self.loop = loop
+        self.window = window
+
+        self.version = 0
+        self._published = frozenset()   # Danh sách ở version hiện tại
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def changed(self):
+        """Có user vào/ra (gọi từ bất kỳ thread nào): hẹn 1 lần flush cho cả loạt thay đổi"""
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        loop = self.loop
+        if loop is None:
+            timer = threading.Timer(self.window, self.flush)
+            timer.daemon = True
+            timer.start()
+        else:
+            loop.call_soon_threadsafe(loop.call_later, self.window, self.flush)
+
+    def flush(self):
+        with self._lock:
+            self._scheduled = False
+            current = frozenset(self.list_users())
+            online = current - self._published
+            offline = self._published - current
+            deltas = []
+            for msg_type, users in ((MessageType.USER_ONLINE, online), (MessageType.USER_OFFLINE, offline)):
+                if users:
+                    self.version += 1
+                    deltas.append((msg_type, {"type": msg_type, "users": sorted(users), "version": self.version}))
+            self._published = current
+            snapshot = self._snapshot()
+        if deltas:
+            self.deliver(deltas, snapshot)
+
+    def snapshot(self):
+        """Danh sách đầy đủ ở version hiện tại (cho người mới vào / client xin lại)"""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {"type": MessageType.LIST_USERS, "users": sorted(self._published), "version": self.version}
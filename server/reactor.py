@@ -0,0 +1,417 @@
+"""
+server/reactor.py - Chế độ reactor cho ChatServer (TCP-only)
+
+1 thread selectors (epoll trên Linux) giữ mọi socket non-blocking: accept, recv_into thẳng vào
+FrameDecoder của từng kết nối, ghi gộp bằng sendmsg khi socket ghi được.
+Handler (ClientHandler.dispatch) chạy trên worker pool cố định; frame của cùng 1 kết nối
+luôn được xử lý tuần tự, đúng thứ tự nhận.
+"""
+
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common.config import RECV_HIGH_WATER, OUTBOUND_CONTROL_LIMIT, OUTBOUND_BLOCK_TIMEOUT
+from common.connection import SessionState
+from common.framing import FrameDecoder
+from common.outbound import MAX_IOV, MediaLanes
+from common.protocol import Protocol
+
+# Số frame tối đa 1 lượt worker xử lý cho 1 kết nối trước khi nhường kết nối khác
+DRAIN_BATCH = 64
+
+
+class ReactorConnection(SessionState):
+    """
+    Kết nối non-blocking của reactor, cùng giao diện với common.connection.Connection
+    (send_message, send_encoded, close, recv...) để ClientHandler / FileHandler dùng chung.
+    Mọi trạng thái (decoder, buffer gửi) được bảo vệ bởi self.lock vì reactor thread và
+    worker cùng chạm vào.
+    Buffer gửi có giới hạn như OutboundQueue: media qua MediaLanes (video chỉ giữ frame mới nhất),
+    chat/presence vượt OUTBOUND_CONTROL_LIMIT thì worker chờ tối đa OUTBOUND_BLOCK_TIMEOUT
+    rồi ngắt kết nối.
+    """
+
+    def __init__(self, reactor, sock, address):
+        self.reactor = reactor
+        self.sock = sock
+        self.address = address
+        self._init_session(FrameDecoder())
+        self.handler = None
+
+        self.lock = threading.Condition()
+        self.out = deque()          # Frame chờ ghi
+        self.out_bytes = 0
+        self.media = MediaLanes()   # Video/audio chờ ghi (chỉ vào out khi out đã ghi hết)
+        self.closed = False
+        self.eof = False            # Client đã đóng chiều gửi / socket lỗi
+        self.read_paused = False
+        self.draining = False       # Đang có 1 worker xử lý frame của kết nối này
+        self._finished = False
+
+        # Thống kê (outbound_stats)
+        self.blocked = 0
+        self.overflowed = False
+
+    # --- REACTOR THREAD ---
+
+    def on_readable(self):
+        with self.lock:
+            try:
+                got = self.sock.recv_into(self.decoder.get_buffer())
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                got = 0
+            if got:
+                self.decoder.buffer_updated(got)
+                # Handler chậm hơn tốc độ nhận -> ngừng đọc cho tới khi worker xử lý bớt
+                if self.decoder.pending > RECV_HIGH_WATER:
+                    self.read_paused = True
+            else:
+                self.eof = True
+            # Upload kiểu cũ đang chờ raw bytes trong recv()
+            self.lock.notify_all()
+            schedule = not self.draining
+            self.draining = True
+        if schedule:
+            self.reactor.pool.submit(self._drain)
+        if self.read_paused or self.eof:
+            self.reactor.update(self)
+
+    def on_writable(self):
+        with self.lock:
+            self._flush()
+        self.reactor.update(self)
+
+    def _flush(self):
+        """Ghi gộp các frame đang chờ (gọi khi giữ lock); ghi thiếu thì giữ phần còn lại"""
+        out = self.out
+        self._promote_media()
+        while out:
+            batch = [out[i] for i in range(min(len(out), MAX_IOV))]
+            try:
+                if hasattr(self.sock, "sendmsg"):
+                    sent = self.sock.sendmsg(batch)
+                else:
+                    sent = self.sock.send(b"".join(batch))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                out.clear()
+                self.media.clear()
+                self.out_bytes = 0
+                self.eof = True
+                self.lock.notify_all()
+                return
+            self.out_bytes -= sent
+            while sent:
+                head = out[0]
+                if sent >= len(head):
+                    sent -= len(head)
+                    out.popleft()
+                else:
+                    out[0] = memoryview(head)[sent:]
+                    sent = 0
+            # Worker đang chờ vì buffer đầy
+            self.lock.notify_all()
+            self._promote_media()
+
+    def _promote_media(self):
+        """Media chỉ vào buffer ghi khi chat/presence đã ghi hết: media chờ vẫn bỏ được frame cũ"""
+        if not self.out and self.media:
+            self.out_bytes += self.media.nbytes
+            self.out.extend(self.media.take())
+
+    @property
+    def events(self):
+        """Sự kiện reactor cần theo dõi cho kết nối này"""
+        if self.closed:
+            return 0
+        events = 0
+        if not self.eof and not self.read_paused:
+            events |= selectors.EVENT_READ
+        if self.out or self.media:
+            events |= selectors.EVENT_WRITE
+        return events
+
+    # --- WORKER ---
+
+    def _drain(self):
+        """Xử lý các frame đã nhận (chạy trên worker), tối đa DRAIN_BATCH frame mỗi lượt"""
+        for _ in range(DRAIN_BATCH):
+            with self.lock:
+                raw = None if self.closed else self.decoder.next_raw_frame()
+                if raw is None:
+                    self.draining = False
+                    finished = self.eof or self.closed
+                    resume = self.read_paused and self.decoder.pending < RECV_HIGH_WATER // 2
+                    if resume:
+                        self.read_paused = False
+                    break
+                msg_type, data = self._decode(*raw)
+            if msg_type is None:
+                # Context giải nén hỏng: không đọc tiếp được frame nào -> đóng như khi client ngắt
+                self._finish()
+                return
+            try:
+                keep = self.handler.dispatch(msg_type, data)
+            except Exception as e:
+                print(f"❌ Error handling {self.handler.username or self.address}: {e}")
+                keep = False
+            if keep is False:
+                self._finish()
+                return
+        else:
+            # Còn frame: xếp hàng lại để worker khác phục vụ kết nối khác trước
+            self.reactor.pool.submit(self._drain)
+            return
+
+        if finished:
+            self._finish()
+        elif resume:
+            self.reactor.update(self)
+
+    def _finish(self):
+        with self.lock:
+            if self._finished:
+                return
+            self._finished = True
+        try:
+            self.handler.finish()
+        finally:
+            self.close()
+
+    # --- GIAO DIỆN GIỐNG Connection (gọi từ bất kỳ thread nào) ---
+
+    def send_message(self, msg_type, data):
+        """Encode theo phiên rồi xếp vào buffer gửi (dùng qua Protocol.send_message)"""
+        with self.lock:
+            frame = self.encoder.encode(msg_type, data)
+            if msg_type in Protocol.MEDIA_TYPES:
+                self._write(frame, msg_type, data.get("sender"))
+            else:
+                self._write(frame)
+        self.reactor.update(self)
+
+    def send_encoded(self, encoded):
+        """Gửi EncodedMessage: dùng lại frame đã encode cho wire format của phiên này"""
+        with self.lock:
+            if encoded.msg_type in Protocol.MEDIA_TYPES:
+                self._write(encoded.frame_for(self.encoder), encoded.msg_type, encoded.sender)
+            else:
+                self._write(encoded.frame_for(self.encoder))
+        self.reactor.update(self)
+
+    def sendall(self, data):
+        with self.lock:
+            self._write(bytes(data))
+        self.reactor.update(self)
+
+    def _write(self, frame, media=None, sender=None):
+        # Encode + xếp hàng trong cùng 1 lần giữ lock: giữ đúng thứ tự (bắt buộc khi có nén)
+        if self.closed or self.eof:
+            raise OSError("Connection closed")
+        if media:
+            # Video/audio cũ không còn giá trị: video thay frame chưa gửi, audio bỏ chunk cũ nhất
+            self.media.put(frame, media, sender)
+            return
+        if self.out_bytes >= OUTBOUND_CONTROL_LIMIT:
+            self._wait_for_room()
+        self.out.append(frame)
+        self.out_bytes += len(frame)
+
+    def _wait_for_room(self):
+        """Buffer chat/presence đầy: chờ reactor ghi bớt, quá hạn -> ngắt kết nối (gọi khi giữ lock)"""
+        self.blocked += 1
+        self.reactor.update(self)
+        deadline = time.monotonic() + OUTBOUND_BLOCK_TIMEOUT
+        while self.out_bytes >= OUTBOUND_CONTROL_LIMIT and not (self.closed or self.eof):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.overflowed = True
+                print(f"🐢 Client nhận quá chậm, ngắt kết nối: {self.address}")
+                self.out.clear()
+                self.media.clear()
+                self.out_bytes = 0
+                self.eof = True
+                self.lock.notify_all()
+                self.reactor.update(self)
+                break
+            self.lock.wait(remaining)
+        if self.closed or self.eof:
+            raise OSError("Connection closed")
+
+    def outbound_stats(self):
+        """Độ sâu buffer gửi + số frame bị bỏ (cùng dạng với OutboundQueue.stats)"""
+        with self.lock:
+            return {
+                "frames": len(self.out) + len(self.media),
+                "bytes": self.out_bytes + self.media.nbytes,
+                "media_dropped": self.media.dropped,
+                "blocked": self.blocked,
+                "overflowed": self.overflowed,
+            }
+
+    def take_media_dropped(self, sender):
+        """(video, audio) của `sender` bị bỏ vì client nhận chậm, kể từ lần hỏi trước"""
+        with self.lock:
+            return self.media.take_dropped(sender)
+
+    def start_writer(self):
+        """Tương thích Connection: reactor vốn đã ghi gộp"""
+
+    def recv(self, bufsize, *args):
+        """
+        recv thô cho upload kiểu cũ (chạy trên worker): chờ reactor nhận thêm dữ liệu.
+        Trả về b"" nếu client ngắt kết nối.
+        """
+        with self.lock:
+            while not self.decoder.pending and not self.eof and not self.closed:
+                if self.read_paused:
+                    self.read_paused = False
+                    self.reactor.update(self)
+                self.lock.wait()
+            return self.decoder.take(bufsize)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            # Cố gửi nốt các frame cuối (vd. LOGIN_FAILED) trước khi đóng
+            self._flush()
+            self.closed = True
+            self.out.clear()
+            self.media.clear()
+            self.out_bytes = 0
+            self.lock.notify_all()
+        self.reactor.update(self)
+
+    def getpeername(self):
+        return self.address
+
+
+class Reactor:
+    """
+    Vòng lặp selectors của ChatServer.
+    Thread khác (worker) không đụng vào selector: chỉ báo qua update(), reactor tự áp dụng
+    sau khi bị đánh thức qua socketpair.
+    """
+
+    def __init__(self, server, handler_factory, workers):
+        self.server = server
+        self.handler_factory = handler_factory
+        self.selector = selectors.DefaultSelector()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-worker")
+        self.connections = set()
+
+        self._changed = set()
+        self._changed_lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._registered = {}   # {connection: events đang đăng ký}
+        self._thread = None
+
+    def update(self, conn):
+        """Yêu cầu reactor tính lại sự kiện theo dõi cho kết nối (thread-safe)"""
+        with self._changed_lock:
+            first = not self._changed
+            self._changed.add(conn)
+        if first and threading.current_thread() is not self._thread:
+            try: self._wake_w.send(b"\0")
+            except (BlockingIOError, OSError): pass
+
+    def serve_forever(self, listen_socket):
+        self._thread = threading.current_thread()
+        listen_socket.setblocking(False)
+        self.selector.register(listen_socket, selectors.EVENT_READ)
+        self.selector.register(self._wake_r, selectors.EVENT_READ)
+        try:
+            while self.server.running:
+                for key, mask in self.selector.select(timeout=1.0):
+                    if key.fileobj is listen_socket:
+                        self._accept(listen_socket)
+                    elif key.fileobj is self._wake_r:
+                        try:
+                            while self._wake_r.recv(4096): pass
+                        except (BlockingIOError, OSError): pass
+                    else:
+                        conn = key.data
+                        if mask & selectors.EVENT_READ:
+                            conn.on_readable()
+                        if mask & selectors.EVENT_WRITE:
+                            conn.on_writable()
+                self._apply_changes()
+        finally:
+            self.shutdown()
+
+    def _accept(self, listen_socket):
+        # Nhận hết các kết nối đang chờ trong backlog
+        while True:
+            try:
+                sock, address = listen_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"❌ Error accepting connection: {e}")
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = ReactorConnection(self, sock, address)
+            conn.handler = self.handler_factory(conn, address)
+            self.connections.add(conn)
+            self._set_events(conn, selectors.EVENT_READ)
+
+    def _apply_changes(self):
+        with self._changed_lock:
+            changed, self._changed = self._changed, set()
+        for conn in changed:
+            with conn.lock:
+                if (conn.out or conn.media) and not conn.closed:
+                    # Ghi luôn: phần lớn frame đi hết ngay, không cần chờ EVENT_WRITE
+                    conn._flush()
+                events = conn.events
+                closed = conn.closed
+                # Socket hỏng / bị đóng từ nơi khác mà không có worker nào đang chạy -> dọn handler
+                cleanup = (conn.eof or closed) and not conn.draining and not conn._finished
+                if cleanup:
+                    conn.draining = True
+            if cleanup:
+                self.pool.submit(conn._drain)
+            if closed:
+                self._remove(conn)
+            else:
+                self._set_events(conn, events)
+
+    def _set_events(self, conn, events):
+        current = self._registered.get(conn, 0)
+        if events == current:
+            return
+        if not events:
+            self.selector.unregister(conn.sock)
+            del self._registered[conn]
+        elif not current:
+            self.selector.register(conn.sock, events, conn)
+            self._registered[conn] = events
+        else:
+            self.selector.modify(conn.sock, events, conn)
+            self._registered[conn] = events
+
+    def _remove(self, conn):
+        self._set_events(conn, 0)
+        self.connections.discard(conn)
+        try: conn.sock.close()
+        except OSError: pass
+
+    def shutdown(self):
+        for conn in list(self.connections):
+            conn.close()
+            self._remove(conn)
+        self.pool.shutdown(wait=False)
+        self.selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
@@ -0,0 +1,134 @@
+"""
+server/registry.py - Danh bạ kết nối của BridgeManager (copy-on-write)
+
+Thread TCP (TCPServer), event loop (Web, AsyncTCPServer) và bus cluster cùng đọc/ghi danh bạ.
+- Ghi: giữ 1 lock, tạo dict mới từ bản cũ rồi thay cả snapshot bằng 1 phép gán (nguyên tử).
+- Đọc: lấy `registry.snapshot` 1 lần rồi dùng, không lock; snapshot không bao giờ bị sửa
+  nên không còn lỗi "dictionary changed size during iteration" khi broadcast giữa lúc login/logout.
+"""
+
+import threading
+from collections import namedtuple
+from functools import cached_property
+from types import MappingProxyType
+
+# Các kết nối của 1 user: Desktop (Connection / ResumableSession) và/hoặc Web (WebOutbound)
+UserEntry = namedtuple("UserEntry", "tcp web")
+_EMPTY = UserEntry(None, None)
+
+
+class Snapshot:
+    """Danh bạ tại 1 thời điểm (chỉ đọc). version tăng sau mỗi lần ghi."""
+
+    def __init__(self, version, users, uploads):
+        self.version = version
+        # dict gốc không bao giờ bị sửa sau khi tạo snapshot -> snapshot sau dùng lại được
+        self._users = users
+        self._uploads = uploads
+        self.users = MappingProxyType(users)        # {username: UserEntry}
+        self.uploads = MappingProxyType(uploads)    # {username: websocket} (kết nối upload/download ẩn)
+
+    # Các view theo transport: tính 1 lần cho mỗi snapshot, lúc được đọc lần đầu
+
+    @cached_property
+    def tcp(self):
+        """{username: socket Desktop}"""
+        return MappingProxyType({u: e.tcp for u, e in self.users.items() if e.tcp is not None})
+
+    @cached_property
+    def web(self):
+        """{username: WebOutbound}"""
+        return MappingProxyType({u: e.web for u, e in self.users.items() if e.web is not None})
+
+    def get(self, username):
+        return self.users.get(username, _EMPTY)
+
+
+class ConnectionRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.snapshot = Snapshot(0, {}, {})
+
+    def _publish(self, users=None, uploads=None):
+        """Thay snapshot (gọi khi giữ lock)"""
+        old = self.snapshot
+        self.snapshot = Snapshot(
+            old.version + 1,
+            users if users is not None else old._users,
+            uploads if uploads is not None else old._uploads,
+        )
+
+    def _set(self, username, **changes):
+        """Sửa entry của 1 user, bỏ luôn user không còn kết nối nào (gọi khi giữ lock)"""
+        users = dict(self.snapshot.users)
+        entry = users.get(username, _EMPTY)._replace(**changes)
+        if entry.tcp is None and entry.web is None:
+            users.pop(username, None)
+        else:
+            users[username] = entry
+        self._publish(users=users)
+
+    # --- DESKTOP (TCP) ---
+
+    def set_tcp(self, username, sock):
+        """Gắn kết nối Desktop cho user. Returns: kết nối cũ (người gọi tự đóng) hoặc None"""
+        with self._lock:
+            old = self.snapshot.get(username).tcp
+            self._set(username, tcp=sock)
+            return old
+
+    def remove_tcp(self, username, sock=None):
+        """
+        Gỡ kết nối Desktop. sock: chỉ gỡ nếu user vẫn đang dùng đúng kết nối này
+        (kết nối cũ đã bị kick không được xoá nhầm kết nối mới). Returns: True nếu đã gỡ.
+        """
+        with self._lock:
+            current = self.snapshot.get(username).tcp
+            if current is None or (sock is not None and current is not sock):
+                return False
+            self._set(username, tcp=None)
+            return True
+
+    # --- WEB ---
+
+    def set_web(self, username, websocket):
+        """Gắn WebSocket chat cho user. Returns: WebSocket cũ (người gọi tự đóng) hoặc None"""
+        with self._lock:
+            old = self.snapshot.get(username).web
+            self._set(username, web=websocket)
+            return old
+
+    def remove_web(self, username, websocket=None):
+        """Gỡ WebSocket chat (như remove_tcp). Returns: WebSocket đã gỡ hoặc None"""
+        with self._lock:
+            current = self.snapshot.get(username).web
+            if current is None or (websocket is not None and current is not websocket):
+                return None
+            self._set(username, web=None)
+            return current
+
+    # --- KẾT NỐI UPLOAD/DOWNLOAD ẨN ---
+
+    def set_upload(self, username, websocket):
+        with self._lock:
+            uploads = dict(self.snapshot.uploads)
+            uploads[username] = websocket
+            self._publish(uploads=uploads)
+
+    def remove_upload(self, username):
+        with self._lock:
+            if username not in self.snapshot.uploads:
+                return
+            uploads = dict(self.snapshot.uploads)
+            del uploads[username]
+            self._publish(uploads=uploads)
+
+    def pop_user(self, username):
+        """Gỡ mọi kết nối của user (đăng nhập ở worker khác). Returns: UserEntry đã gỡ"""
+        with self._lock:
+            entry = self.snapshot.get(username)
+            if entry is not _EMPTY:
+                users = dict(self.snapshot.users)
+                del users[username]
+                self._publish(users=users)
+            return entry
@@ -0,0 +1,186 @@
+"""
+server/rooms.py - Phòng chat (room) + chỉ mục room -> thành viên
+
+Chat nhóm kiểu cũ gửi cho TẤT CẢ user; message có "room" chỉ đi tới thành viên của room đó.
+- Mỗi thành viên lưu sẵn kết nối để gửi (UserEntry(tcp, web) như registry) -> fan-out không
+  phải tra danh bạ, 1 frame encode 1 lần dùng chung cho mọi thành viên.
+- Copy-on-write như ConnectionRegistry: ghi giữ lock rồi thay dict, đọc (`members`) không lock.
+- Room tự mất khi người cuối cùng rời đi / ngắt kết nối.
+- Chạy cluster: RoomIndex chỉ giữ thành viên kết nối vào worker này; thành viên ở worker khác
+  đến từ ClusterBus.remote_rooms (mỗi worker báo vào/ra room của user mình qua bus).
+  Room tồn tại khi còn thành viên ở bất kỳ worker nào.
+"""
+
+import threading
+from types import MappingProxyType
+
+from common.framing import EncodedMessage
+from common.protocol import Protocol, MessageType
+from server.registry import UserEntry
+
+MAX_ROOM_NAME = 64
+_NO_MEMBERS = MappingProxyType({})
+
+
+class RoomIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}     # {room: MappingProxy {username: UserEntry}} - không sửa tại chỗ
+        self._joined = {}    # {username: set(room)} - để dọn nhanh khi user ngắt kết nối
+
+    def members(self, room):
+        """{username: UserEntry} của room (chỉ đọc, rỗng nếu room không tồn tại)"""
+        return self._rooms.get(room, _NO_MEMBERS)
+
+    def rooms_of(self, username):
+        return sorted(self._joined.get(username, ()))
+
+    def memberships(self):
+        """[(room, username)] mọi thành viên ở process này (gửi cho worker mới lên)"""
+        return [(room, username) for room, members in self._rooms.items() for username in members]
+
+    def create(self, room, username, handle, slot="tcp"):
+        """Tạo room và cho người tạo vào luôn. Returns: thành viên hoặc None nếu room đã có"""
+        with self._lock:
+            if room in self._rooms:
+                return None
+            return self._set(room, username, UserEntry(None, None)._replace(**{slot: handle}))
+
+    def join(self, room, username, handle, slot="tcp", create=False):
+        """
+        slot: "tcp" / "web". create: room chỉ có thành viên ở worker khác -> tạo bản ở đây.
+        Returns: thành viên sau khi vào, None nếu room không tồn tại
+        """
+        with self._lock:
+            members = self._rooms.get(room)
+            if members is None and not create:
+                return None
+            entry = (members or _NO_MEMBERS).get(username, UserEntry(None, None))._replace(**{slot: handle})
+            return self._set(room, username, entry)
+
+    def leave(self, room, username):
+        """Rời room (mọi kết nối của user). Returns: True nếu đang ở trong room"""
+        with self._lock:
+            if username not in self._rooms.get(room, _NO_MEMBERS):
+                return False
+            self._set(room, username, None)
+            return True
+
+    def drop(self, username, slot=None):
+        """
+        Kết nối của user đã đóng: gỡ kết nối đó (slot, None = tất cả) khỏi mọi room.
+        Returns: [room] mà user không còn là thành viên (để báo ROOM_LEAVE)
+        """
+        left = []
+        with self._lock:
+            for room in list(self._joined.get(username, ())):
+                entry = self._rooms[room][username]
+                if slot is not None:
+                    entry = entry._replace(**{slot: None})
+                if slot is None or (entry.tcp is None and entry.web is None):
+                    entry = None
+                    left.append(room)
+                self._set(room, username, entry)
+        return left
+
+    def _set(self, room, username, entry):
+        """Sửa 1 thành viên (None = gỡ), bỏ room rỗng (gọi khi giữ lock)"""
+        members = dict(self._rooms.get(room, _NO_MEMBERS))
+        joined = self._joined.setdefault(username, set())
+        if entry is None:
+            members.pop(username, None)
+            joined.discard(room)
+        else:
+            members[username] = entry
+            joined.add(room)
+        if not joined:
+            del self._joined[username]
+
+        rooms = dict(self._rooms)
+        if members:
+            rooms[room] = MappingProxyType(members)
+        else:
+            rooms.pop(room, None)
+        self._rooms = rooms
+        return rooms.get(room, _NO_MEMBERS)
+
+
+def room_name(data):
+    """Tên room hợp lệ từ message, None nếu thiếu / quá dài"""
+    room = data.get("room") if isinstance(data, dict) else None
+    if not isinstance(room, str):
+        return None
+    room = room.strip()
+    return room if 0 < len(room) <= MAX_ROOM_NAME else None
+
+
+def fan_out(members, encoded, skip=()):
+    """
+    Gửi 1 EncodedMessage cho {username: UserEntry} (thành viên room / snapshot.users), trừ skip.
+    Không chờ mạng: Web chỉ xếp text JSON vào hàng đợi WebOutbound (gọi trên event loop),
+    Desktop xếp frame theo wire format của phiên -> người cuối nhận gần như cùng lúc người đầu.
+    Returns: [username] gửi lỗi (kết nối đã đóng / quá tải)
+    """
+    failed = []
+    for username, entry in members.items():
+        if username in skip:
+            continue
+        for handle in entry:
+            if handle is not None and not Protocol.send_encoded(handle, encoded):
+                failed.append(username)
+    return failed
+
+
+def handle_room_command(rooms, msg_type, data, username, handle, slot="tcp", bus=None):
+    """
+    Xử lý ROOM_CREATE / ROOM_JOIN / ROOM_LEAVE của 1 kết nối.
+    Người gửi nhận lại cùng loại message kèm danh sách thành viên (hoặc ERROR),
+    các thành viên khác nhận {"room", "username"}.
+    bus: ClusterBus (chạy cluster) -> tính cả thành viên ở worker khác, báo vào/ra cho các worker đó
+    """
+    room = room_name(data)
+    if room is None:
+        Protocol.send_message(handle, MessageType.ERROR, {"message": "Tên room không hợp lệ"})
+        return
+
+    if msg_type == MessageType.ROOM_LEAVE:
+        if not rooms.leave(room, username):
+            Protocol.send_message(handle, MessageType.ERROR, {"message": f"Bạn không ở trong room {room}"})
+            return
+        Protocol.send_message(handle, msg_type, {"type": msg_type, "room": room, "username": username})
+        notify_leave(rooms, room, username)
+        if bus is not None:
+            bus.publish("room_member", room, username, False)
+        return
+
+    remote = bus.room_members(room) if bus is not None else _NO_MEMBERS
+    if msg_type == MessageType.ROOM_CREATE:
+        members = None if remote else rooms.create(room, username, handle, slot)
+        error = f"Room {room} đã tồn tại"
+    else:
+        members = rooms.join(room, username, handle, slot, create=bool(remote))
+        error = f"Room {room} không tồn tại"
+    if members is None:
+        Protocol.send_message(handle, MessageType.ERROR, {"message": error})
+        return
+
+    everyone = set(members).union(remote)
+    print(f"🚪 [Room] {username} -> {room} ({len(everyone)} thành viên)")
+    Protocol.send_message(handle, msg_type, {
+        "type": msg_type, "room": room, "username": username, "members": sorted(everyone)
+    })
+    notify_join(rooms, room, username)
+    if bus is not None:
+        bus.publish("room_member", room, username, True)
+
+
+def notify_join(rooms, room, username):
+    """Báo các thành viên (ở process này) của room: username vừa vào"""
+    notice = {"type": MessageType.ROOM_JOIN, "room": room, "username": username}
+    fan_out(rooms.members(room), EncodedMessage(MessageType.ROOM_JOIN, notice), skip=(username,))
+
+
+def notify_leave(rooms, room, username):
+    """Báo các thành viên còn lại (ở process này) của room: username đã rời đi"""
+    notice = {"type": MessageType.ROOM_LEAVE, "room": room, "username": username}
+    fan_out(rooms.members(room), EncodedMessage(MessageType.ROOM_LEAVE, notice), skip=(username,))
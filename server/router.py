@@ -0,0 +1,246 @@
+"""
+server/router.py - Định tuyến message theo bảng + chuỗi middleware
+
+Thay cho chuỗi if/elif theo từng loại message (ClientHandler, TCPServer, AsyncTCPServer,
+BridgeManager.listen_to_web_user): mỗi loại đăng ký 1 handler vào bảng {msg_type: handler},
+định tuyến = 1 lần tra dict -> chi phí không tăng khi thêm loại message mới.
+
+Trước handler là chuỗi middleware dùng chung cho cả 3 server:
+  - Validate:  message phải có đủ trường bắt buộc, chưa LOGIN thì chỉ được LOGIN/PING/PONG/ACK
+  - RateLimit: token bucket cho mỗi kết nối (chat / lệnh điều khiển, không áp cho media, chunk file)
+  - Metrics:   số message + thời gian xử lý theo từng loại (Router.stats())
+Middleware có before(ctx, msg_type, data) -> False để bỏ message, after(ctx, msg_type, elapsed).
+
+Bảng tra theo tên loại message (MessageType.*): frame binary đã được decode mã 1 byte ra tên
+trước khi tới đây, Web gửi thẳng tên trong "type".
+"""
+
+import inspect
+import time
+
+from common.config import RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST
+from common.protocol import Protocol, MessageType
+
+
+class ClientContext:
+    """
+    Trạng thái 1 kết nối cho handler / middleware (TCPServer, AsyncTCPServer, Web).
+    conn: kết nối nhận frame; target: nơi gửi trả lời (ResumableSession hoặc chính conn);
+    username: None khi chưa LOGIN; state: chỗ middleware lưu dữ liệu riêng của kết nối.
+    ClientHandler (ChatServer) tự có đủ các thuộc tính này nên dùng luôn chính nó làm ctx.
+    """
+    __slots__ = ("conn", "target", "username", "slot", "state")
+
+    def __init__(self, conn, username=None, slot="tcp"):
+        self.conn = conn
+        self.target = conn
+        self.username = username
+        self.slot = slot
+        self.state = {}
+
+    def reply(self, msg_type, data):
+        return Protocol.send_message(self.target, msg_type, data)
+
+
+class Router:
+    """
+    handler(ctx, msg_type, data) đăng ký bằng add() hoặc decorator on(); loại không có trong
+    bảng đi tới fallback (None = bỏ qua). dispatch() trả về kết quả của handler
+    (ClientHandler: False = đóng kết nối), dispatch_async() chờ luôn handler là coroutine.
+    """
+
+    def __init__(self, fallback=None, middleware=()):
+        self.routes = {}
+        self.fallback = fallback
+        self.middleware = list(middleware)
+
+    def add(self, msg_types, handler):
+        if isinstance(msg_types, str):
+            msg_types = (msg_types,)
+        for msg_type in msg_types:
+            self.routes[msg_type] = handler
+        return handler
+
+    def on(self, *msg_types):
+        """Decorator: @router.on(MessageType.TEXT)"""
+        return lambda handler: self.add(msg_types, handler)
+
+    def use(self, middleware):
+        self.middleware.append(middleware)
+        return middleware
+
+    def _admit(self, ctx, msg_type, data):
+        """Handler cho message này, None nếu không có route hoặc middleware chặn"""
+        handler = self.routes.get(msg_type, self.fallback)
+        if handler is None:
+            return None
+        for middleware in self.middleware:
+            if middleware.before(ctx, msg_type, data) is False:
+                return None
+        return handler
+
+    def _finish(self, ctx, msg_type, start):
+        elapsed = time.perf_counter() - start
+        for middleware in self.middleware:
+            middleware.after(ctx, msg_type, elapsed)
+
+    def dispatch(self, ctx, msg_type, data):
+        handler = self._admit(ctx, msg_type, data)
+        if handler is None:
+            return None
+        start = time.perf_counter()
+        try:
+            return handler(ctx, msg_type, data)
+        finally:
+            self._finish(ctx, msg_type, start)
+
+    async def dispatch_async(self, ctx, msg_type, data):
+        handler = self._admit(ctx, msg_type, data)
+        if handler is None:
+            return None
+        start = time.perf_counter()
+        try:
+            result = handler(ctx, msg_type, data)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            self._finish(ctx, msg_type, start)
+
+    def stats(self):
+        """Thống kê của các middleware có stats() (Metrics, RateLimit)"""
+        stats = {}
+        for middleware in self.middleware:
+            get_stats = getattr(middleware, "stats", None)
+            if get_stats is not None:
+                stats[type(middleware).__name__.lower()] = get_stats()
+        return stats
+
+
+# --- MIDDLEWARE ---
+
+class Middleware:
+    def before(self, ctx, msg_type, data):
+        return True
+
+    def after(self, ctx, msg_type, elapsed):
+        pass
+
+
+class Validate(Middleware):
+    """
+    Chặn message thiếu trường bắt buộc (trả ERROR, LOGIN thì LOGIN_FAILURE)
+    và message gửi trước khi LOGIN (trừ các loại trong `public`).
+    """
+
+    REQUIRED = {
+        MessageType.LOGIN: ("username",),
+        MessageType.FILE_UPLOAD: ("filename",),
+        MessageType.FILE_CHUNK: ("channel",),
+        MessageType.FILE_DOWNLOAD: ("filename",),
+        MessageType.CALL_REQUEST: ("recipient",),
+        MessageType.VIDEO_DATA: ("recipient",),
+        MessageType.AUDIO_DATA: ("recipient",),
+        "FILE_UPLOAD_START": ("data",),
+        "FILE_DOWNLOAD_REQUEST": ("data",),
+    }
+    PUBLIC = frozenset({MessageType.LOGIN, MessageType.PING, MessageType.PONG, MessageType.ACK})
+
+    def __init__(self, required=None, public=PUBLIC):
+        self.required = self.REQUIRED if required is None else required
+        self.public = public
+        self.rejected = 0
+
+    def before(self, ctx, msg_type, data):
+        if ctx.username is None and msg_type not in self.public:
+            self.rejected += 1
+            return False
+        fields = self.required.get(msg_type)
+        if fields is None:
+            return True
+        # dict hoặc RelayFrame (media cut-through, cũng có get)
+        get = getattr(data, "get", None)
+        missing = list(fields) if get is None else [f for f in fields if not get(f)]
+        if not missing:
+            return True
+        self.rejected += 1
+        reply_type = MessageType.LOGIN_FAILURE if msg_type == MessageType.LOGIN else MessageType.ERROR
+        ctx.reply(reply_type, {"message": f"{msg_type} thiếu trường: {', '.join(missing)}"})
+        return False
+
+    def stats(self):
+        return {"rejected": self.rejected}
+
+
+# Chat / lệnh điều khiển do người dùng gõ; media, chunk file, ACK, PING/PONG, ICE không giới hạn
+RATE_LIMITED_TYPES = frozenset({
+    MessageType.TEXT, MessageType.PRIVATE_TEXT, MessageType.LIST_USERS,
+    MessageType.FILE_UPLOAD, MessageType.FILE_DOWNLOAD,
+    MessageType.CALL_REQUEST, MessageType.CALL_ACCEPT, MessageType.CALL_REJECT,
+    MessageType.CALL_BUSY, MessageType.CALL_END,
+    MessageType.ROOM_CREATE, MessageType.ROOM_JOIN, MessageType.ROOM_LEAVE,
+    "FILE_UPLOAD_START", "FILE_DOWNLOAD_REQUEST",
+})
+
+
+class RateLimit(Middleware):
+    """
+    Token bucket cho mỗi kết nối: `rate` message/giây, dồn tối đa `burst`.
+    Hết token -> bỏ message, báo ERROR 1 lần cho mỗi đợt bị chặn (không báo theo từng message).
+    """
+
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, burst=RATE_LIMIT_BURST, types=RATE_LIMITED_TYPES):
+        self.rate = rate
+        self.burst = burst
+        self.types = types
+        self.limited = 0
+
+    def before(self, ctx, msg_type, data):
+        if msg_type not in self.types:
+            return True
+        now = time.monotonic()
+        tokens, last, warned = ctx.state.get("rate_limit", (self.burst, now, False))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            ctx.state["rate_limit"] = (tokens - 1, now, False)
+            return True
+        self.limited += 1
+        ctx.state["rate_limit"] = (tokens, now, True)
+        if not warned:
+            print(f"🚦 [Router] {ctx.username} gửi quá nhanh, bỏ bớt message")
+            ctx.reply(MessageType.ERROR, {"message": "Bạn gửi quá nhanh, vui lòng chờ một chút"})
+        return False
+
+    def stats(self):
+        return {"limited": self.limited}
+
+
+class Metrics(Middleware):
+    """Số message đã xử lý + tổng / lớn nhất thời gian handler theo từng loại"""
+
+    def __init__(self):
+        self.counts = {}    # {msg_type: [count, total_seconds, max_seconds]}
+
+    def after(self, ctx, msg_type, elapsed):
+        entry = self.counts.get(msg_type)
+        if entry is None:
+            entry = self.counts[msg_type] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+
+    def stats(self):
+        return {
+            msg_type: {
+                "count": count,
+                "avg_ms": round(total / count * 1000, 3),
+                "max_ms": round(peak * 1000, 3),
+            }
+            for msg_type, (count, total, peak) in list(self.counts.items())
+        }
+
+
+def standard_router(fallback=None):
+    """Router với chuỗi middleware chuẩn: Validate -> RateLimit -> Metrics"""
+    return Router(fallback, (Validate(), RateLimit(), Metrics()))
@@ -5,19 +5,41 @@ import socket
 import threading
 import os
 
-from common.config import SERVER_STORAGE_DIR
+from common.config import SERVER_STORAGE_DIR, SERVER_MODE, LISTEN_BACKLOG, REACTOR_WORKERS
 from common.protocol import Protocol, MessageType
+from common.framing import EncodedMessage
 from server.handlers.client_handler import ClientHandler
+from server.reactor import Reactor
+from server.presence import PresenceService, send_presence
+from server.rooms import RoomIndex
+from server.heartbeat import HeartbeatMonitor, rtt_ms
+from server.media import MediaFeedback
 
 class ChatServer:
-    def __init__(self, host="0.0.0.0", port=5555):
+    def __init__(self, host="0.0.0.0", port=5555, mode=SERVER_MODE,
+                 backlog=LISTEN_BACKLOG, workers=REACTOR_WORKERS):
         self.host = host
         self.port = port
+        self.mode = mode
+        self.backlog = backlog
+        self.workers = workers
         self.server_socket = None
         self.clients = {}  # {username: socket}
-        self.client_threads = []
+        self.reactor = None
         self.running = False
         
+        # Online/offline: delta có version, gom theo cửa sổ ngắn (chạy trên thread Timer)
+        self.presence = PresenceService(lambda: list(self.clients), self._deliver_presence)
+        
+        # Room -> thành viên (kèm kết nối): chat theo phòng chỉ gửi cho người trong phòng
+        self.rooms = RoomIndex()
+        
+        # PING/PONG + ngắt kết nối chết (thread heartbeat riêng)
+        self.heartbeat = HeartbeatMonitor()
+        
+        # Người nhận chậm bị bỏ frame media -> báo lại người gửi (MEDIA_FEEDBACK)
+        self.media_feedback = MediaFeedback()
+        
         # Tạo thư mục lưu file
         self.storage_dir = SERVER_STORAGE_DIR
         os.makedirs(self.storage_dir, exist_ok=True)
@@ -28,17 +50,27 @@ class ChatServer:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(10)
+            self.server_socket.listen(self.backlog)
             
             self.running = True
+            self.heartbeat.start()
             
             print("=" * 60)
             print(f"🚀 SERVER STARTED")
             print(f"📍 Address: {self.host}:{self.port}")
             print(f"📁 Storage: {self.storage_dir}")
+            print(f"⚙️  Mode: {self.mode}")
             print("=" * 60)
             
-            self.accept_connections()
+            if self.mode == "reactor":
+                self.reactor = Reactor(
+                    self,
+                    lambda conn, address: ClientHandler(self, conn, address),
+                    self.workers
+                )
+                self.reactor.serve_forever(self.server_socket)
+            else:
+                self.accept_connections()
             
         except Exception as e:
             print(f"❌ Error starting server: {e}")
@@ -53,13 +85,12 @@ class ChatServer:
                 # Tạo handler cho client
                 handler = ClientHandler(self, client_socket, address)
                 
-                # Tạo thread xử lý client
+                # Tạo thread xử lý client (thread tự kết thúc khi client ngắt kết nối)
                 thread = threading.Thread(
                     target=handler.handle,
                     daemon=True
                 )
                 thread.start()
-                self.client_threads.append(thread)
                 
             except KeyboardInterrupt:
                 print("\n⏹️  Shutting down server...")
@@ -70,16 +101,23 @@ class ChatServer:
                     print(f"❌ Error accepting connection: {e}")
     
     def broadcast(self, msg_type, data, exclude=None):
-        """Broadcast message tới tất cả client"""
+        """
+        Broadcast message tới tất cả client.
+        Payload chỉ encode 1 lần cho mỗi wire format rồi dùng chung cho mọi người nhận.
+        exclude: 1 username hoặc tập username không gửi
+        """
+        if isinstance(exclude, str):
+            exclude = (exclude,)
+        exclude = exclude or ()
+        
+        encoded = EncodedMessage(msg_type, data)
         disconnected = []
         
-        for username, sock in self.clients.items():
-            if username == exclude:
+        for username, sock in list(self.clients.items()):
+            if username in exclude:
                 continue
             
-            try:
-                Protocol.send_message(sock, msg_type, data)
-            except:
+            if not Protocol.send_encoded(sock, encoded):
                 disconnected.append(username)
         
         # Xóa client bị disconnect
@@ -88,16 +126,41 @@ class ChatServer:
                 del self.clients[username]
     
     def send_user_list(self):
-        """Gửi danh sách user tới tất cả client"""
-        user_list = list(self.clients.keys())
-        self.broadcast(
-            MessageType.USER_LIST,
-            {"users": user_list}
-        )
+        """Báo danh sách user thay đổi: client nhận delta USER_ONLINE/USER_OFFLINE (gom theo lượt)"""
+        self.presence.changed()
+    
+    def _deliver_presence(self, deltas, snapshot):
+        send_presence(list(self.clients.values()), deltas, snapshot)
+    
+    def outbound_stats(self):
+        """Độ sâu hàng đợi gửi + số frame bị bỏ của từng client"""
+        return {
+            username: {"rtt_ms": rtt_ms(sock), **sock.outbound_stats()}
+            for username, sock in list(self.clients.items())
+        }
     
     def stop(self):
         """Dừng server"""
         self.running = False
+        self.heartbeat.stop()
         if self.server_socket:
             self.server_socket.close()
-        print("🛑 Server stopped")
\ No newline at end of file
+        print("🛑 Server stopped")
+
+if __name__ == "__main__":
+    # Chạy TCP-only từ thư mục gốc: python -m server.server_core --mode reactor
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="TCP Chat Server (chỉ Desktop client)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--mode", choices=("thread", "reactor"), default=SERVER_MODE)
+    parser.add_argument("--backlog", type=int, default=LISTEN_BACKLOG)
+    parser.add_argument("--workers", type=int, default=REACTOR_WORKERS)
+    args = parser.parse_args()
+    
+    server = ChatServer(args.host, args.port, args.mode, args.backlog, args.workers)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,174 @@
+"""
+server/sessions.py - Phiên resume được của Desktop client (feature "resume")
+
+Server đánh số thứ tự mọi frame gửi cho client (trừ media/PING/ACK), giữ lại các frame
+chưa được ack trong 1 buffer giới hạn. Client mất kết nối mà quay lại trong thời gian
+RESUME_GRACE_PERIOD thì chỉ cần phát lại các frame bị lỡ, không phải đăng nhập lại từ đầu.
+"""
+
+import threading
+import time
+import uuid
+from collections import deque
+
+from common.config import REPLAY_BUFFER_SIZE, RESUME_GRACE_PERIOD
+from common.protocol import Protocol
+
+
+class ResumableSession:
+    """
+    Đứng thay cho socket trong tcp_clients: Protocol.send_message/send_encoded gửi vào đây,
+    phiên đánh số, lưu vào replay buffer rồi chuyển xuống Connection hiện tại (nếu đang gắn).
+    Khi client rớt mạng, frame vẫn được lưu để phát lại lúc resume.
+    """
+
+    def __init__(self, username, connection=None, buffer_size=REPLAY_BUFFER_SIZE):
+        self.session_id = uuid.uuid4().hex
+        self.username = username
+        self.connection = None
+        self.send_seq = 0                            # Seq của frame gửi gần nhất
+        self.replay = deque(maxlen=buffer_size)      # [(seq, msg_type, data, encoded)]
+        self.detached_at = None
+        self.closed = False
+        self._lock = threading.RLock()
+        if connection is not None:
+            self.attach(connection)
+
+    # --- GẮN / TÁCH KẾT NỐI ---
+
+    @property
+    def attached(self):
+        return self.connection is not None
+
+    def attach(self, connection, last_seq=None):
+        """
+        Gắn Connection mới cho phiên. last_seq: seq cuối client đã nhận (khi resume)
+        -> phát lại các frame sau đó theo đúng thứ tự rồi mới nhận frame mới.
+        """
+        with self._lock:
+            old = self.connection
+            if old is not None and old is not connection:
+                # Kết nối cũ nửa sống nửa chết (server chưa kịp thấy rớt) -> đóng luôn
+                try: old.close()
+                except: pass
+            self.connection = connection
+            self.detached_at = None
+            connection.on_peer_ack = self.ack
+            if last_seq is not None:
+                self.ack(last_seq)
+                for seq, msg_type, data, encoded in list(self.replay):
+                    self._deliver(msg_type, data, encoded)
+
+    def detach(self, connection):
+        """Kết nối rớt: giữ phiên (và replay buffer) chờ client quay lại"""
+        with self._lock:
+            if self.connection is connection:
+                self.connection = None
+                self.detached_at = time.monotonic()
+
+    def can_resume(self, last_seq):
+        """Client đã nhận tới last_seq: các frame sau đó còn đủ trong buffer không"""
+        with self._lock:
+            if self.closed or last_seq > self.send_seq:
+                return False
+            oldest = self.replay[0][0] if self.replay else self.send_seq + 1
+            return last_seq >= oldest - 1
+
+    def expired(self, now=None):
+        if self.closed:
+            return True
+        if self.detached_at is None:
+            return False
+        return (now or time.monotonic()) - self.detached_at > RESUME_GRACE_PERIOD
+
+    # --- GỬI ---
+
+    def ack(self, seq):
+        """Client xác nhận đã nhận tới seq -> bỏ các frame đó khỏi replay buffer"""
+        with self._lock:
+            while self.replay and self.replay[0][0] <= seq:
+                self.replay.popleft()
+
+    def _send(self, msg_type, data=None, encoded=None):
+        with self._lock:
+            if self.closed:
+                raise OSError("Session closed")
+            if msg_type not in Protocol.UNSEQUENCED_TYPES:
+                self.send_seq += 1
+                self.replay.append((self.send_seq, msg_type, data, encoded))
+            elif not self.attached:
+                return  # Media cũ không phát lại
+            self._deliver(msg_type, data, encoded)
+
+    def _deliver(self, msg_type, data, encoded):
+        connection = self.connection
+        if connection is None:
+            return
+        try:
+            if encoded is not None:
+                connection.send_encoded(encoded)
+            else:
+                connection.send_message(msg_type, data)
+        except OSError:
+            # Socket hỏng: frame đã nằm trong replay buffer, luồng nhận sẽ detach
+            pass
+
+    def send_message(self, msg_type, data):
+        self._send(msg_type, data=data)
+
+    def send_encoded(self, encoded):
+        self._send(encoded.msg_type, encoded=encoded)
+
+    def close(self):
+        """Đóng hẳn phiên (bị kick / hết hạn)"""
+        with self._lock:
+            self.closed = True
+            self.replay.clear()
+            if self.connection is not None:
+                try: self.connection.close()
+                except: pass
+
+    def __getattr__(self, name):
+        # getpeername, fileno... -> Connection đang gắn
+        connection = self.__dict__.get("connection")
+        if connection is None:
+            raise AttributeError(name)
+        return getattr(connection, name)
+
+
+class SessionStore:
+    """Các phiên resume được, tra theo session_id"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, username, connection):
+        session = ResumableSession(username, connection)
+        with self._lock:
+            self._sessions[session.session_id] = session
+        return session
+
+    def resume(self, username, resume_info):
+        """
+        Tìm phiên để resume từ trường "resume" trong LOGIN: {"session_id", "last_seq"}.
+        Returns: (session, last_seq) hoặc (None, None) nếu không resume được.
+        """
+        if not isinstance(resume_info, dict):
+            return None, None
+        session_id = resume_info.get("session_id")
+        last_seq = resume_info.get("last_seq", 0)
+        # Dữ liệu từ client: sai kiểu (list, dict, số âm...) -> đăng nhập mới, không để LOGIN handler lỗi
+        if (not isinstance(session_id, str) or isinstance(last_seq, bool)
+                or not isinstance(last_seq, int) or last_seq < 0):
+            return None, None
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if (session is None or session.username != username
+                or session.expired() or not session.can_resume(last_seq)):
+            return None, None
+        return session, last_seq
+
+    def discard(self, session):
+        with self._lock:
+            self._sessions.pop(session.session_id, None)
@@ -0,0 +1,475 @@
+"""
+server/tcp_server_async.py - TCP Server (Desktop client) chạy trên chính event loop của FastAPI
+
+Thay cho TCPServer (1 thread / client): mỗi kết nối chỉ là 1 BufferedProtocol + 1 task,
+nhận thẳng vào buffer của FrameDecoder, gọi Bridge trực tiếp (không run_coroutine_threadsafe),
+và mọi lần ghi socket đều diễn ra trên cùng 1 thread với WebSocket.
+"""
+
+import asyncio
+import os
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from common.protocol import Protocol, MessageType
+from common.connection import SessionState
+from common.framing import FrameDecoder
+from common.outbound import MediaLanes
+from common.config import (
+    DEFAULT_HOST, DEFAULT_PORT, SERVER_STORAGE_DIR, CHUNK_SIZE,
+    RESUME_GRACE_PERIOD, USE_UVLOOP, RECV_HIGH_WATER,
+    COALESCE_MAX_BYTES, OUTBOUND_CONTROL_LIMIT, OUTBOUND_BLOCK_TIMEOUT,
+)
+from server.bridge import global_bridge
+from server.handlers.file_handler import FileHandler
+from server.sessions import SessionStore
+from server.heartbeat import HeartbeatMonitor
+from server.router import ClientContext, standard_router
+
+
+def preferred_loop():
+    """Tên event loop cho uvicorn: uvloop nếu được bật và đã cài, không thì asyncio"""
+    return "uvloop" if USE_UVLOOP and uvloop is not None else "asyncio"
+
+
+class AsyncConnection(SessionState, asyncio.BufferedProtocol):
+    """
+    Kết nối TCP trên event loop, cùng giao diện với common.connection.Connection
+    (send_message, send_encoded, close...) để Bridge / ResumableSession dùng chung.
+    Nhận: asyncio ghi thẳng vào buffer của FrameDecoder (get_buffer/buffer_updated), task xử lý
+    đọc frame bằng `await recv_message()`.
+    Gửi: gom các frame trong cùng 1 vòng lặp event loop rồi ghi 1 lần (writelines).
+    Client nhận chậm (transport báo pause_writing): frame nằm lại hàng đợi của kết nối,
+    video chỉ giữ frame mới nhất / audio vài chunk (MediaLanes), chat/presence vượt OUTBOUND_CONTROL_LIMIT
+    quá OUTBOUND_BLOCK_TIMEOUT giây thì ngắt kết nối (không được chặn event loop để chờ).
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self._init_session(FrameDecoder())
+        # VIDEO_DATA/AUDIO_DATA binary: chuyển tiếp nguyên frame (RelayFrame), không decode payload
+        self.decoder.cut_through = True
+
+        self.closed = False
+        self._reading_paused = False
+        self._data_waiter = None
+        self._out = []              # Chat/presence chờ ghi
+        self._out_bytes = 0
+        self._media = MediaLanes()  # Video/audio chờ ghi (video: frame mới thay frame cũ)
+        self._flush_scheduled = False
+        self._writing_paused = False
+        self._overflow_timer = None
+        self._task = None
+
+        # Thống kê (outbound_stats)
+        self.blocked = 0
+        self.overflowed = False
+
+    # --- asyncio.BufferedProtocol ---
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # Buffer của transport chỉ cần đủ 1 lô; phần còn lại nằm ở hàng đợi có giới hạn của kết nối
+        transport.set_write_buffer_limits(high=4 * COALESCE_MAX_BYTES)
+        self._task = asyncio.get_running_loop().create_task(self.server.handle_client(self))
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        # Task xử lý chậm hơn tốc độ nhận -> ngừng đọc cho tới khi buffer vơi bớt
+        if self.decoder.pending > RECV_HIGH_WATER and not self._reading_paused:
+            self._reading_paused = True
+            self.transport.pause_reading()
+        self._wake()
+
+    def eof_received(self):
+        self._wake()
+        return False  # Đóng transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._out.clear()
+        self._media.clear()
+        self._cancel_overflow_timer()
+        self._wake()
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self._flush()
+
+    def _wake(self):
+        waiter = self._data_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def _wait_for_data(self):
+        if self._reading_paused:
+            self._reading_paused = False
+            self.transport.resume_reading()
+        self._data_waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._data_waiter
+        finally:
+            self._data_waiter = None
+
+    # --- NHẬN ---
+
+    async def recv_message(self):
+        """
+        Frame (msg_type, data) kế tiếp, hoặc (None, None) nếu client ngắt kết nối.
+        Frame được decode ngay (trước await tiếp theo) nên không giữ memoryview vào buffer.
+        """
+        while True:
+            raw = self.decoder.next_raw_frame()
+            if raw is not None:
+                msg_type, data = self._decode(*raw)
+                if msg_type is None:
+                    # Context giải nén hỏng: không đọc tiếp được frame nào
+                    self.close()
+                return msg_type, data
+            if self.closed or self.transport.is_closing():
+                return None, None
+            await self._wait_for_data()
+
+    async def recv_raw(self, n):
+        """Tối đa n byte thô (upload file kiểu cũ gửi raw bytes ngay sau FILE_UPLOAD), b"" nếu đã đóng"""
+        while True:
+            if self.decoder.pending:
+                return self.decoder.take(n)
+            if self.closed or self.transport.is_closing():
+                return b""
+            await self._wait_for_data()
+
+    # --- PHIÊN ---
+
+    def start_writer(self):
+        """Tương thích Connection: ghi trên event loop vốn đã gộp frame"""
+
+    # --- GỬI ---
+
+    def send_message(self, msg_type, data):
+        """Encode theo phiên rồi gửi (dùng qua Protocol.send_message)"""
+        frame = self.encoder.encode(msg_type, data)
+        if msg_type in Protocol.MEDIA_TYPES:
+            self._write(frame, msg_type, data.get("sender"))
+        else:
+            self._write(frame)
+
+    def send_encoded(self, encoded):
+        """Gửi EncodedMessage: dùng lại frame đã encode cho wire format của phiên này"""
+        if encoded.msg_type in Protocol.MEDIA_TYPES:
+            self._write(encoded.frame_for(self.encoder), encoded.msg_type, encoded.sender)
+        else:
+            self._write(encoded.frame_for(self.encoder))
+
+    def _write(self, frame, media=None, sender=None):
+        if self.closed:
+            raise OSError("Connection closed")
+        if media:
+            # Video/audio cũ không còn giá trị: video thay frame chưa gửi, audio bỏ chunk cũ nhất
+            self._media.put(frame, media, sender)
+        else:
+            self._out.append(frame)
+            self._out_bytes += len(frame)
+            if self._out_bytes >= OUTBOUND_CONTROL_LIMIT and self._overflow_timer is None:
+                # Không chờ được trên event loop: cho client thời gian đọc bớt, quá hạn thì ngắt
+                self.blocked += 1
+                self._overflow_timer = asyncio.get_running_loop().call_later(
+                    OUTBOUND_BLOCK_TIMEOUT, self._check_overflow
+                )
+        if not self._flush_scheduled:
+            # Flush 1 lần ở cuối vòng lặp hiện tại: các frame gửi liên tiếp được ghi chung
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if self.closed or self._writing_paused:
+            return
+        if self._out:
+            self.transport.writelines(self._out)
+            self._out = []
+            self._out_bytes = 0
+            self._cancel_overflow_timer()
+        if self._media:
+            self.transport.writelines(self._media.take())
+
+    def _check_overflow(self):
+        self._overflow_timer = None
+        if self._out_bytes >= OUTBOUND_CONTROL_LIMIT and not self.closed:
+            self.overflowed = True
+            print(f"🐢 Client nhận quá chậm, ngắt kết nối: {self.getpeername()}")
+            self.closed = True
+            self._out.clear()
+            self._media.clear()
+            self.transport.abort()
+
+    def _cancel_overflow_timer(self):
+        if self._overflow_timer is not None:
+            self._overflow_timer.cancel()
+            self._overflow_timer = None
+
+    def take_media_dropped(self, sender):
+        """(video, audio) của `sender` bị bỏ vì client nhận chậm, kể từ lần hỏi trước"""
+        return self._media.take_dropped(sender)
+
+    def outbound_stats(self):
+        """Độ sâu hàng đợi gửi + số frame bị bỏ (cùng dạng với OutboundQueue.stats)"""
+        buffered = self.transport.get_write_buffer_size() if self.transport else 0
+        return {
+            "frames": len(self._out) + len(self._media),
+            "bytes": self._out_bytes + self._media.nbytes + buffered,
+            "media_dropped": self._media.dropped,
+            "blocked": self.blocked,
+            "overflowed": self.overflowed,
+        }
+
+    def close(self):
+        if self.closed:
+            return
+        self._flush()
+        self.closed = True
+        self._cancel_overflow_timer()
+        if self.transport is not None:
+            self.transport.close()
+
+    def abort(self):
+        """Đóng ngay, bỏ dữ liệu chưa gửi (peer đã chết: close() sẽ chờ ghi mãi)"""
+        self.closed = True
+        self._cancel_overflow_timer()
+        if self.transport is not None:
+            self.transport.abort()
+
+    def getpeername(self):
+        return self.transport.get_extra_info("peername")
+
+
+class AsyncTCPServer:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, reuse_port=False, sock=None):
+        self.host = host
+        self.port = port
+        # Cluster: mọi worker cùng nghe port này (SO_REUSEPORT)
+        self.reuse_port = reuse_port
+        # Socket lắng nghe có sẵn (nhận từ process cũ khi restart, xem server/drain.py)
+        self.sock = sock
+        self.server = None
+        # Gán khi start(): FileHandler dùng để biết đang chạy trên event loop chính
+        self.main_loop = None
+
+        self.storage_dir = SERVER_STORAGE_DIR
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self.file_handler = FileHandler(self)
+        # Upload kiểu cũ (raw bytes) đang nhận: {AsyncConnection}, drain chờ các upload này xong
+        self.raw_uploads = set()
+
+        # Phiên resume được của Desktop client (feature "resume")
+        self.sessions = SessionStore()
+        
+        # PING/PONG + ngắt kết nối chết (tick trên event loop)
+        self.heartbeat = HeartbeatMonitor()
+
+        # Bảng định tuyến: loại không có trong bảng (chat, gọi điện...) chuyển qua Bridge
+        self.router = standard_router(fallback=self._on_forward)
+        self.router.add(MessageType.LOGIN, self._on_login)
+        self.router.add(MessageType.FILE_UPLOAD, self._on_file_upload)
+        self.router.add(MessageType.FILE_CHUNK, self._on_file_chunk)
+        self.router.add(MessageType.FILE_ERROR, self._on_file_error)
+        self.router.add(MessageType.FILE_DOWNLOAD, self._on_file_download)
+        self.router.add(MessageType.LIST_USERS, self._on_list_users)
+        self.router.add((MessageType.ACK, MessageType.PONG), self._on_ignore)
+        self.router.add(MessageType.PING, self._on_ping)
+        self.router.add(Protocol.ROOM_COMMANDS, self._on_room)
+        self.router.add((MessageType.VIDEO_DATA, MessageType.AUDIO_DATA), self._on_media)
+
+    async def start(self):
+        self.main_loop = asyncio.get_running_loop()
+        global_bridge.presence.loop = self.main_loop
+        self.heartbeat.start(self.main_loop)
+        if self.sock is not None:
+            self.server = await self.main_loop.create_server(lambda: AsyncConnection(self), sock=self.sock)
+        else:
+            self.server = await self.main_loop.create_server(
+                lambda: AsyncConnection(self), self.host, self.port,
+                reuse_address=True, reuse_port=self.reuse_port
+            )
+        print(f"🚀 TCP Server (asyncio) đang chạy tại port {self.port}")
+
+    @property
+    def listen_sockets(self):
+        """Socket lắng nghe đang dùng (để chuyển cho process mới)"""
+        return list(self.server.sockets) if self.server is not None else []
+
+    def stop_accepting(self):
+        """Ngừng nhận kết nối mới, giữ nguyên các kết nối đang mở (drain)"""
+        if self.server is not None:
+            self.server.close()
+
+    async def stop(self):
+        self.heartbeat.stop()
+        self.stop_accepting()
+        # Đóng client trước: wait_closed (Python 3.12+) chờ mọi kết nối đóng hết
+        for sock in global_bridge.tcp_clients.values():
+            try: sock.close()
+            except: pass
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    async def handle_client(self, conn):
+        # ctx.target: thứ được lưu trong tcp_clients - ResumableSession (client hỗ trợ resume) hoặc chính kết nối
+        ctx = ClientContext(conn)
+        try:
+            while True:
+                msg_type, data = await conn.recv_message()
+                if not msg_type:
+                    break
+
+                await self.router.dispatch_async(ctx, msg_type, data)
+
+        except (ConnectionResetError, ConnectionAbortedError):
+            print(f"🔌 Client {ctx.username} ngắt kết nối đột ngột.")
+        except Exception as e:
+            print(f"❌ Error handling TCP client {ctx.username}: {e}")
+        finally:
+            self.heartbeat.untrack(conn)
+            self.file_handler.abort_all_uploads(conn)
+            conn.close()
+
+            username, target = ctx.username, ctx.target
+            if username and global_bridge.tcp_clients.get(username) is target:
+                if target is not conn:
+                    # Phiên resume được: giữ chỗ trong thời gian chờ, hết hạn mới báo offline
+                    target.detach(conn)
+                    self.main_loop.call_later(RESUME_GRACE_PERIOD + 1, self._expire_session, username, target)
+                else:
+                    global_bridge.remove_tcp(username, target)
+
+    # --- HANDLER THEO LOẠI MESSAGE: handler(ctx, msg_type, data) ---
+
+    def _on_login(self, ctx, msg_type, data):
+        username = ctx.username = data.get("username")
+        conn = ctx.conn
+
+        # LOGIN_SUCCESS luôn gửi bằng JSON, sau đó mới gắn codec cho phiên
+        session = Protocol.negotiate_session(data)
+        resumable, last_seq = None, None
+        if "resume" in session["features"]:
+            resumable, last_seq = self.sessions.resume(username, data.get("resume"))
+            if resumable is None:
+                resumable = self.sessions.create(username, None)
+            session["session_id"] = resumable.session_id
+            session["resumed"] = last_seq is not None
+
+        Protocol.send_message(conn, MessageType.LOGIN_SUCCESS, {"message": "OK", **session})
+        conn.bind_session(session)
+        # Peer chết (half-open) không bao giờ đọc hết buffer -> abort thay vì close
+        self.heartbeat.track(conn, conn.abort)
+
+        if resumable is not None:
+            ctx.target = resumable
+            resumable.attach(conn, last_seq)
+            if last_seq is not None and global_bridge.tcp_clients.get(username) is resumable:
+                print(f"🔁 [TCP] {username} resume phiên (từ seq {last_seq})")
+                return
+
+        global_bridge.add_tcp(username, ctx.target)
+        # Người mới: danh sách đầy đủ, sau đó chỉ nhận delta USER_ONLINE/USER_OFFLINE
+        Protocol.send_message(ctx.target, MessageType.LIST_USERS, global_bridge.presence.snapshot())
+
+    async def _on_file_upload(self, ctx, msg_type, data):
+        if data.get("channel"):
+            # Khoá upload theo kết nối, trả lời qua phiên (ctx.target) để giữ seq
+            self.file_handler.begin_channel_upload(ctx.conn, ctx.username, data, ctx.target)
+        else:
+            await self._receive_raw_upload(ctx.conn, ctx.username, data, ctx.target)
+
+    def _on_file_chunk(self, ctx, msg_type, data):
+        self.file_handler.handle_file_chunk(ctx.conn, ctx.username, data)
+
+    async def _on_file_error(self, ctx, msg_type, data):
+        if data.get("channel"):
+            self.file_handler.abort_upload(ctx.conn, data.get("channel"))
+        else:
+            await self._on_forward(ctx, msg_type, data)
+
+    def _on_file_download(self, ctx, msg_type, data):
+        self.file_handler.handle_file_download(ctx.target, data)
+
+    def _on_list_users(self, ctx, msg_type, data):
+        # Client lỡ version presence -> gửi lại danh sách đầy đủ (qua phiên để giữ seq)
+        Protocol.send_message(ctx.target, MessageType.LIST_USERS, global_bridge.presence.snapshot())
+
+    def _on_ping(self, ctx, msg_type, data):
+        # PONG không đánh seq (UNSEQUENCED_TYPES): trả thẳng trên kết nối
+        Protocol.send_message(ctx.conn, MessageType.PONG, data)
+
+    def _on_ignore(self, ctx, msg_type, data):
+        """ACK đã được chuyển cho phiên (on_peer_ack), RTT từ PONG đã tính lúc decode"""
+
+    async def _on_room(self, ctx, msg_type, data):
+        # Vào/ra room: thành viên lưu kèm kết nối (qua phiên để giữ seq)
+        await global_bridge.handle_room(msg_type, data, ctx.username, ctx.target)
+
+    async def _on_media(self, ctx, msg_type, data):
+        # VIDEO/AUDIO -> chuyển tiếp raw
+        await global_bridge.relay_media(msg_type, data, sender=ctx.username)
+
+    async def _on_forward(self, ctx, msg_type, data):
+        """Loại còn lại (CHAT, VIDEO CALL...): chuyển qua Bridge"""
+        if isinstance(data, dict):
+            data["sender"] = ctx.username
+            data["type"] = msg_type
+        await global_bridge.handle_message(data, sender=ctx.username)
+
+    async def _receive_raw_upload(self, conn, username, data, reply_to):
+        """Upload kiểu cũ: đúng `filesize` byte raw nối ngay sau FILE_UPLOAD (đọc trên conn, trả lời qua reply_to)"""
+        self.raw_uploads.add(conn)
+        try:
+            await self._stream_raw_upload(conn, username, data, reply_to)
+        finally:
+            self.raw_uploads.discard(conn)
+
+    async def _stream_raw_upload(self, conn, username, data, reply_to):
+        filename = data.get("filename")
+        filesize = data.get("filesize") or 0
+        safe_filename, filepath = self.file_handler.storage_path(filename)
+        print(f"📤 [Server] Bắt đầu nhận file Stream: {filename} ({filesize} bytes) từ {username}")
+        try:
+            received = 0
+            # Mở / ghi / đóng file trên thread khác: đĩa chậm không được chặn event loop
+            f = await asyncio.to_thread(open, filepath, "wb")
+            try:
+                while received < filesize:
+                    chunk = await conn.recv_raw(min(CHUNK_SIZE, filesize - received))
+                    if not chunk:
+                        raise Exception("Client ngắt kết nối đột ngột khi đang gửi file")
+                    await asyncio.to_thread(f.write, chunk)
+                    received += len(chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+        except Exception as e:
+            print(f"❌ Lỗi khi nhận file stream: {e}")
+            try: Protocol.send_message(reply_to, MessageType.ERROR, {"message": f"Upload thất bại: {str(e)}"})
+            except: pass
+            return
+
+        print(f"✅ [Server] Đã nhận xong file: {safe_filename}")
+        self.file_handler._finish_upload(
+            reply_to, username, filename, safe_filename, filesize, data.get("file_type", "file"), data.get("recipient")
+        )
+
+    def _expire_session(self, username, session):
+        """Hết thời gian chờ resume mà client chưa quay lại -> xoá phiên, báo offline"""
+        if session.attached or not session.expired():
+            return
+        self.sessions.discard(session)
+        session.close()
+        global_bridge.remove_tcp(username, session)
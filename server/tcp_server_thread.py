@@ -3,9 +3,13 @@ import socket
 import asyncio
 import os
 from common.protocol import Protocol, MessageType
-from common.config import SERVER_STORAGE_DIR
+from common.connection import Connection
+from common.config import SERVER_STORAGE_DIR, RESUME_GRACE_PERIOD
 from server.bridge import global_bridge
 from server.handlers.file_handler import FileHandler
+from server.sessions import SessionStore
+from server.heartbeat import HeartbeatMonitor
+from server.router import ClientContext, standard_router
 
 class TCPServer(threading.Thread):
     def __init__(self, main_loop): 
@@ -17,6 +21,8 @@ class TCPServer(threading.Thread):
         
         # Lưu event loop của FastAPI để gọi các hàm async
         self.main_loop = main_loop 
+        # Delta presence gửi trên event loop (cùng chỗ với WebSocket)
+        global_bridge.presence.loop = main_loop
         
         # [FIX QUAN TRỌNG] Khai báo đường dẫn lưu file để FileHandler dùng
         self.storage_dir = SERVER_STORAGE_DIR
@@ -24,8 +30,28 @@ class TCPServer(threading.Thread):
         
         # Khởi tạo File Handler
         self.file_handler = FileHandler(self)
+        
+        # Phiên resume được của Desktop client (feature "resume")
+        self.sessions = SessionStore()
+        
+        # PING/PONG + ngắt kết nối chết (tick trên event loop, gửi không chặn)
+        self.heartbeat = HeartbeatMonitor()
+        
+        # Bảng định tuyến: loại không có trong bảng (chat, gọi điện...) chuyển qua Bridge
+        self.router = standard_router(fallback=self._on_forward)
+        self.router.add(MessageType.LOGIN, self._on_login)
+        self.router.add(MessageType.FILE_UPLOAD, self._on_file_upload)
+        self.router.add(MessageType.FILE_CHUNK, self._on_file_chunk)
+        self.router.add(MessageType.FILE_ERROR, self._on_file_error)
+        self.router.add(MessageType.FILE_DOWNLOAD, self._on_file_download)
+        self.router.add(MessageType.LIST_USERS, self._on_list_users)
+        self.router.add((MessageType.ACK, MessageType.PONG), self._on_ignore)
+        self.router.add(MessageType.PING, self._on_ping)
+        self.router.add(Protocol.ROOM_COMMANDS, self._on_room)
+        self.router.add((MessageType.VIDEO_DATA, MessageType.AUDIO_DATA), self._on_media)
 
     def run(self):
+        self.heartbeat.start(self.main_loop)
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
@@ -46,7 +72,12 @@ class TCPServer(threading.Thread):
             print(f"❌ TCP Server Start Error: {e}")
 
     def handle_client(self, client_socket):
-        username = None
+        # Bọc socket để gắn codec/features của phiên sau khi LOGIN.
+        # ctx.target: thứ được lưu trong tcp_clients - ResumableSession (client hỗ trợ resume) hoặc chính Connection
+        ctx = ClientContext(Connection(client_socket))
+        client_socket = ctx.conn
+        # VIDEO_DATA/AUDIO_DATA binary: chuyển tiếp nguyên frame (RelayFrame), không decode payload
+        client_socket.decoder.cut_through = True
         try:
             while True:
                 # Nhận tin nhắn từ Client
@@ -56,71 +87,117 @@ class TCPServer(threading.Thread):
                 if not msg_type: 
                     break 
 
-                # --- 1. XỬ LÝ LOGIN ---
-                if msg_type == MessageType.LOGIN:
-                    username = data.get("username")
-                    
-                    # Thêm vào Bridge
-                    global_bridge.add_tcp(username, client_socket)
-                    
-                    # Phản hồi đăng nhập thành công
-                    Protocol.send_message(client_socket, MessageType.LOGIN_SUCCESS, {"message": "OK"})
-                    
-                    # Gửi danh sách user
-                    self._update_user_lists()
-
-                # --- 2. XỬ LÝ FILE (Upload/Download) ---
-                elif msg_type == MessageType.FILE_UPLOAD:
-                    self.file_handler.handle_file_upload(client_socket, username, data)
-                
-                elif msg_type == MessageType.FILE_DOWNLOAD:
-                    self.file_handler.handle_file_download(client_socket, data)
-
-                # --- 3. XỬ LÝ CHUNG (CHAT, VIDEO CALL...) ---
-                else:
-                    if isinstance(data, dict):
-                        data["sender"] = username
-                        data["type"] = msg_type
-                    
-                    # Chuyển qua Bridge (chạy trên Main Thread)
-                    self._run_on_main_loop(
-                        global_bridge.handle_message(data, sender=username)
-                    )
+                self.router.dispatch(ctx, msg_type, data)
 
         except (ConnectionResetError, ConnectionAbortedError):
-            print(f"🔌 Client {username} ngắt kết nối đột ngột.")
+            print(f"🔌 Client {ctx.username} ngắt kết nối đột ngột.")
         except Exception as e:
-            print(f"❌ Error handling TCP client {username}: {e}")
+            print(f"❌ Error handling TCP client {ctx.username}: {e}")
         finally:
             # Dọn dẹp khi ngắt kết nối
-            if username:
-                # Kiểm tra socket chính chủ trước khi xóa
-                if global_bridge.tcp_clients.get(username) == client_socket:
-                    global_bridge.remove_tcp(username)
-                    self._update_user_lists()
-            
+            self.heartbeat.untrack(client_socket)
+            self.file_handler.abort_all_uploads(client_socket)
             try: client_socket.close()
             except: pass
+            
+            username, target = ctx.username, ctx.target
+            if username and global_bridge.tcp_clients.get(username) is target:
+                if target is not client_socket:
+                    # Phiên resume được: giữ chỗ trong thời gian chờ, hết hạn mới báo offline
+                    target.detach(client_socket)
+                    timer = threading.Timer(RESUME_GRACE_PERIOD + 1, self._expire_session, args=(username, target))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    global_bridge.remove_tcp(username, target)
+
+    # --- HANDLER THEO LOẠI MESSAGE: handler(ctx, msg_type, data), chạy trên thread của client ---
+
+    def _on_login(self, ctx, msg_type, data):
+        username = ctx.username = data.get("username")
+        client_socket = ctx.conn
+        
+        # Thương lượng version/codec; LOGIN_SUCCESS luôn gửi bằng JSON,
+        # sau đó mới gắn codec cho phiên
+        session = Protocol.negotiate_session(data)
+        resumable, last_seq = None, None
+        if "resume" in session["features"]:
+            resumable, last_seq = self.sessions.resume(username, data.get("resume"))
+            if resumable is None:
+                resumable = self.sessions.create(username, None)
+            session["session_id"] = resumable.session_id
+            session["resumed"] = last_seq is not None
+        
+        Protocol.send_message(client_socket, MessageType.LOGIN_SUCCESS, {"message": "OK", **session})
+        client_socket.bind_session(session)
+        # Từ đây các frame gửi cho client được gộp lại trước khi ghi
+        client_socket.start_writer()
+        self.heartbeat.track(client_socket)
+        
+        if resumable is not None:
+            ctx.target = resumable
+            # Resume: phát lại frame bị lỡ, không đăng nhập lại / không gửi lại user list
+            resumable.attach(client_socket, last_seq)
+            if last_seq is not None and global_bridge.tcp_clients.get(username) is resumable:
+                print(f"🔁 [TCP] {username} resume phiên (từ seq {last_seq})")
+                return
+        
+        # Thêm vào Bridge (mọi người khác nhận delta USER_ONLINE)
+        global_bridge.add_tcp(username, ctx.target)
+        
+        # Người mới: danh sách user đầy đủ
+        Protocol.send_message(ctx.target, MessageType.LIST_USERS, global_bridge.presence.snapshot())
+
+    def _on_file_upload(self, ctx, msg_type, data):
+        # Đọc raw / khoá upload theo kết nối, trả lời qua phiên (ctx.target) để giữ seq
+        self.file_handler.handle_file_upload(ctx.conn, ctx.username, data, ctx.target)
+
+    def _on_file_chunk(self, ctx, msg_type, data):
+        self.file_handler.handle_file_chunk(ctx.conn, ctx.username, data)
+
+    def _on_file_error(self, ctx, msg_type, data):
+        if data.get("channel"):
+            # Client huỷ upload đang chạy trên channel
+            self.file_handler.abort_upload(ctx.conn, data.get("channel"))
+        else:
+            self._on_forward(ctx, msg_type, data)
+
+    def _on_file_download(self, ctx, msg_type, data):
+        self.file_handler.handle_file_download(ctx.target, data)
+
+    def _on_list_users(self, ctx, msg_type, data):
+        # Client lỡ version presence -> gửi lại danh sách đầy đủ (qua phiên để giữ seq)
+        Protocol.send_message(ctx.target, MessageType.LIST_USERS, global_bridge.presence.snapshot())
+
+    def _on_ping(self, ctx, msg_type, data):
+        # PONG không đánh seq (UNSEQUENCED_TYPES): trả thẳng trên kết nối
+        Protocol.send_message(ctx.conn, MessageType.PONG, data)
+
+    def _on_ignore(self, ctx, msg_type, data):
+        """ACK đã được Connection chuyển cho phiên (on_peer_ack), RTT từ PONG đã tính lúc decode"""
+
+    def _on_room(self, ctx, msg_type, data):
+        # Vào/ra room: thành viên lưu kèm kết nối (qua phiên để giữ seq)
+        self._run_on_main_loop(global_bridge.handle_room(msg_type, data, ctx.username, ctx.target))
+
+    def _on_media(self, ctx, msg_type, data):
+        # Chuyển tiếp raw, không qua handle_message
+        self._run_on_main_loop(global_bridge.relay_media(msg_type, data, sender=ctx.username))
+
+    def _on_forward(self, ctx, msg_type, data):
+        """Loại còn lại (CHAT, VIDEO CALL...): chuyển qua Bridge (chạy trên Main Thread)"""
+        if isinstance(data, dict):
+            data["sender"] = ctx.username
+            data["type"] = msg_type
+        self._run_on_main_loop(global_bridge.handle_message(data, sender=ctx.username))
 
-    def _update_user_lists(self):
-        """Cập nhật danh sách online cho tất cả mọi người"""
-        # Lấy tất cả user từ cả TCP (Desktop) và Web
-        all_users = list(global_bridge.tcp_clients.keys()) + list(global_bridge.web_clients.keys())
-
-        # [FIX] Lọc bỏ các user ảo dùng để upload (có chứa "_upload_")
-        # Điều này giúp Desktop Client không bị hiện các tên rác như "User_upload_123"
-        users = [u for u in all_users if "_upload_" not in u]
-
-        # 1. Gửi cho Web Clients (thông qua Bridge)
-        self._run_on_main_loop(global_bridge.broadcast({"type": "SYSTEM", "users": users}))
-
-        # 2. Gửi cho TCP Clients (Desktop App)
-        msg_data = {"users": users}
-        for sock in global_bridge.tcp_clients.values():
-            try:
-                Protocol.send_message(sock, MessageType.LIST_USERS, msg_data)
-            except: 
-                pass
+    def _expire_session(self, username, session):
+        """Hết thời gian chờ resume mà client chưa quay lại -> xoá phiên, báo offline"""
+        if session.attached or not session.expired():
+            return
+        self.sessions.discard(session)
+        session.close()
+        global_bridge.remove_tcp(username, session)
 
     def _run_on_main_loop(self, coro):
         """Helper để chạy Coroutine trên Main Thread"""
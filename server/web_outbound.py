@@ -0,0 +1,185 @@
+"""
+server/web_outbound.py - Hàng đợi gửi có giới hạn cho WebSocket của user chat Web
+
+Broadcast / chat riêng chỉ xếp message vào hàng đợi của từng người nhận rồi đi tiếp,
+1 task riêng cho mỗi WebSocket ghi ra mạng -> 1 trình duyệt chậm không làm chậm người khác.
+"""
+
+import asyncio
+import json
+from collections import deque
+
+from common.config import (
+    OUTBOUND_CONTROL_LIMIT, OUTBOUND_AUDIO_FRAMES, OUTBOUND_BLOCK_TIMEOUT, WEB_SEND_TIMEOUT, WEB_SEND_MAX_TIMEOUTS
+)
+from common.outbound import MediaLanes
+from common.protocol import Protocol
+
+
+class WebOutbound:
+    """
+    Đứng thay cho WebSocket trong BridgeManager.web_clients: send_json/send_text chỉ xếp hàng.
+    Chính sách khi trình duyệt nhận chậm (giống OutboundQueue của Desktop):
+    - media (VIDEO_DATA/AUDIO_DATA): video chỉ giữ frame mới nhất, audio tối đa audio_limit chunk
+    - chat/presence: vượt control_limit byte quá block_timeout giây thì ngắt kết nối
+    - mỗi lần ghi có hạn send_timeout giây: quá hạn = 1 lần timeout, max_timeouts lần liên tiếp
+      (trình duyệt treo, không đọc) thì ngắt kết nối; ghi xong đúng hạn thì tính lại từ đầu
+    Các thuộc tính khác (receive, send_bytes, accept...) chuyển thẳng xuống WebSocket gốc.
+    """
+
+    def __init__(self, websocket, control_limit=OUTBOUND_CONTROL_LIMIT,
+                 audio_limit=OUTBOUND_AUDIO_FRAMES, block_timeout=OUTBOUND_BLOCK_TIMEOUT,
+                 send_timeout=WEB_SEND_TIMEOUT, max_timeouts=WEB_SEND_MAX_TIMEOUTS):
+        self.websocket = websocket
+        self.control_limit = control_limit
+        self.block_timeout = block_timeout
+        self.send_timeout = send_timeout
+        self.max_timeouts = max_timeouts
+
+        self._control = deque()
+        self._control_bytes = 0
+        self._media = MediaLanes(audio_limit)
+        self._wakeup = asyncio.Event()
+        self._overflow_timer = None
+        self.closed = False
+
+        # Thống kê (stats())
+        self.blocked = 0
+        self.overflowed = False
+        self.timeouts = 0           # Tổng số lần ghi quá hạn
+        self.strikes = 0            # Số lần quá hạn liên tiếp (sức khoẻ kết nối)
+
+        self._task = asyncio.get_running_loop().create_task(self._writer())
+
+    # --- GỬI (chỉ xếp hàng, không chờ mạng) ---
+
+    async def send_json(self, data):
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        if isinstance(data, dict) and data.get("type") in Protocol.MEDIA_TYPES:
+            self._put(text, data["type"], data.get("sender"))
+        else:
+            self._put(text)
+
+    async def send_text(self, text):
+        self._put(text)
+
+    def put_text(self, text):
+        """Như send_text nhưng gọi được từ code đồng bộ (chạy trên event loop)"""
+        self._put(text)
+
+    # Protocol.send_message / send_encoded gửi được cho Web như kết nối Desktop (chạy trên event loop)
+
+    def send_message(self, msg_type, data):
+        text = json.dumps({"type": msg_type, **data}, ensure_ascii=False, separators=(",", ":"))
+        if msg_type in Protocol.MEDIA_TYPES:
+            self._put(text, msg_type, data.get("sender"))
+        else:
+            self._put(text)
+
+    def send_encoded(self, encoded):
+        if encoded.msg_type in Protocol.MEDIA_TYPES:
+            self._put(encoded.text, encoded.msg_type, encoded.sender)
+        else:
+            self._put(encoded.text)
+
+    def _put(self, text, media=None, sender=None):
+        if self.closed:
+            raise ConnectionError("WebSocket closed")
+        if media:
+            # Video/audio cũ không còn giá trị: video thay frame chưa gửi, audio bỏ chunk cũ nhất
+            self._media.put(text, media, sender)
+        else:
+            self._control.append(text)
+            self._control_bytes += len(text)
+            if self._control_bytes >= self.control_limit and self._overflow_timer is None:
+                # Không chờ được trên event loop: cho trình duyệt thời gian đọc bớt, quá hạn thì ngắt
+                self.blocked += 1
+                self._overflow_timer = asyncio.get_running_loop().call_later(
+                    self.block_timeout, self._check_overflow
+                )
+        self._wakeup.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._control or self._media:
+                    # Chat/presence đi trước media
+                    if self._control:
+                        text = self._control.popleft()
+                        self._control_bytes -= len(text)
+                        if self._control_bytes < self.control_limit:
+                            self._cancel_overflow_timer()
+                    else:
+                        text = self._media.pop()
+                    await self._send(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Socket hỏng: listen_to_web_user sẽ thấy disconnect và dọn dẹp
+            self._discard()
+
+    async def _send(self, text):
+        """Ghi 1 message có hạn: không huỷ giữa chừng (hỏng frame), chỉ đếm timeout trong lúc chờ"""
+        send = asyncio.ensure_future(self.websocket.send_text(text))
+        while True:
+            done, _ = await asyncio.wait((send,), timeout=self.send_timeout)
+            if done:
+                send.result()
+                self.strikes = 0
+                return
+            self.timeouts += 1
+            self.strikes += 1
+            if self.strikes >= self.max_timeouts:
+                print(f"🐢 [Bridge] Trình duyệt không nhận sau {self.strikes} lần quá hạn, ngắt kết nối")
+                send.cancel()
+                asyncio.get_running_loop().create_task(self.close())
+                raise ConnectionError("WebSocket send timed out")
+
+    def _check_overflow(self):
+        self._overflow_timer = None
+        if self._control_bytes >= self.control_limit and not self.closed:
+            self.overflowed = True
+            print("🐢 [Bridge] Trình duyệt nhận quá chậm, ngắt kết nối")
+            asyncio.get_running_loop().create_task(self.close())
+
+    def _cancel_overflow_timer(self):
+        if self._overflow_timer is not None:
+            self._overflow_timer.cancel()
+            self._overflow_timer = None
+
+    def _discard(self):
+        self.closed = True
+        self._control.clear()
+        self._control_bytes = 0
+        self._media.clear()
+        self._cancel_overflow_timer()
+
+    def stop(self):
+        """User đã rời đi: dừng task ghi, bỏ các message còn chờ"""
+        self._discard()
+        self._task.cancel()
+
+    async def close(self, *args, **kwargs):
+        self.stop()
+        await self.websocket.close(*args, **kwargs)
+
+    def take_media_dropped(self, sender):
+        """(video, audio) của `sender` bị bỏ vì trình duyệt nhận chậm, kể từ lần hỏi trước"""
+        return self._media.take_dropped(sender)
+
+    def stats(self):
+        """Độ sâu hàng đợi + số frame bị bỏ (cùng dạng với OutboundQueue.stats)"""
+        return {
+            "frames": len(self._control) + len(self._media),
+            "bytes": self._control_bytes + self._media.nbytes,
+            "media_dropped": self._media.dropped,
+            "blocked": self.blocked,
+            "overflowed": self.overflowed,
+            "timeouts": self.timeouts,
+        }
+
+    def __getattr__(self, name):
+        # receive, send_bytes, accept... -> WebSocket gốc
+        return getattr(self.websocket, name)
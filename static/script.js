@@ -6,6 +6,9 @@ let ws;
 let username = "";
 let currentChat = null; // null = Chat nhóm
 let messages = [];      // Lưu trữ lịch sử tin nhắn
+let onlineUsers = [];   // Danh sách online hiện tại
+let presenceVersion = null; // Version của onlineUsers (null = chờ danh sách đầy đủ)
+let reconnectAfter = null;  // Server đang restart (SERVER_DRAIN): giây chờ trước khi kết nối lại
 
 // --- CẤU HÌNH ---
 const UPLOAD_SPEED_LIMIT = 100 * 1024; // 100KB/s (Để demo)
@@ -43,12 +46,27 @@ function joinChat() {
     ws.onmessage = (event) => {
         try { handleServerMessage(JSON.parse(event.data)); } catch (e) { console.error(e); }
     };
-    ws.onclose = () => { alert("Mất kết nối server!"); location.reload(); };
+    ws.onclose = () => {
+        // Server restart: tự kết nối lại đúng lượt được chia, không dồn cùng lúc
+        if (reconnectAfter !== null) {
+            const delay = reconnectAfter * 1000;
+            reconnectAfter = null;
+            setTimeout(joinChat, delay);
+            return;
+        }
+        alert("Mất kết nối server!"); location.reload();
+    };
 }
 
 // --- 2. XỬ LÝ TIN NHẮN (GIỮ NGUYÊN) ---
 function handleServerMessage(data) {
-    if (data.type === "SYSTEM" || data.type === "LIST_USERS") updateUserList(data.users || []);
+    if (data.type === "SYSTEM" || data.type === "LIST_USERS") {
+        onlineUsers = data.users || [];
+        presenceVersion = data.version ?? null;
+        updateUserList(onlineUsers);
+    }
+    else if (data.type === "USER_ONLINE" || data.type === "USER_OFFLINE") applyPresenceDelta(data);
+    else if (data.type === "SERVER_DRAIN") reconnectAfter = data.reconnect_after || 0;
     else if (data.type === "TEXT" || data.type === "FILE_INFO") {
         messages.push(data);
         if (isCurrentChat(data)) renderMessage(data);
@@ -68,6 +86,21 @@ function handleServerMessage(data) {
     }
 }
 
+// Delta online/offline có version: lỡ delta nào thì xin lại danh sách đầy đủ
+function applyPresenceDelta(data) {
+    if (presenceVersion === null || data.version <= presenceVersion) return;
+    if (data.version !== presenceVersion + 1) {
+        presenceVersion = null;
+        ws.send(JSON.stringify({ type: "LIST_USERS" }));
+        return;
+    }
+    const users = data.users || [];
+    if (data.type === "USER_ONLINE") onlineUsers = onlineUsers.concat(users.filter(u => !onlineUsers.includes(u)));
+    else onlineUsers = onlineUsers.filter(u => !users.includes(u));
+    presenceVersion = data.version;
+    updateUserList(onlineUsers);
+}
+
 // --- 3. RENDER DANH SÁCH USER (GIỮ NGUYÊN) ---
 function updateUserList(users) {
     const list = document.getElementById("user-list");
@@ -0,0 +1,31 @@
+"""
+tests/conftest.py - Fixture dùng chung: chạy từ thư mục gốc repo (python -m pytest -q).
+Hàm tiện ích (login, recv_until, wait_for) nằm ở tests/helpers.py
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from tests.helpers import wait_for
+
+
+@pytest.fixture
+def chat_server(tmp_path, monkeypatch):
+    """ChatServer (thread mode) trên cổng ngẫu nhiên, file lưu trong tmp_path. Returns: (server, port)"""
+    from server.server_core import ChatServer
+    monkeypatch.chdir(tmp_path)
+    server = ChatServer(host="127.0.0.1", port=0)
+    threading.Thread(target=server.start, daemon=True).start()
+    assert wait_for(lambda: server.running)
+    yield server, server.server_socket.getsockname()[1]
+    server.running = False
+    server.heartbeat.stop()
+    try: server.server_socket.close()
+    except OSError: pass
@@ -0,0 +1,45 @@
+"""
+tests/helpers.py - Hàm dùng chung cho các test: from tests.helpers import login, recv_until, wait_for
+"""
+
+import socket
+import time
+
+from common.connection import Connection
+from common.protocol import Protocol, MessageType
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def login(port, username, features=None, resume=None):
+    """Kết nối + LOGIN như client Desktop. Returns: (Connection, data của LOGIN_SUCCESS)"""
+    conn = Connection(socket.create_connection(("127.0.0.1", port)))
+    conn.settimeout(3)
+    offer = Protocol.handshake_offer()
+    if features is not None:
+        offer["features"] = features
+    data = {"username": username, **offer}
+    if resume is not None:
+        data["resume"] = resume
+    Protocol.send_message(conn, MessageType.LOGIN, data)
+    msg_type, reply = Protocol.recv_message(conn)
+    assert msg_type == MessageType.LOGIN_SUCCESS, reply
+    conn.bind_session(reply)
+    return conn, reply
+
+
+def recv_until(conn, msg_type, limit=50):
+    """Đọc tới khi gặp msg_type (bỏ qua presence...). Returns: data"""
+    for _ in range(limit):
+        got, data = Protocol.recv_message(conn)
+        if got == msg_type:
+            return data
+        assert got is not None, f"mất kết nối khi chờ {msg_type}"
+    raise AssertionError(f"không nhận được {msg_type}")
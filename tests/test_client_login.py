@@ -0,0 +1,50 @@
+"""ChatClient.login: LOGIN round-trip thật với ChatServer, gắn phiên bằng SessionHandler"""
+
+import pytest
+
+import client.client_core as client_core
+from common.protocol import MessageType
+from tests.helpers import login, recv_until, wait_for
+
+
+class FakeRoot:
+    """Thay Tk(): chạy callback after() ngay, không mở cửa sổ"""
+
+    def __init__(self):
+        self.called = []
+
+    def after(self, delay, callback=None, *args):
+        if callback is not None:
+            self.called.append(callback)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+@pytest.fixture
+def chat_client(monkeypatch):
+    monkeypatch.setattr(client_core, "Tk", FakeRoot)
+    monkeypatch.setattr(client_core, "LoginUI", lambda client: None)
+    client = client_core.ChatClient()
+    yield client
+    client.connected = False
+    if client.socket is not None:
+        client.socket.close()
+
+
+def test_login_binds_session(chat_server, chat_client):
+    server, port = chat_server
+    ok, message = chat_client.login("alice", f"127.0.0.1:{port}")
+    assert ok, message
+    assert chat_client.session_handler is not None
+    assert chat_client.socket.supports_binary   # Phiên đã gắn: server hiện tại chọn binary
+    assert wait_for(lambda: "alice" in server.clients)
+
+
+def test_login_then_chat(chat_server, chat_client):
+    server, port = chat_server
+    bob, _ = login(port, "bob")
+    assert chat_client.login("alice", f"127.0.0.1:{port}")[0]
+    assert chat_client.send_text_message("xin chào")
+    assert recv_until(bob, MessageType.TEXT)["message"] == "xin chào"
+    bob.close()
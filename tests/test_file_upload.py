@@ -0,0 +1,158 @@
+"""
+tests/test_file_upload.py - Upload theo channel trên event loop: ghi đĩa ở thread riêng, đúng thứ tự, báo lại qua reply_to
+"""
+
+import asyncio
+import threading
+
+from common.protocol import Protocol, MessageType
+from server.handlers.file_handler import FileHandler
+from tests.helpers import login, recv_until, wait_for
+
+
+class FakeServer:
+    def __init__(self, storage_dir):
+        self.storage_dir = storage_dir
+        self.broadcasts = []
+
+    def broadcast(self, msg_type, data):
+        self.broadcasts.append((msg_type, data))
+
+
+class Replies:
+    """Đứng thay cho phiên / kết nối nhận FILE_INFO, ERROR"""
+
+    def __init__(self):
+        self.messages = []
+        self.event = asyncio.Event()
+
+    def send_message(self, msg_type, data):
+        self.messages.append((msg_type, data))
+        self.event.set()
+
+
+def _upload(tmp_path, monkeypatch, chunks, filesize, fail_open=False):
+    handler = FileHandler(FakeServer(str(tmp_path)))
+    writer_threads = set()
+    write_file = FileHandler._write_file
+
+    def recording_write(upload, chunk):
+        writer_threads.add(threading.current_thread())
+        write_file(upload, chunk)
+    monkeypatch.setattr(FileHandler, "_write_file", staticmethod(recording_write))
+    if fail_open:
+        monkeypatch.setattr(FileHandler, "storage_path", lambda self, name: (name, str(tmp_path / "missing" / name)))
+
+    async def run():
+        replies, conn = Replies(), object()
+        handler.begin_channel_upload(conn, "alice", {"filename": "a.bin", "filesize": filesize, "channel": 3}, replies)
+        for chunk in chunks:
+            handler.handle_file_chunk(conn, "alice", {"channel": 3, "data": chunk})
+        await asyncio.wait_for(replies.event.wait(), 3)
+        return replies.messages, threading.current_thread()
+
+    messages, loop_thread = asyncio.run(run())
+    return handler, messages, loop_thread, writer_threads
+
+
+def test_channel_upload_writes_off_event_loop(tmp_path, monkeypatch):
+    chunks = [bytes([i]) * 1000 for i in range(20)]
+    handler, messages, loop_thread, writers = _upload(tmp_path, monkeypatch, chunks, 20000)
+    assert loop_thread not in writers and len(writers) == 1
+    [(msg_type, info)] = messages
+    assert msg_type == MessageType.FILE_INFO and info["original_filename"] == "a.bin"
+    assert (tmp_path / info["filename"]).read_bytes() == b"".join(chunks)
+    assert not handler.channel_uploads
+
+
+def test_channel_upload_reports_disk_error(tmp_path, monkeypatch):
+    handler, messages, _, _ = _upload(tmp_path, monkeypatch, [b"x" * 10], 10, fail_open=True)
+    [(msg_type, data)] = messages
+    assert msg_type == MessageType.ERROR and "Upload thất bại" in data["message"]
+    assert not handler.server.broadcasts
+
+
+def test_channel_upload_inline_without_event_loop(tmp_path):
+    handler = FileHandler(FakeServer(str(tmp_path)))
+    replies = []
+
+    class Target:
+        def send_message(self, msg_type, data):
+            replies.append((msg_type, data))
+
+    conn = object()
+    handler.begin_channel_upload(conn, "bob", {"filename": "b.txt", "filesize": 5, "channel": 1}, Target())
+    handler.handle_file_chunk(conn, "bob", {"channel": 1, "data": b"hello"})
+    assert handler._writer is None
+    [(msg_type, info)] = replies
+    assert (tmp_path / info["filename"]).read_bytes() == b"hello"
+
+
+def test_async_server_uploads(tmp_path, monkeypatch):
+    """AsyncTCPServer: upload kiểu cũ (raw bytes) và theo channel, FILE_INFO đi qua phiên resume"""
+    import server.tcp_server_async as tcp_server_async
+    from common.protocol import Protocol
+    from server.bridge import global_bridge
+
+    monkeypatch.setattr(tcp_server_async, "SERVER_STORAGE_DIR", str(tmp_path))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = tcp_server_async.AsyncTCPServer(host="127.0.0.1", port=0)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(3)
+    port = server.server.sockets[0].getsockname()[1]
+    try:
+        conn, _ = login(port, "carol")
+        conn.track_seq = True
+        channel = conn.open_channel()
+        Protocol.send_message(conn, MessageType.FILE_UPLOAD, {"filename": "c.bin", "filesize": 6, "channel": channel})
+        Protocol.send_message(conn, MessageType.FILE_CHUNK, {"channel": channel, "data": b"abc"})
+        Protocol.send_message(conn, MessageType.FILE_CHUNK, {"channel": channel, "data": b"def"})
+        info = recv_until(conn, MessageType.FILE_INFO)
+        assert (tmp_path / info["filename"]).read_bytes() == b"abcdef"
+        assert conn.recv_seq == global_bridge.tcp_clients["carol"].send_seq
+        conn.close()
+
+        legacy, _ = login(port, "dave", features=[])
+        Protocol.send_message(legacy, MessageType.FILE_UPLOAD, {"filename": "d.bin", "filesize": 5})
+        legacy.sendall(b"hello")
+        info = recv_until(legacy, MessageType.FILE_INFO)
+        assert (tmp_path / info["filename"]).read_bytes() == b"hello"
+        legacy.close()
+        assert wait_for(lambda: "dave" not in global_bridge.tcp_clients)
+    finally:
+        server.heartbeat.stop()
+        loop.call_soon_threadsafe(server.server.close)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_drain_waits_for_raw_upload(tmp_path, monkeypatch):
+    import server.tcp_server_async as tcp_server_async
+    from server.bridge import global_bridge
+    from server.drain import DrainController
+
+    class Bridge:
+        active_uploads = {}
+
+    monkeypatch.setattr(tcp_server_async, "SERVER_STORAGE_DIR", str(tmp_path))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = tcp_server_async.AsyncTCPServer(host="127.0.0.1", port=0)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(3)
+    drain = DrainController(Bridge(), server)
+    try:
+        conn, _ = login(server.server.sockets[0].getsockname()[1], "frank", features=[])
+        Protocol.send_message(conn, MessageType.FILE_UPLOAD, {"filename": "raw.bin", "filesize": 8})
+        conn.sock.sendall(b"abcd")
+        # Mới nhận nửa file: drain phải chờ
+        assert wait_for(lambda: server.raw_uploads)
+        assert not drain._uploads_done()
+        conn.sock.sendall(b"efgh")
+        info = recv_until(conn, MessageType.FILE_INFO)
+        assert (tmp_path / info["filename"]).read_bytes() == b"abcdefgh"
+        assert wait_for(drain._uploads_done)
+        conn.close()
+        assert wait_for(lambda: "frank" not in global_bridge.tcp_clients)
+    finally:
+        server.heartbeat.stop()
+        loop.call_soon_threadsafe(server.server.close)
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,149 @@
+"""
+tests/test_framing.py - FrameDecoder / FrameEncoder: tách frame từ mẩu bytes bất kỳ, binary frame, nén deflate
+"""
+
+from common.framing import FrameDecoder, FrameEncoder, RelayFrame
+from common.protocol import Protocol, MessageType
+
+
+def _compressed_pair(**decoder_options):
+    encoder = FrameEncoder(compressor=Protocol.new_compressor())
+    decoder = FrameDecoder(**decoder_options)
+    decoder.decompressor = Protocol.new_decompressor()
+    return encoder, decoder
+
+
+def test_frames_split_across_feeds():
+    encoder = FrameEncoder()
+    messages = [(MessageType.TEXT, {"message": f"tin {i}"}) for i in range(5)]
+    stream = encoder.encode_many(messages)
+    decoder = FrameDecoder()
+    frames = []
+    for i in range(0, len(stream), 7):
+        frames.extend(decoder.feed(stream[i:i + 7]))
+    assert frames == messages
+    assert decoder.pending == 0
+
+
+def test_large_frame_grows_and_shrinks_buffer():
+    decoder = FrameDecoder()
+    big = {"message": "x" * (3 * FrameDecoder.MAX_IDLE_SIZE)}
+    assert decoder.feed(Protocol.encode_message(MessageType.TEXT, big)) == [(MessageType.TEXT, big)]
+    assert decoder.capacity > FrameDecoder.MAX_IDLE_SIZE
+    decoder.feed(Protocol.encode_message(MessageType.TEXT, {"message": "nhỏ"}))
+    assert decoder.capacity == FrameDecoder.INITIAL_SIZE
+
+
+def test_binary_frame_and_cut_through():
+    frame = Protocol.encode_binary_message(MessageType.VIDEO_DATA, b"\xff\xd8jpeg", sender="alice", recipient="bob")
+    msg_type, data = FrameDecoder().feed(frame)[0]
+    assert msg_type == MessageType.VIDEO_DATA and bytes(data["data"]) == b"\xff\xd8jpeg"
+
+    decoder = FrameDecoder()
+    decoder.cut_through = True
+    msg_type, relay = decoder.feed(frame)[0]
+    assert isinstance(relay, RelayFrame)
+    assert (relay.sender, relay.recipient) == ("alice", "bob")
+    assert relay.frame() == frame
+    assert relay.stamp("mallory").sender == "mallory"
+    assert bytes(relay.payload) == b"\xff\xd8jpeg"
+
+
+def test_compressed_round_trip_in_order():
+    encoder, decoder = _compressed_pair()
+    messages = [(MessageType.TEXT, {"message": "lặp lại " * 200, "n": i}) for i in range(3)]
+    stream = b"".join(encoder.encode(*m) for m in messages)
+    assert any(word & Protocol.COMPRESSED_BIT for word in _words(stream))
+    assert decoder.feed(stream) == messages
+
+
+def test_corrupt_compressed_frame_is_an_error():
+    _, decoder = _compressed_pair()
+    body = b"\xff" * 32
+    word = Protocol.COMPRESSED_BIT | len(body)
+    [(msg_type, error)] = decoder.feed(word.to_bytes(4, "big") + body)
+    assert msg_type == MessageType.ERROR and error
+    assert decoder.broken
+
+    # Context giải nén đã lệch: frame nén hợp lệ sau đó cũng bị từ chối, frame không nén vẫn đọc được
+    valid = _compressed_pair()[0].encode(MessageType.TEXT, {"message": "b" * 2000})
+    assert decoder.feed(valid) == [(MessageType.ERROR, decoder.broken)]
+    assert decoder.feed(Protocol.encode_message(MessageType.TEXT, {"message": "ok"})) == [(MessageType.TEXT, {"message": "ok"})]
+
+
+def test_compressed_frame_without_deflate_is_an_error():
+    encoder, _ = _compressed_pair()
+    frame = encoder.encode(MessageType.TEXT, {"message": "a" * 2000})
+    [(msg_type, _)] = FrameDecoder().feed(frame)
+    assert msg_type == MessageType.ERROR
+
+
+def test_oversized_decompression_is_rejected():
+    encoder, decoder = _compressed_pair(max_decompressed=4096)
+    # 1MB chữ "a" nén lại chỉ còn vài KB
+    frame = encoder.encode(MessageType.TEXT, {"message": "a" * (1024 * 1024)})
+    assert len(frame) < 8192
+    [(msg_type, error)] = decoder.feed(frame)
+    assert msg_type == MessageType.ERROR and "4096" in error
+    assert decoder.broken
+
+    # Frame kế tiếp của cùng encoder không giải tiếp được (phần dở của frame trước đã bị bỏ)
+    next_frame = encoder.encode(MessageType.TEXT, {"message": "c" * 2000})
+    assert decoder.feed(next_frame) == [(MessageType.ERROR, decoder.broken)]
+
+
+def test_broken_decompressor_closes_connection():
+    """Connection.recv_message: context giải nén hỏng -> đóng kết nối, trả về như khi ngắt"""
+    import socket
+    from common.connection import Connection
+
+    left, right = socket.socketpair()
+    conn = Connection(left)
+    conn.bind_session({"features": ["deflate"]})
+    encoder = FrameEncoder(compressor=Protocol.new_compressor())
+    body = b"\xff" * 32
+    right.sendall((Protocol.COMPRESSED_BIT | len(body)).to_bytes(4, "big") + body)
+    right.sendall(encoder.encode(MessageType.TEXT, {"message": "d" * 2000}))
+    assert conn.recv_message() == (None, None)
+    assert right.recv(1) == b""
+    right.close()
+
+
+def test_garbage_json_is_an_error():
+    body = b"{not json"
+    [(msg_type, _)] = FrameDecoder().feed(len(body).to_bytes(4, "big") + body)
+    assert msg_type == MessageType.ERROR
+
+
+def _words(stream):
+    offset = 0
+    while offset < len(stream):
+        word = int.from_bytes(stream[offset:offset + 4], "big")
+        yield word
+        offset += 4 + (word & Protocol.LENGTH_MASK)
+
+
+def test_async_server_closes_on_broken_decompressor(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+    import server.tcp_server_async as tcp_server_async
+    from tests.helpers import login
+
+    monkeypatch.setattr(tcp_server_async, "SERVER_STORAGE_DIR", str(tmp_path))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = tcp_server_async.AsyncTCPServer(host="127.0.0.1", port=0)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(3)
+    try:
+        conn, _ = login(server.server.sockets[0].getsockname()[1], "erin")
+        assert "deflate" in conn.features
+        body = b"\xff" * 32
+        conn.sock.sendall((Protocol.COMPRESSED_BIT | len(body)).to_bytes(4, "big") + body)
+        # Server đóng kết nối: đọc tới EOF (không đóng thì recv hết giờ -> socket.timeout)
+        while conn.sock.recv(4096):
+            pass
+        conn.close()
+    finally:
+        server.heartbeat.stop()
+        loop.call_soon_threadsafe(server.server.close)
+        loop.call_soon_threadsafe(loop.stop)
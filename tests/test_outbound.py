@@ -0,0 +1,83 @@
+"""
+tests/test_outbound.py - MediaLanes / OutboundQueue: hộp thư video, FIFO audio, thứ tự lô gửi, nén + bỏ frame
+"""
+
+from common.framing import FrameDecoder, FrameEncoder, EncodedMessage
+from common.outbound import MediaLanes, OutboundQueue
+from common.protocol import Protocol, MessageType
+
+
+def test_video_lane_keeps_newest_frame():
+    lanes = MediaLanes()
+    assert lanes.put(b"v1", MessageType.VIDEO_DATA, "alice") is None
+    assert lanes.put(b"v22", MessageType.VIDEO_DATA, "alice") == b"v1"
+    assert lanes.put(b"v333", MessageType.VIDEO_DATA, "bob") == b"v22"
+    assert len(lanes) == 1 and lanes.nbytes == 4
+    assert lanes.dropped == 2
+    assert lanes.take_dropped("alice") == (2, 0)
+    assert lanes.take_dropped("alice") == (0, 0)
+    assert lanes.take() == [b"v333"]
+    assert len(lanes) == 0 and lanes.nbytes == 0
+
+
+def test_audio_lane_drops_oldest_and_goes_first():
+    lanes = MediaLanes(audio_limit=2)
+    lanes.put(b"v", MessageType.VIDEO_DATA, "alice")
+    for chunk in (b"a1", b"a2", b"a3"):
+        lanes.put(chunk, MessageType.AUDIO_DATA, "bob")
+    assert lanes.take_dropped("bob") == (0, 1)
+    assert lanes.pop() == b"a2"
+    assert lanes.take() == [b"a3", b"v"]
+
+
+def test_batch_order_control_media_then_channels():
+    queue = OutboundQueue(max_delay=0)
+    queue.put(b"c1" * 50, channel=1)
+    queue.put(b"c1" * 50, channel=1)
+    queue.put(b"c2" * 50, channel=2)
+    queue.put(b"v-old", media=MessageType.VIDEO_DATA, sender="alice")
+    queue.put(b"v-new", media=MessageType.VIDEO_DATA, sender="alice")
+    queue.put(b"chat")
+    assert len(queue) == 5
+    batch = queue.take_batch()
+    assert batch == [b"chat", b"v-new", b"c1" * 50, b"c2" * 50, b"c1" * 50]
+    assert queue.stats()["media_dropped"] == 1 and queue.queued_bytes == 0
+    assert queue.take_media_dropped("alice") == (1, 0)
+
+
+def test_control_overflow_without_blocking():
+    queue = OutboundQueue(control_limit=10)
+    assert queue.put(b"x" * 10)
+    assert not queue.put(b"y", block=False)
+    assert queue.overflowed
+
+
+def _lossy_session(binary):
+    """Encoder/decoder có nén của 1 phiên + hàng đợi bỏ bớt video (hộp thư 1 chỗ)"""
+    encoder = FrameEncoder(binary=binary, compressor=Protocol.new_compressor())
+    decoder = FrameDecoder()
+    decoder.decompressor = Protocol.new_decompressor()
+    return encoder, decoder, OutboundQueue(max_delay=0)
+
+
+def test_dropped_media_does_not_break_compression():
+    # Client không hiểu binary frame -> media đi bằng JSON + Base64, đủ lớn để vượt ngưỡng nén
+    for binary in (False, True):
+        encoder, decoder, queue = _lossy_session(binary)
+        text = "xin chào " * 200
+        for i in range(5):
+            for n in range(3):
+                video = {"sender": "alice", "recipient": "bob", "data": bytes([i, n]) * 1000}
+                if n % 2:
+                    frame = EncodedMessage(MessageType.VIDEO_DATA, video).frame_for(encoder)
+                else:
+                    frame = encoder.encode(MessageType.VIDEO_DATA, video)
+                queue.put(frame, media=MessageType.VIDEO_DATA, sender="alice")
+            queue.put(encoder.encode(MessageType.TEXT, {"sender": "alice", "message": f"{i} {text}"}))
+        assert queue.media_dropped == 14
+
+        frames = decoder.feed(b"".join(queue.take_batch()))
+        texts = [data["message"] for msg_type, data in frames if msg_type == MessageType.TEXT]
+        assert texts == [f"{i} {text}" for i in range(5)]
+        assert [msg_type for msg_type, _ in frames].count(MessageType.VIDEO_DATA) == 1
+        assert MessageType.ERROR not in [msg_type for msg_type, _ in frames]
@@ -0,0 +1,91 @@
+"""
+tests/test_resume.py - Đếm seq / ack của phiên resume khi có upload file (TCPServer + feature "resume")
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from common.protocol import Protocol, MessageType
+from server.bridge import global_bridge
+from tests.helpers import login, recv_until, wait_for
+
+
+@pytest.fixture
+def tcp_server(tmp_path, monkeypatch):
+    """TCPServer (1 thread / client) trên cổng ngẫu nhiên. Returns: (server, port)"""
+    import server.tcp_server_thread as tcp_server_thread
+    monkeypatch.setattr(tcp_server_thread, "SERVER_STORAGE_DIR", str(tmp_path))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = tcp_server_thread.TCPServer(loop)
+    server.host, server.port = "127.0.0.1", 0
+    server.daemon = True
+    server.start()
+    assert wait_for(lambda: server.server_socket is not None and server.server_socket.getsockname()[1])
+    yield server, server.server_socket.getsockname()[1]
+    server.running = False
+    server.heartbeat.stop()
+    try: server.server_socket.close()
+    except OSError: pass
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def _resumable_login(port, username):
+    conn, reply = login(port, username)
+    assert "resume" in conn.features
+    conn.track_seq = True
+    return conn, reply
+
+
+def test_upload_replies_are_sequenced(tcp_server):
+    server, port = tcp_server
+    conn, reply = _resumable_login(port, "alice")
+    channel = conn.open_channel()
+    Protocol.send_message(conn, MessageType.FILE_UPLOAD,
+                          {"filename": "a.txt", "filesize": 5, "recipient": None, "channel": channel})
+    Protocol.send_message(conn, MessageType.FILE_CHUNK, {"channel": channel, "data": b"hello"})
+    info = recv_until(conn, MessageType.FILE_INFO)
+    assert info["filename"].endswith("a.txt")
+
+    # Mọi frame có thứ tự client đã nhận đều đi qua phiên -> seq hai bên khớp
+    session = global_bridge.tcp_clients["alice"]
+    assert conn.recv_seq == session.send_seq
+
+    # Rớt mạng rồi resume từ seq đã nhận: server chấp nhận, không phải đăng nhập lại
+    last_seq = conn.recv_seq
+    conn.close()
+    assert wait_for(lambda: not session.attached)
+    again, reply = login(port, "alice", resume={"session_id": reply["session_id"], "last_seq": last_seq})
+    assert reply["resumed"] is True
+    again.close()
+
+
+def test_download_error_is_sequenced(tcp_server):
+    server, port = tcp_server
+    conn, reply = _resumable_login(port, "bob")
+    Protocol.send_message(conn, MessageType.FILE_DOWNLOAD, {"filename": "missing.bin"})
+    recv_until(conn, MessageType.ERROR)
+
+    assert conn.recv_seq == global_bridge.tcp_clients["bob"].send_seq
+    conn.close()
+
+
+def test_bad_resume_falls_back_to_fresh_login(tcp_server):
+    server, port = tcp_server
+    conn, reply = _resumable_login(port, "carol")
+    session_id = reply["session_id"]
+    assert wait_for(lambda: "carol" in global_bridge.tcp_clients)
+    session = global_bridge.tcp_clients["carol"]
+    conn.close()
+    assert wait_for(lambda: not session.attached)
+
+    # session_id không hash được / last_seq sai kiểu hoặc âm: đăng nhập mới thay vì làm hỏng LOGIN
+    for resume in ({"session_id": [session_id], "last_seq": 0},
+                   {"session_id": session_id, "last_seq": "3"},
+                   {"session_id": session_id, "last_seq": -1}):
+        again, reply = login(port, "carol", resume=resume)
+        assert not reply.get("resumed")
+        assert reply["session_id"] != session_id
+        again.close()
@@ -0,0 +1,98 @@
+"""
+tests/test_rooms_cluster.py - Room khi chạy cluster: 2 worker (2 BridgeManager + ClusterBus qua Unix socket)
+"""
+
+import asyncio
+import shutil
+import tempfile
+
+from common.protocol import MessageType
+from server.bridge import BridgeManager
+from server.cluster import ClusterBus
+
+
+class Handle:
+    """Đứng thay cho kết nối của 1 user: ghi lại mọi message nhận được"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, msg_type, data):
+        self.messages.append((msg_type, data))
+
+    def send_encoded(self, encoded):
+        self.messages.append((encoded.msg_type, encoded.data))
+
+    def last(self):
+        return self.messages[-1]
+
+
+async def _until(condition, timeout=3.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+async def _cluster(bus_dir):
+    workers = []
+    for worker_id in range(2):
+        bridge = BridgeManager()
+        bridge.bus = ClusterBus(worker_id, 2, bus_dir, bridge)
+        await bridge.bus.start()
+        workers.append(bridge)
+    return workers
+
+
+def test_rooms_span_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bus_dir = tempfile.mkdtemp(prefix="rooms-bus-")
+
+    async def run():
+        w0, w1 = await _cluster(bus_dir)
+        alice, bob, carol = Handle(), Handle(), Handle()
+        try:
+            await w0.handle_room(MessageType.ROOM_CREATE, {"room": "r"}, "alice", alice)
+            assert alice.last()[0] == MessageType.ROOM_CREATE
+            assert await _until(lambda: w1.bus.room_members("r") == {"alice": 0})
+
+            # Room tạo ở worker 0: worker 1 không được tạo trùng, vào được và thấy đủ thành viên
+            await w1.handle_room(MessageType.ROOM_CREATE, {"room": "r"}, "carol", carol)
+            assert carol.last() == (MessageType.ERROR, {"message": "Room r đã tồn tại"})
+            await w1.handle_room(MessageType.ROOM_JOIN, {"room": "r"}, "bob", bob)
+            msg_type, reply = bob.last()
+            assert msg_type == MessageType.ROOM_JOIN and reply["members"] == ["alice", "bob"]
+            assert await _until(lambda: alice.last() == (
+                MessageType.ROOM_JOIN, {"type": MessageType.ROOM_JOIN, "room": "r", "username": "bob"}))
+
+            # Chat trong room tới được thành viên ở worker kia
+            await w0.room_broadcast("r", {"type": "TEXT", "room": "r", "message": "chào"}, sender="alice")
+            assert await _until(lambda: bob.last()[1].get("message") == "chào")
+
+            # Rời room / worker mới lên nhận lại danh sách thành viên
+            await w1.handle_room(MessageType.ROOM_LEAVE, {"room": "r"}, "bob", bob)
+            assert await _until(lambda: alice.last()[0] == MessageType.ROOM_LEAVE)
+            assert await _until(lambda: "bob" not in w0.bus.room_members("r"))
+            await w1.handle_room(MessageType.ROOM_LEAVE, {"room": "r"}, "carol", carol)
+            assert carol.last()[0] == MessageType.ERROR
+
+            # Worker mới lên (hello): các worker khác gửi lại thành viên room của mình
+            await w1.handle_room(MessageType.ROOM_JOIN, {"room": "r"}, "bob", bob)
+            assert await _until(lambda: w0.bus.room_members("r") == {"bob": 1})
+            w0.bus.remote_rooms.clear()
+            w0.bus.publish("hello")
+            assert await _until(lambda: w0.bus.room_members("r") == {"bob": 1})
+
+            # Worker chết: thành viên của nó rời room
+            await w0.bus._drop_worker(1)
+            assert w0.bus.room_members("r") == {}
+            assert alice.last() == (MessageType.ROOM_LEAVE, {"type": MessageType.ROOM_LEAVE, "room": "r", "username": "bob"})
+        finally:
+            for bridge in (w0, w1):
+                await bridge.bus.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        shutil.rmtree(bus_dir, ignore_errors=True)
@@ -0,0 +1,98 @@
+"""
+tests/test_tiles.py - TileEncoder -> TileCompositor: keyframe, delta, frame tĩnh, frame bị bỏ trên đường đi
+"""
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from client.tiles import TileEncoder, TileCompositor, DELTA_MAGIC, has_tile_marker, keyframe_id
+
+
+def _frame(seed=0, shape=(240, 320, 3)):
+    rng = np.random.default_rng(seed)
+    return cv2.GaussianBlur(rng.integers(0, 255, shape, dtype=np.uint8), (9, 9), 3)
+
+
+def _paint(frame, y, x, value):
+    out = frame.copy()
+    out[y:y + 20, x:x + 20] = value
+    return out
+
+
+def _error(a, b):
+    return float(np.abs(a.astype(int) - b.astype(int)).mean())
+
+
+def _pair():
+    encoder = TileEncoder(keyframe_interval=3600)
+    encoder.peer_tiles = True
+    return encoder, TileCompositor(request_interval=0)
+
+
+def test_round_trip_keyframe_delta_and_static():
+    encoder, compositor = _pair()
+    base = _frame()
+    key = encoder.encode(base, 80)
+    assert has_tile_marker(key) and keyframe_id(key) == encoder.keyframe_id
+    assert _error(compositor.apply(key), base) < 3
+
+    # Không đổi gì -> không gửi
+    assert encoder.encode(base.copy(), 80) is None
+
+    frame = base
+    for i, (y, x) in enumerate([(10, 10), (100, 200), (220, 300)]):
+        frame = _paint(frame, y, x, 40 * i)
+        delta = encoder.encode(frame, 80)
+        assert delta[:len(DELTA_MAGIC)] == DELTA_MAGIC
+        assert _error(compositor.apply(delta), frame) < 3
+    assert encoder.deltas == 3 and encoder.skipped == 1
+    assert not compositor.take_keyframe_request()
+
+
+def test_dropped_delta_requests_keyframe():
+    encoder, compositor = _pair()
+    base = _frame()
+    compositor.apply(encoder.encode(base, 80))
+
+    lost = _paint(base, 10, 10, 255)
+    encoder.encode(lost, 80)                 # Bị hộp thư video bỏ, không tới người nhận
+    later = _paint(lost, 100, 200, 0)
+    assert compositor.apply(encoder.encode(later, 80)) is None
+    assert compositor.gaps == 1
+    assert compositor.take_keyframe_request()
+
+    # Peer nhận CALL_KEYFRAME -> frame kế tiếp gửi nguyên, hình khớp lại cả ô đã lỡ
+    encoder.force_keyframe()
+    key = encoder.encode(later, 80)
+    assert key[:len(DELTA_MAGIC)] != DELTA_MAGIC
+    assert _error(compositor.apply(key), later) < 3
+    assert not compositor.take_keyframe_request()
+    again = _paint(later, 200, 50, 255)
+    assert _error(compositor.apply(encoder.encode(again, 80)), again) < 3
+
+
+def test_replaced_first_keyframe_requests_keyframe():
+    encoder, compositor = _pair()
+    base = _frame()
+    encoder.encode(base, 80)                 # Keyframe đầu tiên bị frame mới thay
+    frame = _paint(base, 50, 50, 0)
+    assert compositor.apply(encoder.encode(frame, 80)) is None
+    assert compositor.take_keyframe_request()
+    # Xin tối đa 1 lần mỗi request_interval
+    compositor.request_interval = 60
+    compositor.take_keyframe_request()
+    assert not compositor.take_keyframe_request()
+
+
+def test_delta_from_older_keyframe_is_ignored():
+    encoder, compositor = _pair()
+    base = _frame()
+    compositor.apply(encoder.encode(base, 80))
+    encoder.force_keyframe()
+    encoder.encode(_frame(1), 80)            # Keyframe mới bị bỏ
+    stale = encoder.encode(_paint(_frame(1), 0, 0, 0), 80)
+    assert stale[:len(DELTA_MAGIC)] == DELTA_MAGIC
+    assert compositor.apply(stale) is None
+    assert compositor.take_keyframe_request()